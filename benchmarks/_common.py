@@ -0,0 +1,69 @@
+"""Shared setup for the benchmark scripts.
+
+Every benchmark runs against a throw-away testing.postgresql instance with
+a fresh schema, the same way tests/conftest.py does.
+"""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import testing.postgresql
+
+from project import create_app, db
+from project.models import User, UsersGroup
+
+
+@contextmanager
+def bench_app(**config):
+    """Yield an app bound to a temporary Postgres with an empty schema."""
+    with testing.postgresql.Postgresql() as postgresql:
+        cfg = {
+            'SECRET_KEY': 'benchmark',
+            'WTF_CSRF_ENABLED': False,
+            'SQLALCHEMY_DATABASE_URI': postgresql.url(),
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+            # the benchmarks hammer the auth endpoints from one address on purpose
+            'RATELIMIT_ENABLED': False,
+        }
+        cfg.update(config)
+        fd, cfg_path = tempfile.mkstemp(suffix='.cfg')
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(f'{key} = {value!r}\n' for key, value in cfg.items())
+        try:
+            app = create_app(cfg_path)
+        finally:
+            os.remove(cfg_path)
+
+        with app.app_context():
+            db.create_all()
+            db.session.add(UsersGroup(group_id=2, group_name='users'))
+            db.session.commit()
+            yield app
+            db.session.remove()
+            db.drop_all()
+
+
+def add_user(email='bench@example.com', password='Password1!'):
+    user = User(first_name='Bench', last_name='User', email=email, phone='+442083661177', password=password)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@contextmanager
+def timer(label, count=None):
+    """Print the wall time of the block (and the per-item rate if `count` is given)."""
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    rate = f', {count / elapsed:,.0f}/s' if count else ''
+    print(f'{label:<40} {elapsed * 1000:10.1f} ms{rate}')
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
@@ -0,0 +1,94 @@
+"""A minimal local SMTP server that accepts and counts every message.
+
+    with SMTPStub(delay=0.01) as smtp:
+        app.config.update(MAIL_SERVER='localhost', MAIL_PORT=smtp.port)
+        ...
+        print(smtp.messages, smtp.connections, smtp.subjects)
+
+smtp.reject = 2 answers the next two messages with a temporary failure
+(451), as a server that is overloaded; the connection stays usable.
+"""
+import socketserver
+import threading
+import time
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        stub = self.server.stub
+        stub.count('connections')
+        self.reply('220 localhost SMTP stub')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                subject = None
+                while True:
+                    data = self.rfile.readline()
+                    if data in (b'.\r\n', b'.\n', b''):
+                        break
+                    if subject is None and data.startswith(b'Subject: '):
+                        subject = data[len(b'Subject: '):].decode('ascii', 'replace').strip()
+                if stub.delay:
+                    time.sleep(stub.delay)
+                if stub.take_rejection():
+                    self.reply('451 try again later')
+                    continue
+                stub.received(subject)
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                # MAIL FROM, RCPT TO, RSET, NOOP
+                self.reply('250 OK')
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPStub:
+    def __init__(self, host='localhost', port=0, delay=0.0):
+        self.delay = delay
+        self.messages = 0
+        self.connections = 0
+        self.subjects = []
+        self.reject = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.stub = self
+        self.port = self._server.server_address[1]
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def received(self, subject):
+        with self._lock:
+            self.messages += 1
+            self.subjects.append(subject)
+
+    def take_rejection(self) -> bool:
+        with self._lock:
+            if self.reject <= 0:
+                return False
+            self.reject -= 1
+            return True
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,130 @@
+"""Replay a season of synthetic bookings through the shelf assignment strategies.
+
+Bookings arrive one by one, some days before they start. Every strategy
+places them on the same shelves and rejects what it can't place; with
+--reoptimize a rejected booking triggers a recoloring of the bookings that
+have not started yet, and is accepted if the recoloring finds it room.
+Runs in memory, no database needed.
+
+    python -m benchmarks.allocation_sim --shelves 200 --days 120 --load 1.1
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from project.allocation import color_intervals
+from project.availability import ShelfSpans
+
+SEASON_START = date(2022, 6, 1)
+
+
+def synthetic_bookings(shelves, days, load):
+    """(arrival, start, stop) tuples asking for about `load` times the shelf-days of the season."""
+    bookings, demand = [], 0
+    while demand < shelves * days * load:
+        duration = random.choice((random.randint(2, 7), random.randint(7, 30), random.randint(30, 60)))
+        start = random.randint(0, days - duration)
+        arrival = max(0, start - random.randint(0, 45))
+        bookings.append((arrival, SEASON_START + timedelta(days=start),
+                         SEASON_START + timedelta(days=start + duration - 1)))
+        demand += duration
+    bookings.sort(key=lambda b: b[0])
+    return bookings
+
+
+def first_fit(spans, start, stop):
+    for shelf_id, shelf in spans.items():
+        if shelf.is_free(start, stop):
+            return shelf_id
+    return None
+
+
+def best_fit(spans, start, stop):
+    ranked = [(shelf.slack(start, stop), shelf_id) for shelf_id, shelf in spans.items()]
+    ranked = [entry for entry in ranked if entry[0] is not None]
+    return min(ranked)[1] if ranked else None
+
+
+def reoptimize(spans, placed, order_id, start, stop, today):
+    """Recolor the bookings starting after today together with the new one; True if it fits."""
+    free_from = dict.fromkeys(spans, today)
+    movable = [(order_id, start, stop)]
+    for other_id, (shelf_id, other_start, other_stop) in placed.items():
+        if other_start > today:
+            movable.append((other_id, other_start, other_stop))
+        else:
+            free_from[shelf_id] = max(free_from[shelf_id], other_stop + timedelta(days=1))
+    current = {other_id: placed[other_id][0] for other_id, _, _ in movable[1:]}
+    assigned, unplaced = color_intervals(free_from, movable, current)
+    if unplaced:
+        return False
+
+    for other_id, other_start, _ in movable[1:]:
+        spans[placed[other_id][0]].remove(other_id, other_start)
+    for other_id, other_start, other_stop in movable:
+        spans[assigned[other_id]].add(other_id, other_start, other_stop)
+        placed[other_id] = (assigned[other_id], other_start, other_stop)
+    return True
+
+
+def simulate(bookings, shelves, pick, reopt=False):
+    spans = {shelf_id: ShelfSpans() for shelf_id in range(1, shelves + 1)}
+    placed, rejected, reoptimized = {}, 0, 0
+    solve_time = reopt_time = 0.0
+    for order_id, (arrival, start, stop) in enumerate(bookings):
+        started = time.perf_counter()
+        shelf_id = pick(spans, start, stop)
+        solve_time += time.perf_counter() - started
+        if shelf_id is not None:
+            spans[shelf_id].add(order_id, start, stop)
+            placed[order_id] = (shelf_id, start, stop)
+            continue
+        if reopt:
+            started = time.perf_counter()
+            fitted = reoptimize(spans, placed, order_id, start, stop, SEASON_START + timedelta(days=arrival))
+            reopt_time += time.perf_counter() - started
+            if fitted:
+                reoptimized += 1
+                continue
+        rejected += 1
+
+    booked_days = sum((stop - start).days + 1 for _, start, stop in placed.values())
+    return {
+        'accepted': len(placed),
+        'rejected': rejected,
+        'reoptimized': reoptimized,
+        'booked_days': booked_days,
+        'solve_ms': solve_time * 1000,
+        'reopt_ms': reopt_time * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shelves', type=int, default=200)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--load', type=float, default=1.1, help='requested shelf-days / season capacity')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    bookings = synthetic_bookings(args.shelves, args.days, args.load)
+    capacity = args.shelves * args.days
+    print(f'{len(bookings)} bookings on {args.shelves} shelves over {args.days} days')
+
+    runs = (
+        ('first-fit', first_fit, False),
+        ('best-fit', best_fit, False),
+        ('best-fit + reoptimization', best_fit, True),
+    )
+    for label, pick, reopt in runs:
+        result = simulate(bookings, args.shelves, pick, reopt)
+        print(f'{label:<28} {result["accepted"]:6} accepted {result["rejected"]:6} rejected '
+              f'{result["booked_days"] / capacity:7.1%} utilization '
+              f'{result["solve_ms"]:8.1f} ms placing {result["reopt_ms"]:8.1f} ms recoloring '
+              f'({result["reoptimized"]} saved)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Bytes and requests per page view, with and without the fingerprinted assets.
+
+A page view fetches the HTML and every /static URL it references, the way a
+browser with a 960px viewport would: WebP from a <picture> when offered,
+br/gzip accepted. The repeat view replays it with a browser cache: fresh
+(immutable) responses are not requested at all, the others are revalidated
+with If-None-Match / If-Modified-Since.
+
+    plain          static files served by Flask as they are
+    fingerprinted  after `flask build-assets`: hashed names, precompressed, immutable
+
+    python -m benchmarks.assets_bench
+
+static/dist is built for the run and removed afterwards unless it was there before.
+"""
+import os
+import re
+import shutil
+import tempfile
+
+from project import create_app
+from project.assets import DIST, build_assets
+
+PAGES = ('/index', '/login', '/no-such-page')
+VIEWPORT = 960
+ACCEPT_ENCODING = 'br, gzip'
+
+PICTURE = re.compile(r'<picture>(.*?)</picture>', re.S)
+SRCSET = re.compile(r'srcset="([^"]+)"')
+STATIC_URL = re.compile(r'(?:href|src)="(/static/[^"]+)"')
+
+
+def _pick(srcset):
+    """The candidate a browser of VIEWPORT width takes: the narrowest one at least as wide, or the widest."""
+    candidates = sorted((int(width.rstrip('w')), url)
+                        for url, width in (candidate.split() for candidate in srcset.split(',')))
+    return next((url for width, url in candidates if width >= VIEWPORT), candidates[-1][1])
+
+
+def static_urls(html):
+    urls = []
+    for picture in PICTURE.findall(html):
+        srcset = SRCSET.search(picture)
+        urls.extend([_pick(srcset.group(1))] if srcset else STATIC_URL.findall(picture))
+    urls.extend(STATIC_URL.findall(PICTURE.sub('', html)))
+    return list(dict.fromkeys(urls))
+
+
+def page_view(client, page, cache):
+    """(requests, bytes) of one view of the page; `cache` holds the responses of the earlier views."""
+    response = client.get(page)
+    requests, transferred = 1, len(response.data)
+    for url in static_urls(response.get_data(as_text=True)):
+        cached = cache.get(url)
+        if cached is not None and cached.cache_control.immutable:
+            continue
+        headers = {'Accept-Encoding': ACCEPT_ENCODING}
+        if cached is not None:
+            if cached.headers.get('ETag'):
+                headers['If-None-Match'] = cached.headers['ETag']
+            if cached.headers.get('Last-Modified'):
+                headers['If-Modified-Since'] = cached.headers['Last-Modified']
+        asset = client.get(url, headers=headers)
+        assert asset.status_code in (200, 304), f'{url}: {asset.status_code}'
+        requests += 1
+        transferred += len(asset.data)
+        if asset.status_code == 200:
+            cache[url] = asset
+    return requests, transferred
+
+
+def measure(cfg_path, **config):
+    app = create_app(cfg_path, **config)
+    client = app.test_client()
+    cache = {}
+    first = [page_view(client, page, cache) for page in PAGES]
+    repeat = [page_view(client, page, cache) for page in PAGES]
+    return [tuple(map(sum, zip(*views))) for views in (first, repeat)]
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    cfg_path = os.path.join(workdir, 'bench.cfg')
+    with open(cfg_path, 'w') as f:
+        # the pages measured don't touch the DB, nothing listens there
+        f.write("SECRET_KEY = 'benchmark'\n"
+                "SQLALCHEMY_DATABASE_URI = 'postgresql://localhost:1/unused'\n"
+                "SQLALCHEMY_TRACK_MODIFICATIONS = False\n"
+                "MAIL_OUTBOX_WORKER = False\n"
+                "EXPIRY_SWEEPER_WORKER = False\n"
+                "TEMPLATE_BYTECODE_CACHE = None\n")
+    static_folder = create_app(cfg_path, ASSETS_MANIFEST=None).static_folder
+    dist = os.path.join(static_folder, DIST)
+    built_here = not os.path.exists(dist)
+    try:
+        plain = measure(cfg_path, ASSETS_MANIFEST=None)
+        manifest = build_assets(static_folder)
+        fingerprinted = measure(cfg_path)
+        webp = sum(len(entry.get('webp', {})) for entry in manifest.values())
+        print(f'{len(manifest)} assets, {webp} WebP variants; {len(PAGES)} pages: {", ".join(PAGES)}')
+        print(f'{"variant":<14} {"1st requests":>13} {"1st KB":>9} {"repeat requests":>16} {"repeat KB":>10}')
+        for name, ((requests, transferred), (repeat_requests, repeat_transferred)) in \
+                (('plain', plain), ('fingerprinted', fingerprinted)):
+            print(f'{name:<14} {requests:13d} {transferred / 1024:9.1f} '
+                  f'{repeat_requests:16d} {repeat_transferred / 1024:10.1f}')
+    finally:
+        if built_here:
+            shutil.rmtree(dist, ignore_errors=True)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
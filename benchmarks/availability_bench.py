@@ -0,0 +1,85 @@
+"""Shelf availability: interval index vs naive per-shelf SQL scan.
+
+    python -m benchmarks.availability_bench --orders 100000
+"""
+import argparse
+import random
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from benchmarks._common import add_user, bench_app, timer
+from project import db
+from project.availability import availability
+from project.models import Size, StorageOrder, Warehouse
+
+SEASON_START = date(2022, 10, 1)
+
+
+def seed(shelves, orders, sizes=4):
+    db.session.bulk_insert_mappings(Size, [{'size_id': i, 'size_name': 13 + i} for i in range(1, sizes + 1)])
+    db.session.bulk_insert_mappings(Warehouse, [
+        {'shelf_id': i, 'active': True, 'size_id': i % sizes + 1} for i in range(1, shelves + 1)
+    ])
+    user_id = add_user().user_id
+
+    rows, per_shelf = [], orders // shelves
+    for shelf_id in range(1, shelves + 1):
+        day = SEASON_START - timedelta(days=random.randint(0, 30))
+        for _ in range(per_shelf):
+            day += timedelta(days=random.randint(0, 10))
+            stop = day + timedelta(days=random.randint(14, 60))
+            rows.append({'start_date': day, 'stop_date': stop, 'storage_order_cost': 100,
+                         'created': datetime.now(), 'user_id': user_id, 'shelf_id': shelf_id})
+            day = stop + timedelta(days=1)
+    db.session.bulk_insert_mappings(StorageOrder, rows)
+    db.session.commit()
+    return len(rows)
+
+
+def naive_free_shelves(size_id, start_date, stop_date, limit):
+    found = []
+    shelves = db.session.execute(text('SELECT shelf_id FROM warehouse WHERE size_id = :size AND active '
+                                      'ORDER BY shelf_id'), {'size': size_id}).scalars()
+    for shelf_id in shelves:
+        busy = db.session.execute(text('SELECT count(*) FROM storage_orders WHERE shelf_id = :shelf '
+                                       'AND start_date <= :stop AND stop_date >= :start'),
+                                  {'shelf': shelf_id, 'start': start_date, 'stop': stop_date}).scalar()
+        if not busy:
+            found.append(shelf_id)
+            if len(found) >= limit:
+                break
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--shelves', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(42)
+    with bench_app():
+        with timer('seed'):
+            total = seed(args.shelves, args.orders)
+        print(f'{total} orders on {args.shelves} shelves')
+
+        queries = []
+        for _ in range(args.queries):
+            start = SEASON_START + timedelta(days=random.randint(0, 365))
+            queries.append((random.randint(1, 4), start, start + timedelta(days=random.randint(14, 180))))
+
+        with timer('index build'):
+            availability.load()
+        with timer('interval index', args.queries):
+            indexed = [availability.free_shelves(*q, limit=args.limit) for q in queries]
+        with timer('naive SQL scan', args.queries):
+            naive = [naive_free_shelves(*q, limit=args.limit) for q in queries]
+
+        assert indexed == naive, 'index and SQL scan disagree'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Email lookups on a large users table, with an EXPLAIN check of the plan.
+
+    python -m benchmarks.email_lookup_bench --users 1000000
+"""
+import argparse
+import random
+
+from sqlalchemy import text
+
+from benchmarks._common import add_user, bench_app, timer
+from project import db
+from project.models import User
+
+
+def seed(users):
+    template = add_user()
+    db.session.execute(text("""
+        INSERT INTO users (first_name, last_name, email, phone, active, password, salt, created, group_id)
+        SELECT 'First', 'Last', 'User' || n || '@Example.com', phone, true, password, salt, now(), group_id
+          FROM generate_series(1, :users) AS n, users WHERE users.user_id = :template
+    """), {'users': users, 'template': template.user_id})
+    db.session.commit()
+    db.session.execute(text('ANALYZE users'))
+
+
+def explain(query):
+    compiled = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    return '\n'.join(db.session.execute(text(f'EXPLAIN {compiled}')).scalars())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    with bench_app() as app:
+        with timer(f'seed {args.users} users'):
+            seed(args.users)
+
+        plan = explain(User.query.filter(User.email_normalized == User.normalize_email(' user42@example.COM ')))
+        print(plan)
+        assert 'ix_users_email_normalized' in plan, 'normalized lookup does not use the index'
+
+        emails = [f'  USER{random.randint(1, args.users)}@example.com ' for _ in range(args.lookups)]
+        with app.test_request_context():
+            with timer('User.by_email', args.lookups):
+                found = sum(User.by_email(email) is not None for email in emails)
+        assert found == args.lookups
+
+        samples = emails[:max(1, args.lookups // 100)]
+        with timer('filter_by(email=...) (old, seq scan)', len(samples)):
+            for email in samples:
+                User.query.filter_by(email=email.strip()).first()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Closing out expired orders: per-row ORM writes vs the chunked bulk sweeper.
+
+    python -m benchmarks.expiry_bench --orders 100000 --chunk 5000
+"""
+import argparse
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from benchmarks._common import add_user, bench_app, timer
+from project import db
+from project.expiry import expiry
+from project.models import Size, StorageOrder, Warehouse
+
+
+def seed(shelves, orders):
+    db.session.bulk_insert_mappings(Size, [{'size_id': 1, 'size_name': 14}])
+    db.session.bulk_insert_mappings(Warehouse, [
+        {'shelf_id': i, 'active': True, 'size_id': 1} for i in range(1, shelves + 1)
+    ])
+    user_id = add_user().user_id
+
+    # back-to-back 3-day orders, all of them over before today
+    rows, per_shelf = [], orders // shelves
+    first = date.today() - timedelta(days=4 * per_shelf + 1)
+    for shelf_id in range(1, shelves + 1):
+        for i in range(per_shelf):
+            start = first + timedelta(days=4 * i)
+            rows.append({'start_date': start, 'stop_date': start + timedelta(days=2), 'storage_order_cost': 100,
+                         'created': datetime.now(), 'user_id': user_id, 'shelf_id': shelf_id})
+    db.session.bulk_insert_mappings(StorageOrder, rows)
+    db.session.commit()
+    return len(rows)
+
+
+def orm_sweep():
+    orders = StorageOrder.query \
+        .filter(StorageOrder.completed.is_(None), StorageOrder.stop_date < date.today()) \
+        .all()
+    for order in orders:
+        order.completed = datetime.now()
+    db.session.commit()
+    return len(orders)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--shelves', type=int, default=1000)
+    parser.add_argument('--chunk', type=int, default=5000)
+    args = parser.parse_args()
+
+    with bench_app(EXPIRY_SWEEPER_WORKER=False, EXPIRY_SWEEP_CHUNK=args.chunk):
+        with timer('seed'):
+            total = seed(args.shelves, args.orders)
+        print(f'{total} expired orders on {args.shelves} shelves')
+
+        with timer('ORM: load and update every order', total):
+            assert orm_sweep() == total
+
+        db.session.execute(text('UPDATE storage_orders SET completed = NULL'))
+        db.session.commit()
+        with timer(f'sweeper: bulk UPDATE, {args.chunk} per chunk', total):
+            assert expiry.sweep() == total
+        print(f'{"":<40} {expiry.stats()["last_rate"]:,.0f} rows/s reported')
+
+        # a rerun after a finished (or crashed) sweep only sees what is still open
+        with timer('sweeper: rerun with nothing left'):
+            assert expiry.sweep() == 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Latency of a non-auth page while logins saturate bcrypt.
+
+Runs the same load once per executor setting and prints p50/p99 of
+GET /index next to the login throughput:
+
+    python -m benchmarks.hashing_bench --login-clients 32 --page-clients 4
+"""
+import argparse
+import threading
+import time
+
+from benchmarks._common import add_user, bench_app, percentile
+
+SETTINGS = {
+    'inline': {'HASHING_EXECUTOR': 'inline'},
+    'thread pool': {'HASHING_EXECUTOR': 'thread', 'HASHING_WORKERS': 2, 'HASHING_QUEUE_SIZE': 16},
+}
+
+
+def flood_logins(app, stop, counts):
+    client = app.test_client()
+    done = busy = 0
+    while not stop.is_set():
+        response = client.post('/login', data={'email': 'bench@example.com', 'password': 'Wrong-pass1!'})
+        if response.status_code == 503:
+            busy += 1
+        else:
+            done += 1
+    counts.append((done, busy))
+
+
+def view_pages(app, stop, latencies):
+    client = app.test_client()
+    while not stop.is_set():
+        started = time.perf_counter()
+        client.get('/index')
+        latencies.append(time.perf_counter() - started)
+
+
+def run(name, config, args):
+    with bench_app(**config) as app:
+        add_user(password='Password1!')
+        stop = threading.Event()
+        counts, latencies = [], []
+        threads = [threading.Thread(target=flood_logins, args=(app, stop, counts))
+                   for _ in range(args.login_clients)]
+        threads += [threading.Thread(target=view_pages, args=(app, stop, latencies))
+                    for _ in range(args.page_clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        logins = sum(c[0] for c in counts)
+        rejected = sum(c[1] for c in counts)
+        print(f'{name:<12} index p50={percentile(latencies, 50) * 1000:7.1f} ms '
+              f'p99={percentile(latencies, 99) * 1000:7.1f} ms  '
+              f'logins={logins / args.seconds:6.1f}/s rejected={rejected}')
+        print(f'{"":<12} {app.extensions["hasher"].stats()}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--login-clients', type=int, default=32)
+    parser.add_argument('--page-clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    for name, config in SETTINGS.items():
+        run(name, config, args)
+
+
+if __name__ == '__main__':
+    main()
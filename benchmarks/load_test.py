@@ -0,0 +1,253 @@
+"""Load test of the auth and profile flows, with JSON baselines.
+
+Every endpoint is driven in turn by --concurrency client threads for
+--seconds, against a temporary Postgres and the local SMTP stub (reset
+emails go through the outbox sender into the stub). Prints throughput and
+latency percentiles per endpoint; --save writes them as a JSON baseline
+and `compare` fails when a run is worse than its baseline by more than the
+tolerance:
+
+    python -m benchmarks.load_test run --concurrency 8 --seconds 10 --save baseline.json
+    python -m benchmarks.load_test run --save current.json
+    python -m benchmarks.load_test compare baseline.json current.json --tolerance 0.2
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from benchmarks._common import add_user, bench_app, percentile
+from benchmarks._smtp_stub import SMTPStub
+from project import db
+from project.models import Size, StorageOrder, Warehouse
+
+PASSWORD = 'Password1!'
+ORDERS_PER_USER = 25
+
+
+def seed(clients):
+    """One user per client thread, each with a page of storage orders."""
+    db.session.bulk_insert_mappings(Size, [{'size_id': 1, 'size_name': 14}])
+    db.session.bulk_insert_mappings(Warehouse, [
+        {'shelf_id': i, 'active': True, 'size_id': 1} for i in range(1, clients + 1)
+    ])
+    users, orders = [], []
+    for i in range(clients):
+        user = add_user(email=f'load{i}@example.com', password=PASSWORD)
+        users.append((user.user_id, user.email))
+        day = date(2022, 1, 1)
+        for _ in range(ORDERS_PER_USER):
+            orders.append({'start_date': day, 'stop_date': day + timedelta(days=9), 'storage_order_cost': 100,
+                           'created': datetime.now(), 'user_id': user.user_id, 'shelf_id': i + 1})
+            day += timedelta(days=10)
+    db.session.bulk_insert_mappings(StorageOrder, orders)
+    db.session.commit()
+    return users
+
+
+class Scenario:
+    """One endpoint: setup() runs once per client, request() is the timed call, after() is not timed."""
+    path = None
+
+    def __init__(self, client, user_id, email):
+        self.client = client
+        self.user_id = user_id
+        self.email = email
+
+    def setup(self):
+        pass
+
+    def request(self):
+        raise NotImplementedError
+
+    def after(self):
+        pass
+
+
+class Index(Scenario):
+    path = '/index'
+
+    def request(self):
+        return self.client.get('/index')
+
+
+class Login(Scenario):
+    path = '/login'
+
+    def request(self):
+        return self.client.post('/login', data={'email': self.email, 'password': PASSWORD})
+
+    def after(self):
+        self.client.get('/logout')
+
+
+_registrations = itertools.count()
+
+
+class Register(Scenario):
+    path = '/register'
+
+    def request(self):
+        return self.client.post('/register', data={
+            'first_name': 'Load', 'last_name': 'Test', 'email': f'new{next(_registrations)}@example.com',
+            'phone': '+442083661177', 'password': PASSWORD, 'password_check': PASSWORD,
+        })
+
+    def after(self):
+        self.client.get('/logout')
+
+
+class Profile(Scenario):
+    path = '/profile/<id>'
+
+    def setup(self):
+        self.client.post('/login', data={'email': self.email, 'password': PASSWORD})
+
+    def request(self):
+        return self.client.get(f'/profile/{self.user_id}')
+
+
+class ResetPasswordRequest(Scenario):
+    path = '/reset_password_request'
+
+    def request(self):
+        return self.client.post('/reset_password_request', data={'email': self.email})
+
+
+SCENARIOS = {
+    'index': Index,
+    'login': Login,
+    'register': Register,
+    'profile': Profile,
+    'reset_password_request': ResetPasswordRequest,
+}
+
+
+def drive(app, scenario_cls, users, seconds):
+    stop = threading.Event()
+    results = []
+
+    def client_loop(user_id, email):
+        scenario = scenario_cls(app.test_client(), user_id, email)
+        scenario.setup()
+        latencies, errors = [], 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = scenario.request()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            scenario.after()
+        results.append((latencies, errors))
+
+    threads = [threading.Thread(target=client_loop, args=user) for user in users]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    return {
+        'path': scenario_cls.path,
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies, default=0) * 1000, 2),
+    }
+
+
+def print_report(endpoints):
+    print(f'{"endpoint":<24} {"req/s":>8} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8} {"errors":>7}')
+    for name, r in endpoints.items():
+        print(f'{name:<24} {r["rps"]:8.1f} {r["p50_ms"]:8.1f} {r["p90_ms"]:8.1f} {r["p99_ms"]:8.1f} '
+              f'{r["max_ms"]:8.1f} {r["errors"]:7}')
+
+
+def run(args):
+    with SMTPStub(delay=args.smtp_delay) as smtp:
+        config = dict(MAIL_SERVER='localhost', MAIL_PORT=smtp.port, MAIL_DEFAULT_SENDER='bench@example.com',
+                      EXPIRY_SWEEPER_WORKER=False)
+        with bench_app(**config) as app:
+            users = seed(args.concurrency)
+            endpoints = {}
+            for name in args.endpoints:
+                endpoints[name] = drive(app, SCENARIOS[name], users, args.seconds)
+            emails = smtp.messages
+
+    print_report(endpoints)
+    print(f'{emails} emails reached the SMTP stub')
+    if args.save:
+        baseline = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'concurrency': args.concurrency,
+            'seconds': args.seconds,
+            'endpoints': endpoints,
+        }
+        with open(args.save, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f'saved to {args.save}')
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if (baseline['concurrency'], baseline['seconds']) != (current['concurrency'], current['seconds']):
+        print('warning: the runs used different --concurrency or --seconds', file=sys.stderr)
+
+    regressions = []
+    print(f'{"endpoint":<24} {"req/s":>17} {"p99 ms":>17}')
+    for name, base in baseline['endpoints'].items():
+        now = current['endpoints'].get(name)
+        if now is None:
+            print(f'{name:<24} missing from {args.current}')
+            continue
+        slower = now['rps'] < base['rps'] * (1 - args.tolerance)
+        laggier = now['p99_ms'] > base['p99_ms'] * (1 + args.tolerance)
+        failed = now['errors'] > base['errors']
+        flag = 'REGRESSION' if slower or laggier or failed else 'ok'
+        print(f'{name:<24} {base["rps"]:8.1f} -> {now["rps"]:6.1f} {base["p99_ms"]:8.1f} -> {now["p99_ms"]:6.1f}  {flag}')
+        if flag != 'ok':
+            regressions.append(name)
+
+    if regressions:
+        sys.exit(f'regressions beyond {args.tolerance:.0%}: {", ".join(regressions)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='load the endpoints and report')
+    run_parser.add_argument('--concurrency', type=int, default=8, help='client threads per endpoint')
+    run_parser.add_argument('--seconds', type=float, default=10, help='duration per endpoint')
+    run_parser.add_argument('--endpoints', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    run_parser.add_argument('--smtp-delay', type=float, default=0.0, help='seconds the stub spends per message')
+    run_parser.add_argument('--save', help='write the results to this JSON file')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='fail if a run regressed against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Logging cost per request: synchronous file sink vs the queued JSON pipeline.
+
+    python -m benchmarks.logging_bench --requests 2000
+"""
+import argparse
+import os
+import tempfile
+
+from loguru import logger
+
+from benchmarks._common import bench_app, timer
+from project.log import configure_sink
+
+
+def run(app, label, requests):
+    client = app.test_client()
+    client.get('/index')
+    with timer(label, requests):
+        for _ in range(requests):
+            client.get('/index')
+    logger.complete()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    logger.remove()
+    with tempfile.TemporaryDirectory() as tmp, bench_app() as app:
+        # the old setup: a plain synchronous text sink, every record hits the file
+        app.config.update(LOG_FILE=os.path.join(tmp, 'sync.log'), LOG_JSON=False, LOG_ENQUEUE=False,
+                          LOG_BUFFERING=1, LOG_ACCESS=False)
+        configure_sink(app.config)
+        run(app, 'synchronous file sink', args.requests)
+
+        app.config.update(LOG_FILE=os.path.join(tmp, 'queued.log'), LOG_JSON=True, LOG_ENQUEUE=True,
+                          LOG_BUFFERING=65536, LOG_ACCESS=True)
+        configure_sink(app.config)
+        run(app, 'queued JSON sink', args.requests)
+
+        app.config.update(LOG_SAMPLING={'main.index': 0.05})
+        configure_sink(app.config)
+        run(app, 'queued JSON sink, 5% sampling', args.requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Free shelves per size and day: occupancy grid vs one SQL count per day.
+
+    python -m benchmarks.occupancy_bench --orders 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import text
+
+from benchmarks._common import add_user, bench_app, timer
+from project import db
+from project.models import Size, StorageOrder, Warehouse
+from project.occupancy import occupancy
+
+
+def seed(shelves, orders, sizes=4):
+    db.session.bulk_insert_mappings(Size, [{'size_id': i, 'size_name': 13 + i} for i in range(1, sizes + 1)])
+    db.session.bulk_insert_mappings(Warehouse, [
+        {'shelf_id': i, 'active': True, 'size_id': i % sizes + 1} for i in range(1, shelves + 1)
+    ])
+    user_id = add_user().user_id
+
+    rows, per_shelf = [], orders // shelves
+    for shelf_id in range(1, shelves + 1):
+        day = date.today() - timedelta(days=random.randint(0, 30))
+        for _ in range(per_shelf):
+            day += timedelta(days=random.randint(0, 10))
+            stop = day + timedelta(days=random.randint(2, 20))
+            rows.append({'start_date': day, 'stop_date': stop, 'storage_order_cost': 100,
+                         'created': datetime.now(), 'user_id': user_id, 'shelf_id': shelf_id})
+            day = stop + timedelta(days=1)
+    db.session.bulk_insert_mappings(StorageOrder, rows)
+    db.session.commit()
+    return len(rows)
+
+
+def sql_free_counts(start_date, days):
+    counts = {}
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        rows = db.session.execute(text(
+            'SELECT w.size_id, count(*) FROM warehouse w WHERE w.active AND NOT EXISTS ('
+            'SELECT 1 FROM storage_orders o WHERE o.shelf_id = w.shelf_id '
+            'AND o.start_date <= :day AND o.stop_date >= :day) GROUP BY w.size_id'), {'day': day})
+        for size_id, count in rows:
+            counts.setdefault(size_id, [0] * days)[offset] = count
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--shelves', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    random.seed(42)
+    path = os.path.join(tempfile.mkdtemp(), 'occupancy')
+    with bench_app(OCCUPANCY_FILE=path):
+        with timer('seed'):
+            total = seed(args.shelves, args.orders)
+        print(f'{total} orders on {args.shelves} shelves')
+
+        with timer('grid build + write'):
+            occupancy.build()
+        occupancy.loaded = False
+        with timer('grid map from file'):
+            occupancy.ensure_loaded()
+        print(f'grid file: {os.path.getsize(path + ".npy") / 2 ** 20:.1f} MiB')
+
+        today = date.today()
+        with timer(f'grid: per-size counts for {args.days} days', 1):
+            grid_counts = occupancy.free_counts(today, today + timedelta(days=args.days - 1))
+        with timer(f'SQL: per-size counts for {args.days} days', 1):
+            sql_counts = sql_free_counts(today, args.days)
+        for size_id, counts in sql_counts.items():
+            assert np.array_equal(grid_counts[size_id], counts), 'grid and SQL disagree'
+
+        windows = []
+        for _ in range(args.queries):
+            start = today + timedelta(days=random.randint(0, 300))
+            windows.append((random.randint(1, 4), start, start + timedelta(days=random.randint(1, 60))))
+        with timer('grid: free shelves for a window', args.queries):
+            for window in windows:
+                occupancy.free_shelves(*window)
+
+
+if __name__ == '__main__':
+    main()
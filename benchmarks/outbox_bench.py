@@ -0,0 +1,45 @@
+"""Email throughput: one SMTP connection per message vs the batched outbox.
+
+    python -m benchmarks.outbox_bench --messages 500 --smtp-delay 0.002
+"""
+import argparse
+
+from flask_mail import Message
+
+from benchmarks._common import bench_app, timer
+from benchmarks._smtp_stub import SMTPStub
+from project import mail
+from project.email import send_email
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--smtp-delay', type=float, default=0.0, help='seconds the stub spends per message')
+    args = parser.parse_args()
+
+    with SMTPStub(delay=args.smtp_delay) as smtp:
+        config = dict(MAIL_SERVER='localhost', MAIL_PORT=smtp.port, MAIL_DEFAULT_SENDER='bench@example.com',
+                      MAIL_OUTBOX_WORKER=False, MAIL_OUTBOX_BATCH=args.batch)
+        with bench_app(**config) as app:
+            outbox = app.extensions['outbox']
+
+            with timer('mail.send per message', args.messages):
+                for i in range(args.messages):
+                    mail.send(Message(f'direct {i}', recipients=['user@example.com'], body='hello'))
+            print(f'{"":<40} {smtp.connections} SMTP connections')
+
+            smtp.connections = smtp.messages = 0
+            with app.test_request_context():
+                with timer('enqueue into outbox', args.messages):
+                    for i in range(args.messages):
+                        send_email(f'outbox {i}', ['user@example.com'], 'hello', '<p>hello</p>')
+                with timer('outbox drain', args.messages):
+                    outbox.drain()
+            print(f'{"":<40} {smtp.connections} SMTP connections, {smtp.messages} messages, '
+                  f'last batch {outbox.stats()["last_batch_rate"]} msg/s')
+
+
+if __name__ == '__main__':
+    main()
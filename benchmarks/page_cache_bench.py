@@ -0,0 +1,78 @@
+"""Guest throughput of /index with and without the page cache.
+
+Every thread has its own test client (a separate guest) and requests
+/index for --seconds; `revalidate` sends the ETag of the previous answer,
+as a browser holding the page would.
+
+    uncached     PAGE_CACHE_ENABLED = False, the template is rendered every time
+    cached       the page is rendered once per PAGE_CACHE_TTL
+    revalidate   cached, and the clients get 304s
+
+    python -m benchmarks.page_cache_bench --threads 4 --seconds 5
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from project import create_app
+from project.page_cache import page_cache
+
+VARIANTS = {
+    'uncached': (dict(PAGE_CACHE_ENABLED=False), False),
+    'cached': (dict(PAGE_CACHE_ENABLED=True), False),
+    'revalidate': (dict(PAGE_CACHE_ENABLED=True), True),
+}
+
+
+def hammer(app, seconds, revalidate, counts):
+    client = app.test_client()
+    etag, done = None, 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        response = client.get('/index', headers={'If-None-Match': etag} if revalidate and etag else {})
+        assert response.status_code in (200, 304), response.status_code
+        etag = response.headers.get('ETag', etag)
+        done += 1
+    counts.append(done)
+
+
+def run(cfg_path, threads, seconds, config, revalidate):
+    app = create_app(cfg_path, **config)
+    counts = []
+    workers = [threading.Thread(target=hammer, args=(app, seconds, revalidate, counts)) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / seconds, page_cache.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    cfg_path = os.path.join(workdir, 'bench.cfg')
+    with open(cfg_path, 'w') as f:
+        # guests on /index don't touch the DB, nothing listens there
+        f.write("SECRET_KEY = 'benchmark'\n"
+                "SQLALCHEMY_DATABASE_URI = 'postgresql://localhost:1/unused'\n"
+                "SQLALCHEMY_TRACK_MODIFICATIONS = False\n"
+                "MAIL_OUTBOX_WORKER = False\n"
+                "EXPIRY_SWEEPER_WORKER = False\n")
+    try:
+        print(f'{"variant":<12} {"req/s":>9}  cache')
+        for name, (config, revalidate) in VARIANTS.items():
+            rate, stats = run(cfg_path, args.threads, args.seconds, config, revalidate)
+            print(f'{name:<12} {rate:9.0f}  {stats}')
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Phone validation: cold process, warmed-up metadata, cached result.
+
+    python -m benchmarks.phone_bench
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+from project.auth.auth_lib import normalize_phone, normalize_phones, warm_up_phone_metadata
+
+NUMBERS = ['442083661177', '+79161234567', '14155552671', '+4930123456', '33142685300', '+81312345678']
+
+COLD = '''
+import time
+from project.auth.auth_lib import normalize_phone
+started = time.perf_counter()
+normalize_phone({number!r})
+print(time.perf_counter() - started)
+'''
+
+
+def per_call_us(fn, numbers, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for number in numbers:
+            fn(number)
+    return (time.perf_counter() - started) / (rounds * len(numbers)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    cold = [float(subprocess.check_output([sys.executable, '-c', COLD.format(number=number)]))
+            for number in NUMBERS]
+    print(f'{"cold (first call in a new process)":<40} {sum(cold) / len(cold) * 1e6:10.1f} us')
+
+    started = time.perf_counter()
+    warm_up_phone_metadata()
+    print(f'{"metadata warm-up":<40} {(time.perf_counter() - started) * 1e6:10.1f} us')
+
+    uncached = normalize_phone.__wrapped__
+    print(f'{"warm, uncached":<40} {per_call_us(uncached, NUMBERS, args.rounds):10.1f} us')
+    print(f'{"cached":<40} {per_call_us(normalize_phone, NUMBERS, args.rounds):10.1f} us')
+
+    batch = NUMBERS * 1000
+    started = time.perf_counter()
+    normalize_phones(batch)
+    print(f'{"batch of " + str(len(batch)):<40} {(time.perf_counter() - started) * 1e6 / len(batch):10.1f} us/number')
+
+
+if __name__ == '__main__':
+    main()
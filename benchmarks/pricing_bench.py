@@ -0,0 +1,56 @@
+"""Batch storage quotes: NumPy pricing engine vs a per-order Python loop.
+
+    python -m benchmarks.pricing_bench --quotes 100000
+"""
+import argparse
+import random
+from datetime import date, timedelta
+
+import numpy as np
+
+from benchmarks._common import timer
+from project.pricing import MONTH_SEASONS, PricingEngine
+
+TARIFFS = {size_id: {'winter': 30 + size_id, 'spring': 20 + size_id, 'summer': 15 + size_id,
+                     'autumn': 25 + size_id} for size_id in range(1, 11)}
+
+
+def loop_quote(size_id, start_date, stop_date):
+    cost, day = 0, start_date
+    while day <= stop_date:
+        cost += TARIFFS[size_id][MONTH_SEASONS[day.month]]
+        day += timedelta(days=1)
+    return cost
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--quotes', type=int, default=100000)
+    args = parser.parse_args()
+
+    random.seed(42)
+    engine = PricingEngine()
+    with timer('build tariff tables'):
+        engine.configure(TARIFFS, cache_size=args.quotes)
+
+    sizes, starts, stops = [], [], []
+    for _ in range(args.quotes):
+        start = date(2022, 1, 1) + timedelta(days=random.randint(0, 1000))
+        sizes.append(random.randint(1, 10))
+        starts.append(start)
+        stops.append(start + timedelta(days=random.randint(7, 240)))
+
+    with timer('vectorized quote_many', args.quotes):
+        costs = engine.quote_many(sizes, starts, stops)
+    with timer('memoized quote (cold)', args.quotes):
+        cached = [engine.quote(*order) for order in zip(sizes, starts, stops)]
+    with timer('memoized quote (warm)', args.quotes):
+        cached = [engine.quote(*order) for order in zip(sizes, starts, stops)]
+    with timer('per-order Python loop', args.quotes):
+        looped = [loop_quote(*order) for order in zip(sizes, starts, stops)]
+
+    assert np.array_equal(costs, looped) and cached == looped, 'engines disagree'
+
+
+if __name__ == '__main__':
+    main()
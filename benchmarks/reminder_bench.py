@@ -0,0 +1,82 @@
+"""Reminder digests against the local SMTP stub: queueing, pooled sending, no re-sends.
+
+    python -m benchmarks.reminder_bench --customers 5000 --workers 4 --rate 0
+"""
+import argparse
+import random
+from datetime import date, datetime, timedelta
+
+from benchmarks._common import bench_app, timer
+from benchmarks._smtp_stub import SMTPStub
+from project import db
+from project.models import Size, StorageOrder, User, Warehouse
+from project.outbox import outbox
+from project.reminders import reminders
+
+
+def seed(customers, orders_per_customer):
+    db.session.bulk_insert_mappings(Size, [{'size_id': 1, 'size_name': 14}])
+    shelves = customers * orders_per_customer
+    db.session.bulk_insert_mappings(Warehouse, [
+        {'shelf_id': i, 'active': True, 'size_id': 1} for i in range(1, shelves + 1)
+    ])
+    # bcrypt for every customer would dominate the seed, they share one hash
+    template = User(first_name='Bench', last_name='User', email='template@example.com',
+                    phone='+442083661177', password='Password1!')
+    db.session.bulk_insert_mappings(User, [
+        {'first_name': 'Bench', 'last_name': f'User{i}', 'email': f'user{i}@example.com', 'phone': template.phone,
+         'password': template.password, 'salt': template.salt, 'active': True, 'group_id': 2,
+         'created': datetime.now()}
+        for i in range(customers)
+    ])
+    user_ids = [user_id for user_id, in db.session.query(User.user_id)]
+
+    rows, shelf_id = [], 0
+    for user_id in user_ids:
+        for _ in range(orders_per_customer):
+            shelf_id += 1
+            stop = date.today() + timedelta(days=random.randint(0, 14))
+            rows.append({'start_date': stop - timedelta(days=30), 'stop_date': stop, 'storage_order_cost': 100,
+                         'created': datetime.now(), 'user_id': user_id, 'shelf_id': shelf_id})
+    db.session.bulk_insert_mappings(StorageOrder, rows)
+    db.session.commit()
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=2, help='orders per customer')
+    parser.add_argument('--workers', type=int, default=4, help='SMTP connections')
+    parser.add_argument('--rate', type=float, default=0, help='messages per second, 0 for no limit')
+    parser.add_argument('--smtp-delay', type=float, default=0.001)
+    args = parser.parse_args()
+
+    random.seed(42)
+    with SMTPStub(delay=args.smtp_delay) as smtp:
+        config = dict(MAIL_SERVER='localhost', MAIL_PORT=smtp.port, MAIL_DEFAULT_SENDER='bench@example.com',
+                      MAIL_OUTBOX_WORKER=False, MAIL_OUTBOX_WORKERS=args.workers, MAIL_OUTBOX_RATE=args.rate,
+                      EXPIRY_SWEEPER_WORKER=False)
+        with bench_app(**config):
+            with timer('seed'):
+                total = seed(args.customers, args.orders)
+            due = len({row.user_id for row in reminders.due_orders()})
+            print(f'{total} orders, {due} customers due for a reminder')
+
+            with timer('render + queue digests', due):
+                queued = reminders.send()
+            assert queued == due, f'{queued} digests queued, {due} expected'
+            with timer(f'send over {args.workers} connections', queued):
+                outbox.drain(workers=args.workers)
+            print(f'{"":<40} {smtp.connections} SMTP connections, {smtp.messages} messages')
+            assert smtp.messages == due
+
+            # a second run (or a restart) finds nothing left to remind
+            with timer('rerun'):
+                assert reminders.send() == 0
+            outbox.drain(workers=args.workers)
+            assert smtp.messages == due, 'reminders were sent twice'
+
+
+if __name__ == '__main__':
+    main()
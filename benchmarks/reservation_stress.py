@@ -0,0 +1,83 @@
+"""Concurrent shelf booking: throughput per worker count and an overlap check.
+
+    python -m benchmarks.reservation_stress --workers 1 2 4 8 --bookings 200
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from benchmarks._common import add_user, bench_app
+from project import db
+from project.models import Size, Warehouse
+from project.reservations import ShelfUnavailable, reserve_shelf
+
+SEASON_START = date(2022, 10, 1)
+
+OVERLAPS = text("""
+    SELECT count(*) FROM storage_orders a JOIN storage_orders b
+      ON a.shelf_id = b.shelf_id AND a.storage_order_id < b.storage_order_id
+     AND a.start_date <= b.stop_date AND b.start_date <= a.stop_date
+""")
+
+
+def book(app, user_id, bookings, results):
+    booked = rejected = 0
+    with app.app_context():
+        for _ in range(bookings):
+            start = SEASON_START + timedelta(days=random.randint(0, 60))
+            try:
+                reserve_shelf(user_id, 1, start, start + timedelta(days=random.randint(7, 30)), cost=100)
+            except ShelfUnavailable:
+                rejected += 1
+            else:
+                booked += 1
+        db.session.remove()
+    results.append((booked, rejected))
+
+
+def run(app, user_id, workers, bookings):
+    db.session.execute(text('TRUNCATE storage_orders'))
+    db.session.commit()
+    app.extensions['availability'].load()
+
+    results = []
+    threads = [threading.Thread(target=book, args=(app, user_id, bookings, results)) for _ in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    booked = sum(r[0] for r in results)
+    rejected = sum(r[1] for r in results)
+    overlaps = db.session.execute(OVERLAPS).scalar()
+    print(f'workers={workers:<3} booked={booked:<6} rejected={rejected:<6} '
+          f'{booked / elapsed:8.1f} bookings/s  overlaps={overlaps}')
+    return overlaps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--bookings', type=int, default=200, help='bookings per worker')
+    parser.add_argument('--shelves', type=int, default=100)
+    args = parser.parse_args()
+
+    with bench_app(SQLALCHEMY_ENGINE_OPTIONS={'pool_size': max(args.workers) + 2}) as app:
+        db.session.add(Size(size_id=1, size_name=15))
+        db.session.bulk_insert_mappings(Warehouse, [
+            {'shelf_id': i, 'active': True, 'size_id': 1} for i in range(1, args.shelves + 1)
+        ])
+        user_id = add_user().user_id
+
+        overlaps = [run(app, user_id, workers, args.bookings) for workers in args.workers]
+        assert not any(overlaps), 'double-booked shelves found'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""First-request latency of fresh app instances: lazy compile vs bytecode cache vs precompiled.
+
+Each run builds a new app (a new Jinja environment, like a freshly started
+worker) and times its first and second GET of every page:
+
+    cold        no bytecode cache, templates compiled on the first hit
+    bytecode    the disk cache is already filled by an earlier worker
+    precompiled bytecode cache + every template loaded at startup
+
+    python -m benchmarks.template_bench --runs 5
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from project import create_app
+
+PAGES = ('/index', '/login', '/register', '/reset_password_request')
+
+VARIANTS = {
+    'cold': dict(TEMPLATE_BYTECODE_CACHE=None, TEMPLATE_PRECOMPILE=False),
+    'bytecode': dict(TEMPLATE_PRECOMPILE=False),
+    'precompiled': dict(TEMPLATE_PRECOMPILE=True),
+}
+
+
+def first_requests(cfg_path, cache_dir, config):
+    started = time.perf_counter()
+    app = create_app(cfg_path, **{'TEMPLATE_BYTECODE_CACHE': cache_dir, **config})
+    startup = time.perf_counter() - started
+    client = app.test_client()
+    first, second = [], []
+    for page in PAGES:
+        for timings in (first, second):
+            started = time.perf_counter()
+            response = client.get(page)
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200, f'{page}: {response.status_code}'
+    return startup, sum(first), sum(second)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    cache_dir = os.path.join(workdir, 'jinja-cache')
+    cfg_path = os.path.join(workdir, 'bench.cfg')
+    with open(cfg_path, 'w') as f:
+        # the pages measured don't touch the DB, nothing listens there
+        f.write("SECRET_KEY = 'benchmark'\n"
+                "SQLALCHEMY_DATABASE_URI = 'postgresql://localhost:1/unused'\n"
+                "SQLALCHEMY_TRACK_MODIFICATIONS = False\n"
+                "MAIL_OUTBOX_WORKER = False\n"
+                "EXPIRY_SWEEPER_WORKER = False\n"
+                # the second requests would be replayed from the page cache
+                "PAGE_CACHE_ENABLED = False\n")
+    try:
+        # fill the bytecode cache once, as the first worker of the host would
+        create_app(cfg_path, TEMPLATE_BYTECODE_CACHE=cache_dir, TEMPLATE_PRECOMPILE=True)
+        print(f'{"variant":<12} {"startup ms":>11} {"1st requests ms":>16} {"2nd requests ms":>16}  ({len(PAGES)} pages)')
+        for name, config in VARIANTS.items():
+            runs = [first_requests(cfg_path, cache_dir, config) for _ in range(args.runs)]
+            startup, first, second = (statistics.median(column) * 1000 for column in zip(*runs))
+            print(f'{name:<12} {startup:11.1f} {first:16.1f} {second:16.1f}')
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,106 @@
 from flask import Flask
 from flask_mail import Mail
-from flask_sqlalchemy import SQLAlchemy
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
 from psycopg2.errors import DatabaseError
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from project.config import Config
+from project.log import init_logging
+from project.replicas import RoutingSQLAlchemy, read_replica, replicas
+from project.template_cache import init_bytecode_cache, precompile_templates
 from loguru import logger
 
-logger.add("logger.log")
-
 mail = Mail()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 login_manager = LoginManager()
 
 # TODO Move config to object
 
 
-def create_app(config_filename=None):
+def create_app(config_filename=None, **config):
+    """Keyword arguments override the values of the config file."""
     app = Flask(__name__, static_folder='static', template_folder='templates', instance_relative_config=True)
     # app.config.from_object(Config)
     app.config.from_pyfile(config_filename)
-    print(f'using config: {config_filename}')
+    app.config.update(config)
+    trust_proxies(app)
+    init_logging(app)
+    logger.info(f'using config: {config_filename}')
+    init_bytecode_cache(app)
     initialize_extensions(app)
     register_blueprints(app)
+    register_commands(app)
+    warm_up(app)
     return app
 
 
+def trust_proxies(app):
+    """Take the client address from X-Forwarded-For, as set by PROXY_FIX_X_FOR trusted proxies.
+
+    request.remote_addr (the key of the rate limits, the address in the logs)
+    is otherwise the address of the proxy in front. Only the last
+    PROXY_FIX_X_FOR entries of the header are trusted, what a client sends
+    itself is ignored. Default 0: no proxy, the header is not read at all.
+    """
+    proxies = app.config.get('PROXY_FIX_X_FOR', 0)
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+
+
 def initialize_extensions(app):
     db.init_app(app)
+    replicas.init_app(app)
     Bootstrap(app)
     login_manager.init_app(app)
     login_manager.login_view = "auth.login"
     mail.init_app(app)
     
     from project.models import User
+    from project.assets import assets
+    from project.availability import availability
+    from project.cache import user_cache
+    from project.expiry import expiry
+    from project.hashing import hasher
+    from project.occupancy import occupancy
+    from project.outbox import outbox
+    from project.page_cache import page_cache
+    from project.pricing import pricing
+    from project.ratelimit import limiter
+    from project.reminders import reminders
+    from project.sql_stats import query_stats
+    
+    assets.init_app(app)
+    availability.init_app(app)
+    hasher.init_app(app)
+    user_cache.init_app(app)
+    expiry.init_app(app)
+    occupancy.init_app(app)
+    outbox.init_app(app)
+    page_cache.init_app(app)
+    pricing.init_app(app)
+    limiter.init_app(app)
+    reminders.init_app(app)
+    query_stats.init_app(app)
     
     @login_manager.user_loader
     def load_user(user_id):
+        user = user_cache.get(db.session, int(user_id))
+        if user is not None:
+            return user
         try:
-            user = User.query.get(int(user_id))
+            with read_replica():
+                user = User.query.get(int(user_id))
+            if user is None:
+                # a user registered moments ago may not have reached the replica yet
+                user = User.query.get(int(user_id))
         except DatabaseError:
             logger.error(f'DB error during load_user')
             db.session.rollback()
             return None
         else:
+            if user is not None:
+                user_cache.put(user)
             return user
     
 
@@ -53,9 +109,26 @@ def register_blueprints(app):
     from project.main import main as main_blueprint
     from project.profile import profile as profile_blueprint
     from project.errors import errors as errors_blueprint
+    from project.stats import stats as stats_blueprint
 
     app.register_blueprint(auth_blueprint)
     app.register_blueprint(main_blueprint)
     app.register_blueprint(profile_blueprint, url_prefix='/profile')
     app.register_blueprint(errors_blueprint, url_prefix='/')
-    
\ No newline at end of file
+    app.register_blueprint(stats_blueprint, url_prefix='/stats')
+
+
+def register_commands(app):
+    from project import commands
+    
+    commands.register(app)
+    
+
+def warm_up(app):
+    """Pay one-off lazy initialization costs at startup instead of on the first requests."""
+    if app.config.get('PHONE_METADATA_WARMUP', True):
+        from project.auth.auth_lib import warm_up_phone_metadata
+        
+        warm_up_phone_metadata()
+    if app.config.get('TEMPLATE_PRECOMPILE', True):
+        precompile_templates(app)
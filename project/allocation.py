@@ -0,0 +1,151 @@
+"""Shelf assignment strategies.
+
+First-fit books the free shelf with the lowest id. Over a season that
+leaves gaps of a few days between bookings that no later order fits into.
+Best-fit books the free shelf whose gap around the requested dates is the
+tightest, so the long free runs stay whole for long bookings.
+
+Bookings that have not started yet are not on a shelf physically, so they
+can still be moved. plan_reassignment() recolors them per size as an
+interval graph: orders by stop date, each one on the shelf that became
+free last before its start. For identical shelves this greedy places the
+largest possible number of orders, and it leaves the schedule packed.
+Among equally good shelves an order keeps its current one, which keeps the
+number of moves low.
+
+Config:
+    ALLOCATION_STRATEGY  'best-fit' (default) or 'first-fit'
+"""
+from bisect import bisect_right, insort
+from collections import namedtuple
+from datetime import date, timedelta
+
+from flask import current_app
+from loguru import logger
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from project import db, order_events
+from project.availability import availability
+from project.models import StorageOrder, Warehouse
+
+STRATEGIES = ('best-fit', 'first-fit')
+
+Reassignment = namedtuple('Reassignment', 'size_id moves unplaced orders')
+
+
+class AllocationError(ValueError):
+    pass
+
+
+def candidate_shelves(size_id: int, start_date: date, stop_date: date, limit: int = 1) -> list:
+    """Free shelves for the booking in the order the configured strategy prefers them."""
+    strategy = current_app.config.get('ALLOCATION_STRATEGY', 'best-fit')
+    if strategy == 'best-fit':
+        return availability.best_fit_shelves(size_id, start_date, stop_date, limit=limit)
+    if strategy == 'first-fit':
+        return availability.free_shelves(size_id, start_date, stop_date, limit=limit)
+    raise AllocationError(f'unknown allocation strategy {strategy!r}, expected one of {STRATEGIES}')
+
+
+def color_intervals(free_from: dict, bookings: list, current: dict = None):
+    """Assign bookings to shelves without overlaps.
+
+    free_from maps every shelf id to the first day it can take a booking,
+    bookings is a list of (order_id, start_date, stop_date) and current maps
+    order ids to the shelf they are on now. Returns ({order_id: shelf_id},
+    [order ids that did not fit]).
+    """
+    current = current or {}
+    shelves = sorted((day, shelf_id) for shelf_id, day in free_from.items())
+    assigned, unplaced = {}, []
+    for order_id, start_date, stop_date in sorted(bookings, key=lambda b: (b[2], b[1], b[0])):
+        # the shelf freed last before the start leaves the smallest gap
+        i = bisect_right(shelves, (start_date, float('inf')))
+        if i == 0:
+            unplaced.append(order_id)
+            continue
+        day = shelves[i - 1][0]
+        own = (day, current.get(order_id))
+        j = bisect_right(shelves, own) - 1 if own[1] is not None else -1
+        if j < 0 or shelves[j] != own:
+            j = i - 1
+        _, shelf_id = shelves.pop(j)
+        assigned[order_id] = shelf_id
+        insort(shelves, (stop_date + timedelta(days=1), shelf_id))
+    return assigned, unplaced
+
+
+def plan_reassignment(size_id: int, today: date = None) -> Reassignment:
+    """Recolor the not-yet-started bookings of the size over its active shelves."""
+    today = today or date.today()
+    shelf_ids = [shelf_id for shelf_id, in db.session.query(Warehouse.shelf_id)
+                 .filter(Warehouse.size_id == size_id, Warehouse.active.is_(True))]
+    free_from = dict.fromkeys(shelf_ids, today)
+
+    # orders that have started stay where they are
+    pinned = db.session.query(StorageOrder.shelf_id, func.max(StorageOrder.stop_date)) \
+        .filter(StorageOrder.shelf_id.in_(shelf_ids),
+                StorageOrder.start_date <= today, StorageOrder.stop_date >= today) \
+        .group_by(StorageOrder.shelf_id)
+    for shelf_id, stop_date in pinned:
+        free_from[shelf_id] = stop_date + timedelta(days=1)
+
+    future = db.session.query(StorageOrder.storage_order_id, StorageOrder.shelf_id,
+                              StorageOrder.start_date, StorageOrder.stop_date) \
+        .filter(StorageOrder.shelf_id.in_(shelf_ids), StorageOrder.start_date > today) \
+        .all()
+    current = {order_id: shelf_id for order_id, shelf_id, _, _ in future}
+    assigned, unplaced = color_intervals(free_from, [(o, start, stop) for o, _, start, stop in future], current)
+    moves = {order_id: (current[order_id], shelf_id)
+             for order_id, shelf_id in assigned.items() if shelf_id != current[order_id]}
+    return Reassignment(size_id, moves, unplaced, len(future))
+
+
+def apply_reassignment(plan: Reassignment) -> int:
+    """Move the orders of the plan in one transaction. Returns the number of orders moved.
+
+    Shelves can swap orders, which the immediate exclusion constraint would
+    reject row by row, so the moved rows are deleted and inserted back with
+    their ids on the new shelves. The shelves of the size are locked for
+    the duration: concurrent bookings of the size skip them meanwhile. A
+    booking that got in anyway makes the constraint reject the moves, and
+    AllocationError is raised with nothing moved.
+    """
+    if plan.unplaced:
+        raise AllocationError(f'{len(plan.unplaced)} orders of size {plan.size_id} would lose their shelf')
+    if not plan.moves:
+        return 0
+    db.session.query(Warehouse.shelf_id) \
+        .filter(Warehouse.size_id == plan.size_id) \
+        .with_for_update() \
+        .all()
+    table = StorageOrder.__table__
+    ids = list(plan.moves)
+    rows = [dict(row) for row in db.session.execute(
+        table.select().where(table.c.storage_order_id.in_(ids)).with_for_update()).mappings()]
+    if len(rows) != len(ids):
+        db.session.rollback()
+        raise AllocationError('orders of the plan changed meanwhile, plan again')
+    for row in rows:
+        old_shelf, new_shelf = plan.moves[row['storage_order_id']]
+        if row['shelf_id'] != old_shelf or row['start_date'] <= date.today():
+            db.session.rollback()
+            raise AllocationError('orders of the plan changed meanwhile, plan again')
+        row['shelf_id'] = new_shelf
+        # core statements bypass the ORM events, the moves are handed to the indexes directly
+        order_events.record(db.session, 'remove', (row['storage_order_id'], old_shelf,
+                                                   row['start_date'], row['stop_date']))
+        order_events.record(db.session, 'add', (row['storage_order_id'], new_shelf,
+                                                row['start_date'], row['stop_date']))
+    try:
+        db.session.execute(table.delete().where(table.c.storage_order_id.in_(ids)))
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        logger.warning(f'size {plan.size_id}: reassignment conflicts with a concurrent booking: {e.orig}')
+        raise AllocationError('a booking conflicts with the plan, plan again') from None
+
+    logger.info(f'size {plan.size_id}: {len(rows)} of {plan.orders} future orders moved')
+    return len(rows)
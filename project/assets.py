@@ -0,0 +1,179 @@
+"""Fingerprinted static assets.
+
+`flask build-assets` copies every file of project/static into static/dist
+under a content-hashed name (css/styles.css -> css/styles.1a2b3c4d5e.css),
+writes gzip and brotli copies of the text assets, WebP variants of the
+images at their own width and at ASSET_WIDTHS below it, and a
+manifest.json mapping the original names to all of that.
+
+With a manifest, url_for('static', filename='css/styles.css') builds the
+fingerprinted URL and /static/dist/ is served by Assets.serve(): the
+precompressed copy the client accepts and a one-year immutable
+Cache-Control, so repeat views don't even revalidate. A changed file gets a
+new name. Without a manifest (development), static files are served as
+before. The picture() macro of _picture.html offers the WebP variants.
+
+Building needs `brotli` for the .br copies and `Pillow`, with WebP
+support, for the variants of the images (see requirements.txt): without
+them build_assets() fails before touching static/dist. Serving the built
+files needs neither.
+
+Config:
+    ASSETS_MANIFEST   path of the manifest, None to disable
+                      (default: <static folder>/dist/manifest.json)
+    ASSET_WIDTHS      widths of the WebP variants (default (480, 960, 1600))
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_from_directory, url_for
+from loguru import logger
+
+DIST = 'dist'
+COMPRESSED_SUFFIXES = ('.css', '.js', '.svg', '.json', '.txt', '.map')
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+ONE_YEAR = 365 * 24 * 3600
+
+
+def _fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()[:10]
+
+
+def _check_tools(images: bool) -> None:
+    """Fail when a package needed to build the assets is missing, rather than leave out its files."""
+    try:
+        import brotli  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError('building the assets needs the brotli package, see requirements.txt') from e
+    if not images:
+        return
+    try:
+        from PIL import features
+    except ImportError as e:
+        raise RuntimeError('building the assets needs the Pillow package, see requirements.txt') from e
+    if not features.check('webp'):
+        raise RuntimeError('building the assets needs Pillow with WebP support (libwebp)')
+
+
+def _compress(path):
+    import brotli
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(f'{path}.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    with open(f'{path}.br', 'wb') as f:
+        f.write(brotli.compress(data, quality=11))
+    return ['br', 'gzip']
+
+
+def _webp_variants(path, stem, widths):
+    """{width: dist-relative name} of the WebP copies, the widest being the original width."""
+    from PIL import Image
+
+    variants = {}
+    with Image.open(path) as image:
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        for width in sorted({w for w in widths if w < image.width} | {image.width}):
+            name = f'{stem}.{width}w.webp'
+            resized = image if width == image.width else \
+                image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+            resized.save(os.path.join(os.path.dirname(path), os.path.basename(name)), 'WEBP', quality=80, method=6)
+            variants[width] = name
+    return variants
+
+
+def build_assets(static_folder: str, widths=(480, 960, 1600)) -> dict:
+    """Rebuild static/dist and its manifest. Returns the manifest."""
+    dist = os.path.join(static_folder, DIST)
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist]
+        sources.extend(os.path.join(root, filename) for filename in sorted(files))
+    _check_tools(images=any(source.lower().endswith(IMAGE_SUFFIXES) for source in sources))
+
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+    manifest = {}
+    for source in sources:
+        name = os.path.relpath(source, static_folder).replace(os.sep, '/')
+        base, ext = os.path.splitext(name)
+        stem = f'{base}.{_fingerprint(source)}'
+        target = os.path.join(dist, f'{stem}{ext}')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(source, target)
+
+        entry = {'file': f'{DIST}/{stem}{ext}', 'bytes': os.path.getsize(source)}
+        if ext.lower() in COMPRESSED_SUFFIXES:
+            entry['encodings'] = _compress(target)
+        elif ext.lower() in IMAGE_SUFFIXES:
+            webp = _webp_variants(target, stem, widths)
+            entry['webp'] = {str(width): f'{DIST}/{variant}' for width, variant in webp.items()}
+        manifest[name] = entry
+
+    with open(os.path.join(dist, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    logger.info(f'{len(manifest)} assets built into {dist}')
+    return manifest
+
+
+class Assets:
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.dist = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.dist = os.path.join(app.static_folder, DIST)
+        self.widths = app.config.get('ASSET_WIDTHS', (480, 960, 1600))
+        path = app.config.get('ASSETS_MANIFEST', os.path.join(self.dist, 'manifest.json'))
+        self.manifest = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.manifest = json.load(f)
+            logger.info(f'{len(self.manifest)} fingerprinted assets from {path}')
+        app.extensions['assets'] = self
+        app.url_defaults(self._fingerprinted_url)
+        app.add_url_rule(f'{app.static_url_path}/{DIST}/<path:filename>', 'assets', self.serve)
+        app.jinja_env.globals['asset_srcset'] = self.srcset
+
+    def _fingerprinted_url(self, endpoint, values):
+        if endpoint == 'static' and self.manifest:
+            entry = self.manifest.get(values.get('filename'))
+            if entry is not None:
+                values['filename'] = entry['file']
+
+    def srcset(self, filename: str) -> str:
+        """'url 480w, url 960w' of the WebP variants of the image, '' if there are none."""
+        entry = self.manifest.get(filename, {})
+        return ', '.join(f"{url_for('static', filename=variant)} {width}w"
+                         for width, variant in sorted(entry.get('webp', {}).items(), key=lambda i: int(i[0])))
+
+    def serve(self, filename):
+        accepted = request.accept_encodings
+        mimetype = mimetypes.guess_type(filename)[0]
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accepted[candidate] and os.path.isfile(os.path.join(self.dist, f'{filename}{suffix}')):
+                encoding = candidate
+                filename = f'{filename}{suffix}'
+                break
+        response = send_from_directory(self.dist, filename, mimetype=mimetype, max_age=ONE_YEAR)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+assets = Assets()
@@ -1,28 +1,63 @@
+r"""The password must be at least 8 chars long and not exceed 32 chars;
+must contain at least one digit, one upper, one lower letter, one special char ['$', '@', '#', '!', '%']
 
-    """The password must be at least 8 chars long and not exceed 32 chars;
-    must contain at least one digit, one upper, one lower letter, one special char ['$', '@', '#', '!', '%']
-    
-    Minimum eight characters, at least one letter and one number:
-    "^(?=.*[A-Za-z])(?=.*\d)[A-Za-z\d]{8,}$"
-    
-    Minimum eight characters, at least one letter, one number and one special character:
-    "^(?=.*[A-Za-z])(?=.*\d)(?=.*[@$!%*#?&])[A-Za-z\d@$!%*#?&]{8,}$"
-    
-    Minimum eight characters, at least one uppercase letter, one lowercase letter and one number:
-    "^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)[a-zA-Z\d]{8,}$"
-    
-    Minimum eight characters, at least one uppercase letter, one lowercase letter, one number and one special character:
-    "^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$"
-    
-    
-    Minimum eight and maximum 10 characters, at least one uppercase letter, one lowercase letter, one number and one special character:
-    "^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,10}$"
-    
-    """
+Minimum eight characters, at least one letter and one number:
+"^(?=.*[A-Za-z])(?=.*\d)[A-Za-z\d]{8,}$"
+
+Minimum eight characters, at least one letter, one number and one special character:
+"^(?=.*[A-Za-z])(?=.*\d)(?=.*[@$!%*#?&])[A-Za-z\d@$!%*#?&]{8,}$"
+
+Minimum eight characters, at least one uppercase letter, one lowercase letter and one number:
+"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)[a-zA-Z\d]{8,}$"
+
+Minimum eight characters, at least one uppercase letter, one lowercase letter, one number and one special character:
+"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,}$"
+
+
+Minimum eight and maximum 10 characters, at least one uppercase letter, one lowercase letter, one number and one special character:
+"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,10}$"
+
+"""
+import re
+from functools import lru_cache
+from typing import Iterable, Optional
+
+import phonenumbers
+from phonenumbers import PhoneMetadata, NumberParseException
+
+PHONE_RX = re.compile(r"\d{10,15}$")
+
+PHONE_CACHE_SIZE = 8192
 
 
 def validate_phone(phone: str) -> bool:
-    rx = re.compile(r"\d{10,15}$")
-    return True if rx.match(phone) else False
-    # return re.fullmatch("\d{10,15}$", phone)
-    
\ No newline at end of file
+    return True if PHONE_RX.match(phone) else False
+
+
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
+def normalize_phone(phone: str) -> Optional[str]:
+    """E.164 form of the phone number, None if it is not a valid number."""
+    if not phone.startswith('+'):
+        phone = '+' + phone
+    try:
+        p = phonenumbers.parse(phone)
+    except NumberParseException:
+        return None
+    if not phonenumbers.is_valid_number(p):
+        return None
+    return phonenumbers.format_number(p, phonenumbers.PhoneNumberFormat.E164)
+
+
+def normalize_phones(phones: Iterable[str]) -> dict:
+    """Normalize a batch (e.g. a bulk import); repeated numbers are parsed once."""
+    return {phone: normalize_phone(phone.strip()) for phone in phones}
+
+
+def warm_up_phone_metadata(regions=None) -> int:
+    """Load the per-region metadata phonenumbers otherwise loads on the first number of each region."""
+    regions = regions or phonenumbers.SUPPORTED_REGIONS
+    for region in regions:
+        PhoneMetadata.metadata_for_region(region)
+    for country_code in phonenumbers.COUNTRY_CODES_FOR_NON_GEO_REGIONS:
+        PhoneMetadata.metadata_for_nongeo_region(country_code)
+    return len(regions)
@@ -1,10 +1,9 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, EmailField, TelField
 from wtforms.validators import DataRequired, Email, Length, Regexp, EqualTo, ValidationError
-import phonenumbers
 import email_validator
 
-from project.models import User
+from .auth_lib import normalize_phone
 
 # TODO: validate (normalize) email with spaces
 
@@ -44,23 +43,12 @@ class RegisterForm(FlaskForm):
 	
 	submit = SubmitField('Register')
 	
-	@staticmethod
-	def validate_email(self, email):
-		if User.query.filter_by(email=email.data).first():
-			raise ValidationError("Email already registered")
-	
 	@staticmethod
 	def validate_phone(self, phone):
-		if phone.data[0] != '+':
-			phone.data = '+' + phone.data
-		try:
-			p = phonenumbers.parse(phone.data)
-			if not phonenumbers.is_valid_number(p):
-				# TODO what to do if
-				raise ValueError()
-			phone.data = phonenumbers.format_number(p, phonenumbers.PhoneNumberFormat.E164)
-		except (phonenumbers.phonenumberutil.NumberParseException, ValueError):
+		normalized = normalize_phone(phone.data.strip())
+		if normalized is None:
 			raise ValidationError('Invalid phone number')
+		phone.data = normalized
 
 
 class ResetPasswordRequestForm(FlaskForm):
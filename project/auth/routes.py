@@ -10,13 +10,16 @@ from . import auth
 from .forms import LoginForm, RegisterForm, ResetPasswordRequestForm, ResetPasswordForm
 from .. import db
 from ..email import send_password_reset_email
+from ..hashing import HashingBusy
 from ..models import User
+from ..ratelimit import limit_posts
 
 # TODO: не работает try-except на БД
 # TODO: подтверждение email после регистрации
 
 
 @auth.route('/login', methods=['GET', 'POST'])
+@limit_posts('login')
 def login():
     if current_user.is_authenticated:
         logger.info(f'{current_user.email} tried to log in again')
@@ -27,19 +30,27 @@ def login():
     
     if login_form.validate_on_submit():
         try:
-            user = User.query.filter_by(email=login_form.email.data.strip()).first()
+            user = User.by_email(login_form.email.data)
         except DatabaseError:
             logger.error(f'DB error when user {login_form.email.data.strip()} tried to log in')
             db.session.rollback()
             flash('Sorry, database error', 'danger')
             return redirect(url_for('.login'))
         else:
-            if user is None or not user.check_password(login_form.password.data.strip()):
+            try:
+                password_ok = user is not None and user.check_password(login_form.password.data.strip())
+            except HashingBusy:
+                logger.warning(f'Hashing queue is full, {login_form.email.data.strip()} could not log in')
+                flash('Server is busy, please try again', 'danger')
+                return render_template('auth/login.html', form=login_form), 503
+            
+            if not password_ok:
                 flash('Invalid email or password', 'danger')
                 return redirect(url_for('.login'))
             
             login_user(user, remember=login_form.remember_me.data)
             logger.info(f'{current_user.email} logged in')
+            user.rehash_password_later(login_form.password.data.strip())
             flash('Welcome!', 'success')
             return redirect(next_url or url_for('main.index'))
         
@@ -56,16 +67,21 @@ def register():
     
     if register_form.validate_on_submit():
         
-        new_user = User(
-            first_name=register_form.first_name.data.strip(),
-            last_name=register_form.last_name.data.strip(),
-            email=register_form.email.data.strip(),
-            phone=register_form.phone.data.strip(),
-            password=register_form.password.data.strip()
-        )
-        db.session.add(new_user)
+        try:
+            new_user = User(
+                first_name=register_form.first_name.data.strip(),
+                last_name=register_form.last_name.data.strip(),
+                email=register_form.email.data.strip(),
+                phone=register_form.phone.data.strip(),
+                password=register_form.password.data.strip()
+            )
+        except HashingBusy:
+            logger.warning(f'Hashing queue is full, {register_form.email.data.strip()} could not register')
+            flash('Server is busy, please try again', 'danger')
+            return render_template('auth/register.html', form=register_form), 503
         
         try:
+            user = User.insert_unique(new_user)
             db.session.commit()
         except DatabaseError:
             logger.error(f'DB error when user {new_user.email} tried to register')
@@ -73,7 +89,10 @@ def register():
             flash('Sorry, database error', 'danger')
             return redirect(url_for('.register'))
         else:
-            user = User.query.filter_by(email=new_user.email).first()
+            if user is None:
+                register_form.email.errors.append('Email already registered')
+                return render_template('auth/register.html', form=register_form)
+            
             login_user(user)
             logger.info(f'{user.email} has been registered')
             flash('Thanks for registering', 'success')
@@ -92,6 +111,7 @@ def logout():
 
 
 @auth.route('/reset_password_request', methods=['GET', 'POST'])
+@limit_posts('reset')
 def reset_password_request():
     if current_user.is_authenticated:
         return redirect(url_for('main.index'))
@@ -101,7 +121,7 @@ def reset_password_request():
         
         email_to_reset = form.email.data.strip()
         try:
-            user = User.query.filter_by(email=email_to_reset).first()
+            user = User.by_email(email_to_reset)
         except DatabaseError:
             logger.error(f'DB error when user {email_to_reset} tried to request password reset')
             db.session.rollback()
@@ -157,7 +177,12 @@ def reset_password(token):
     
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        user.set_password(form.password.data.strip())
+        try:
+            user.set_password(form.password.data.strip())
+        except HashingBusy:
+            logger.warning(f'Hashing queue is full, {user.email} could not set new password')
+            flash('Server is busy, please try again', 'danger')
+            return render_template('auth/reset_password.html', form=form), 503
         
         try:
             db.session.commit()
@@ -0,0 +1,379 @@
+"""Interval index over StorageOrder date ranges.
+
+Every shelf keeps its bookings sorted by start date, so checking one shelf
+for a [start_date, stop_date] window is a bisect instead of a scan over
+all of its orders. Bookings on one shelf are expected not to overlap.
+Every size also keeps the free gaps between the bookings of its shelves,
+sorted by length, for best_fit_shelves(): the shelves whose gap around the
+booking is the tightest, found among the gaps long enough for the window
+only. free_shelves() answers first-fit (lowest shelf ids) from a tree over
+the shelves of the size in id order, which skips the runs of shelves that
+have no gap able to hold the window and stops at `limit` shelves.
+
+The index is built lazily from the DB on first use and then follows the
+committed order changes delivered by project.order_events. Those are the
+changes of this process only: what another worker books reaches it with
+the next reload, at most AVAILABILITY_MAX_AGE seconds later. The answers
+are hints that narrow the search; project.reservations locks the shelf and
+checks it against storage_orders before booking it, and falls back to a
+search in the DB when every hint turns out to be taken.
+
+Config:
+    AVAILABILITY_MAX_AGE   seconds before the index is reloaded from the DB (default 60, None: never)
+"""
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, timedelta
+from itertools import chain, islice
+from threading import Lock, RLock
+from time import monotonic
+
+from loguru import logger
+
+from project import db, order_events
+from project.models import StorageOrder, Warehouse
+
+
+# slack of an unbounded side, so shelves with nothing booked on one side are picked last
+OPEN_SLACK = 100000
+ONE_DAY = timedelta(days=1)
+NO_GAP = -1
+INF = float('inf')
+
+
+class ShelfSpans:
+    """Sorted, non-overlapping booked spans of one shelf (dates inclusive)."""
+    __slots__ = ('starts', 'stops', 'order_ids')
+
+    def __init__(self):
+        self.starts = []
+        self.stops = []
+        self.order_ids = []
+
+    def add(self, order_id: int, start_date: date, stop_date: date) -> int:
+        """Insert the booking; returns its position."""
+        i = bisect_right(self.starts, start_date)
+        self.starts.insert(i, start_date)
+        self.stops.insert(i, stop_date)
+        self.order_ids.insert(i, order_id)
+        return i
+
+    def find(self, order_id: int, start_date: date):
+        """Position of the booking, None if it isn't there."""
+        i = bisect_left(self.starts, start_date)
+        while i < len(self.starts) and self.starts[i] == start_date:
+            if self.order_ids[i] == order_id:
+                return i
+            i += 1
+        return None
+
+    def remove(self, order_id: int, start_date: date) -> None:
+        i = self.find(order_id, start_date)
+        if i is not None:
+            del self.starts[i], self.stops[i], self.order_ids[i]
+
+    def gap(self, i: int):
+        """(first, last) free day before the booking at position i, None for an unbounded side."""
+        return (self.stops[i - 1] + ONE_DAY if i else None,
+                self.starts[i] - ONE_DAY if i < len(self.starts) else None)
+
+    def is_free(self, start_date: date, stop_date: date) -> bool:
+        # the only span that may overlap is the last one starting on or before stop_date
+        i = bisect_right(self.starts, stop_date)
+        return i == 0 or self.stops[i - 1] < start_date
+
+    def slack(self, start_date: date, stop_date: date):
+        """Free days left before and after the window in its gap, None if the window is busy.
+
+        An open-ended side (no booking before or after) counts as OPEN_SLACK days.
+        """
+        i = bisect_right(self.starts, stop_date)
+        if i and self.stops[i - 1] >= start_date:
+            return None
+        before = (start_date - self.stops[i - 1]).days - 1 if i else OPEN_SLACK
+        after = (self.starts[i] - stop_date).days - 1 if i < len(self.starts) else OPEN_SLACK
+        return before + after
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class SizeGaps:
+    """Free gaps of the shelves of one size, each kind sorted the way its slack grows.
+
+    closed  (days - 1, shelf_id, first day)  between two bookings
+    heads   (last day, shelf_id)             before the first booking
+    tails   (-first day ordinal, shelf_id)   after the last booking
+    empty   shelf_id                         nothing booked
+    """
+    __slots__ = ('closed', 'heads', 'tails', 'empty')
+
+    def __init__(self):
+        self.closed = []
+        self.heads = []
+        self.tails = []
+        self.empty = []
+
+    def _entry(self, shelf_id, first, last):
+        if first is None and last is None:
+            return self.empty, shelf_id
+        if first is None:
+            return self.heads, (last, shelf_id)
+        if last is None:
+            return self.tails, (-first.toordinal(), shelf_id)
+        if first > last:
+            return None, None
+        return self.closed, ((last - first).days, shelf_id, first)
+
+    def add(self, shelf_id: int, first, last) -> None:
+        entries, key = self._entry(shelf_id, first, last)
+        if entries is not None:
+            insort(entries, key)
+
+    def append(self, shelf_id: int, first, last) -> None:
+        """add() for a bulk load, sort() afterwards."""
+        entries, key = self._entry(shelf_id, first, last)
+        if entries is not None:
+            entries.append(key)
+
+    def sort(self) -> None:
+        for entries in (self.closed, self.heads, self.tails, self.empty):
+            entries.sort()
+
+    def remove(self, shelf_id: int, first, last) -> None:
+        entries, key = self._entry(shelf_id, first, last)
+        if entries is None:
+            return
+        i = bisect_left(entries, key)
+        if i < len(entries) and entries[i] == key:
+            del entries[i]
+
+    def fitting(self, start_date: date, stop_date: date):
+        """(slack, shelf_id) of every gap holding the window, by slack then shelf id."""
+        need = (stop_date - start_date).days
+        closed = ((days - need, shelf_id)
+                  for days, shelf_id, first in islice(self.closed, bisect_left(self.closed, (need,)), None)
+                  if first <= start_date and first + timedelta(days=days) >= stop_date)
+        heads = ((OPEN_SLACK + (last - stop_date).days, shelf_id)
+                 for last, shelf_id in islice(self.heads, bisect_left(self.heads, (stop_date,)), None))
+        tails = ((OPEN_SLACK + start_date.toordinal() + neg_first, shelf_id)
+                 for neg_first, shelf_id in islice(self.tails, bisect_left(self.tails, (-start_date.toordinal(),)),
+                                                   None))
+        empty = ((2 * OPEN_SLACK, shelf_id) for shelf_id in self.empty)
+        # a closed gap is shorter than OPEN_SLACK, a shelf with one open side has less slack than an empty one
+        return chain(closed, heapq.merge(heads, tails), empty)
+
+
+class FirstFitTree:
+    """The shelves of one size in shelf id order, under a tree of what their gaps can hold.
+
+    Every node keeps, for the shelves below it, the longest gap between two
+    bookings (in days - 1, as in SizeGaps), the latest last day of a gap
+    before the first booking and the earliest first day of a gap after the
+    last one (ordinals; an empty shelf has both, unbounded). A window can
+    only fit below a node whose values allow it, so the search goes down
+    the leftmost such nodes and checks only the shelves it reaches.
+    """
+    __slots__ = ('shelf_ids', 'shelves', 'position', 'size', 'closed', 'heads', 'tails')
+
+    def __init__(self, shelves):
+        """`shelves`: (shelf_id, ShelfSpans) sorted by shelf id."""
+        self.shelf_ids = [shelf_id for shelf_id, _ in shelves]
+        self.shelves = [shelf for _, shelf in shelves]
+        self.position = {shelf_id: i for i, shelf_id in enumerate(self.shelf_ids)}
+        self.size = 1
+        while self.size < len(shelves):
+            self.size *= 2
+        self.closed = [NO_GAP] * (2 * self.size)
+        self.heads = [-INF] * (2 * self.size)
+        self.tails = [INF] * (2 * self.size)
+        for i, shelf in enumerate(self.shelves):
+            self._set_leaf(self.size + i, shelf)
+        for node in range(self.size - 1, 0, -1):
+            self._combine(node)
+
+    def _set_leaf(self, node: int, shelf: ShelfSpans) -> None:
+        if not shelf.starts:
+            self.closed[node], self.heads[node], self.tails[node] = NO_GAP, INF, -INF
+            return
+        self.closed[node] = max(((start - stop).days - 2 for stop, start in zip(shelf.stops, shelf.starts[1:])),
+                                default=NO_GAP)
+        self.heads[node] = (shelf.starts[0] - ONE_DAY).toordinal()
+        self.tails[node] = (shelf.stops[-1] + ONE_DAY).toordinal()
+
+    def _combine(self, node: int) -> None:
+        left, right = 2 * node, 2 * node + 1
+        self.closed[node] = max(self.closed[left], self.closed[right])
+        self.heads[node] = max(self.heads[left], self.heads[right])
+        self.tails[node] = min(self.tails[left], self.tails[right])
+
+    def update(self, shelf_id: int) -> None:
+        """Follow a change of the bookings of the shelf."""
+        i = self.position[shelf_id]
+        node = self.size + i
+        self._set_leaf(node, self.shelves[i])
+        node //= 2
+        while node:
+            self._combine(node)
+            node //= 2
+
+    def first_free(self, start_date: date, stop_date: date, limit: int) -> list:
+        """The `limit` lowest shelf ids free for the window."""
+        need = (stop_date - start_date).days
+        start, stop = start_date.toordinal(), stop_date.toordinal()
+        found = []
+        nodes = [1]
+        while nodes and len(found) < limit:
+            node = nodes.pop()
+            if self.closed[node] < need and self.heads[node] < stop and self.tails[node] > start:
+                continue
+            if node < self.size:
+                nodes.append(2 * node + 1)
+                nodes.append(2 * node)
+            elif self.shelves[node - self.size].is_free(start_date, stop_date):
+                # a gap long enough between two bookings may still not be where the window is
+                found.append(self.shelf_ids[node - self.size])
+        return found
+
+
+class ShelfAvailability:
+    def __init__(self, app=None):
+        self._lock = RLock()
+        self._loading = Lock()
+        self._spans = {}
+        self._size_of = {}
+        self._gaps = {}
+        self._first_fit = {}
+        self._orders = {}
+        self.max_age = 60
+        self.loaded = False
+        self.loaded_at = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_age = app.config.get('AVAILABILITY_MAX_AGE', 60)
+        app.extensions['availability'] = self
+        order_events.subscribe(self)
+
+    def load(self) -> None:
+        """(Re)build the index from the warehouse and storage_orders tables."""
+        spans, size_of, orders = {}, {}, {}
+        shelves = db.session.query(Warehouse.shelf_id, Warehouse.size_id) \
+            .filter(Warehouse.active.is_(True)) \
+            .order_by(Warehouse.shelf_id)
+        for shelf_id, size_id in shelves:
+            spans[shelf_id] = ShelfSpans()
+            size_of[shelf_id] = size_id
+
+        rows = db.session.query(StorageOrder.storage_order_id, StorageOrder.shelf_id,
+                                StorageOrder.start_date, StorageOrder.stop_date) \
+            .order_by(StorageOrder.shelf_id, StorageOrder.start_date) \
+            .yield_per(10000)
+        for order_id, shelf_id, start_date, stop_date in rows:
+            shelf = spans.get(shelf_id)
+            if shelf is None:
+                continue
+            # rows arrive sorted per shelf, appending keeps the lists ordered
+            shelf.starts.append(start_date)
+            shelf.stops.append(stop_date)
+            shelf.order_ids.append(order_id)
+            orders[order_id] = (shelf_id, start_date)
+
+        gaps = {size_id: SizeGaps() for size_id in set(size_of.values())}
+        for shelf_id, shelf in spans.items():
+            size_gaps = gaps[size_of[shelf_id]]
+            for i in range(len(shelf) + 1):
+                size_gaps.append(shelf_id, *shelf.gap(i))
+        for size_gaps in gaps.values():
+            size_gaps.sort()
+        # spans are in shelf id order
+        first_fit = {size_id: FirstFitTree([(shelf_id, shelf) for shelf_id, shelf in spans.items()
+                                            if size_of[shelf_id] == size_id])
+                     for size_id in gaps}
+
+        with self._lock:
+            self._spans, self._size_of, self._gaps, self._orders = spans, size_of, gaps, orders
+            self._first_fit = first_fit
+            self.loaded = True
+            self.loaded_at = monotonic()
+        logger.info(f'availability index loaded: {len(spans)} shelves, {len(orders)} orders')
+
+    def ensure_loaded(self) -> None:
+        if not self.loaded:
+            with self._loading:
+                if not self.loaded:
+                    self.load()
+        elif self.max_age is not None and monotonic() - self.loaded_at > self.max_age \
+                and self._loading.acquire(blocking=False):
+            # one thread reloads, the others go on with the current index meanwhile
+            try:
+                self.load()
+            finally:
+                self._loading.release()
+
+    def add_order(self, order_id: int, shelf_id: int, start_date: date, stop_date: date) -> None:
+        with self._lock:
+            if not self.loaded or order_id in self._orders:
+                return
+            shelf = self._spans.get(shelf_id)
+            if shelf is None:
+                return
+            size_id = self._size_of[shelf_id]
+            gaps = self._gaps[size_id]
+            gaps.remove(shelf_id, *shelf.gap(bisect_right(shelf.starts, start_date)))
+            i = shelf.add(order_id, start_date, stop_date)
+            gaps.add(shelf_id, *shelf.gap(i))
+            gaps.add(shelf_id, *shelf.gap(i + 1))
+            self._first_fit[size_id].update(shelf_id)
+            self._orders[order_id] = (shelf_id, start_date)
+
+    def remove_order(self, order_id: int, *args) -> None:
+        with self._lock:
+            entry = self._orders.pop(order_id, None)
+            if entry is None:
+                return
+            shelf_id, start_date = entry
+            shelf = self._spans[shelf_id]
+            i = shelf.find(order_id, start_date)
+            if i is None:
+                return
+            # the gaps on both sides of the booking become one
+            size_id = self._size_of[shelf_id]
+            gaps = self._gaps[size_id]
+            gaps.remove(shelf_id, *shelf.gap(i))
+            gaps.remove(shelf_id, *shelf.gap(i + 1))
+            shelf.remove(order_id, start_date)
+            gaps.add(shelf_id, *shelf.gap(i))
+            self._first_fit[size_id].update(shelf_id)
+
+    def is_free(self, shelf_id: int, start_date: date, stop_date: date) -> bool:
+        self.ensure_loaded()
+        with self._lock:
+            shelf = self._spans.get(shelf_id)
+            return shelf is not None and shelf.is_free(start_date, stop_date)
+
+    def free_shelves(self, size_id: int, start_date: date, stop_date: date, limit: int = 1) -> list:
+        """First `limit` active shelves of the size with no booking in the window."""
+        if start_date > stop_date:
+            raise ValueError('start_date is after stop_date')
+        self.ensure_loaded()
+        with self._lock:
+            shelves = self._first_fit.get(size_id)
+            if shelves is None:
+                return []
+            return shelves.first_free(start_date, stop_date, limit)
+
+    def best_fit_shelves(self, size_id: int, start_date: date, stop_date: date, limit: int = 1) -> list:
+        """Up to `limit` free shelves of the size, the tightest gap around the window first."""
+        if start_date > stop_date:
+            raise ValueError('start_date is after stop_date')
+        self.ensure_loaded()
+        with self._lock:
+            gaps = self._gaps.get(size_id)
+            if gaps is None:
+                return []
+            return [shelf_id for _, shelf_id in islice(gaps.fitting(start_date, stop_date), limit)]
+
+
+availability = ShelfAvailability()
@@ -0,0 +1,203 @@
+"""Small key/value caches with TTL and the Flask-Login identity cache.
+
+Two backends share one interface (get / set / delete / clear / stats):
+LocalCache is a process-local LRU, RedisCache is shared by all workers and
+needs the optional `redis` package. make_cache() picks one from the config:
+
+    CACHE_BACKEND      'local' (default) or 'redis', unless the user of the
+                       cache picks its own
+    CACHE_REDIS_URL    redis://localhost:6379/0 by default
+"""
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+
+class LocalCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {'backend': 'local', 'size': len(self._data), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+
+class RedisCache:
+    def __init__(self, url, prefix, ttl=60, client=None):
+        """`client`: a redis.Redis to use instead of connecting to `url`."""
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self._redis = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key):
+        raw = self._redis.get(self._key(key))
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._redis.set(self._key(key), pickle.dumps(value), px=max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self._redis.delete(self._key(key))
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(f'{self.prefix}:*'))
+        if keys:
+            self._redis.delete(*keys)
+
+    def stats(self) -> dict:
+        return {'backend': 'redis', 'hits': self.hits, 'misses': self.misses}
+
+
+def make_cache(app, prefix, maxsize=1024, ttl=60, backend=None):
+    backend = backend or app.config.get('CACHE_BACKEND', 'local')
+    if backend == 'local':
+        return LocalCache(maxsize=maxsize, ttl=ttl)
+    if backend == 'redis':
+        return RedisCache(app.config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'), prefix, ttl=ttl)
+    raise ValueError(f'unknown CACHE_BACKEND {backend!r}')
+
+
+SESSION_INVALIDATE_KEY = 'user_cache_invalidate'
+
+
+class UserCache:
+    """Column values of recently loaded users, keyed by user_id.
+
+    Rows are cached rather than ORM objects, so every request gets its own
+    instance attached to its own session without a SELECT. Entries are
+    dropped when the password, `active` or `group_id` of a user changes,
+    and again after the changing transaction commits.
+
+    Config:
+        USER_CACHE_TTL     seconds, 0 disables the cache (default 60)
+        USER_CACHE_SIZE    max entries of the local backend (default 1024)
+    """
+
+    def __init__(self, app=None):
+        self._cache = None
+        self.invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        ttl = app.config.get('USER_CACHE_TTL', 60)
+        self._cache = make_cache(app, 'user', maxsize=app.config.get('USER_CACHE_SIZE', 1024), ttl=ttl) \
+            if ttl else None
+        app.extensions['user_cache'] = self
+        app.extensions.setdefault('stats', {})['user_cache'] = self.stats
+
+        from project.models import User
+        for attr in (User.password, User.active, User.group_id):
+            if not event.contains(attr, 'set', _on_user_change):
+                event.listen(attr, 'set', _on_user_change)
+        if not event.contains(Session, 'after_commit', _invalidate_committed):
+            event.listen(Session, 'after_commit', _invalidate_committed)
+
+    def get(self, session, user_id: int):
+        if self._cache is None:
+            return None
+        row = self._cache.get(user_id)
+        if row is None:
+            return None
+
+        from project.models import User
+        user = session.identity_map.get(identity_key(User, user_id))
+        if user is not None:
+            return user
+        user = User.__mapper__.class_manager.new_instance()
+        for key, value in row.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        session.add(user)
+        return user
+
+    def put(self, user) -> None:
+        if self._cache is None:
+            return
+        row = {attr.key: getattr(user, attr.key) for attr in inspect(type(user)).column_attrs}
+        self._cache.set(user.user_id, row)
+
+    def invalidate(self, user_id) -> None:
+        if self._cache is None or user_id is None:
+            return
+        self._cache.delete(user_id)
+        self.invalidations += 1
+
+    def clear(self) -> None:
+        if self._cache is not None:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        if self._cache is None:
+            return {'enabled': False}
+        return dict(self._cache.stats(), enabled=True, invalidations=self.invalidations)
+
+
+def _on_user_change(target, value, oldvalue, initiator):
+    if target.user_id is None:
+        return
+    user_cache.invalidate(target.user_id)
+    session = inspect(target).session
+    if session is not None:
+        session.info.setdefault(SESSION_INVALIDATE_KEY, set()).add(target.user_id)
+
+
+def _invalidate_committed(session):
+    for user_id in session.info.pop(SESSION_INVALIDATE_KEY, ()):
+        user_cache.invalidate(user_id)
+
+
+user_cache = UserCache()
@@ -0,0 +1,170 @@
+import time
+
+import click
+from loguru import logger
+from sqlalchemy import text
+
+from project import db
+from project.assets import build_assets
+from project.allocation import apply_reassignment, plan_reassignment
+from project.expiry import expiry
+from project.hashing import calibrate, hasher
+from project.occupancy import occupancy
+from project.outbox import outbox
+from project.reminders import reminders
+from project.template_cache import precompile_templates
+
+
+def register(app):
+    @app.cli.command('add-booking-constraint')
+    def add_booking_constraint():
+        """Add the no-overlap exclusion constraint to an existing storage_orders table."""
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS btree_gist'))
+        db.session.execute(text(
+            'ALTER TABLE storage_orders ADD CONSTRAINT storage_orders_shelf_dates_excl '
+            "EXCLUDE USING gist (shelf_id WITH =, daterange(start_date, stop_date, '[]') WITH &&)"
+        ))
+        db.session.commit()
+        logger.info('storage_orders_shelf_dates_excl added')
+        click.echo('Constraint added')
+
+    @app.cli.command('create-indexes')
+    def create_indexes():
+        """Create the model indexes that are missing in an existing database."""
+        existing = set(db.session.execute(text('SELECT indexname FROM pg_indexes')).scalars())
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=db.engine)
+                    click.echo(f'{table.name}: {index.name} created')
+    
+    @app.cli.command('normalize-emails')
+    @click.option('--chunk', default=10000, help='users updated per transaction')
+    def normalize_emails(chunk):
+        """Trim stored emails and build the unique lower(trim(email)) index."""
+        last_id = db.session.execute(text('SELECT coalesce(max(user_id), 0) FROM users')).scalar()
+        trimmed = 0
+        for first_id in range(0, last_id + 1, chunk):
+            trimmed += db.session.execute(text(
+                'UPDATE users SET email = btrim(email) '
+                'WHERE user_id BETWEEN :first AND :last AND email <> btrim(email)'
+            ), {'first': first_id, 'last': first_id + chunk - 1}).rowcount
+            db.session.commit()
+        click.echo(f'{trimmed} emails trimmed')
+        
+        duplicates = db.session.execute(text(
+            'SELECT lower(btrim(email)), count(*) FROM users GROUP BY 1 HAVING count(*) > 1'
+        )).all()
+        if duplicates:
+            for email, count in duplicates:
+                click.echo(f'duplicate: {email} x{count}')
+            raise click.ClickException('merge the duplicate accounts, then run the command again')
+        
+        # CONCURRENTLY can't run inside a transaction block
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text('CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_users_email_normalized '
+                              'ON users (lower(btrim(email)))'))
+            conn.execute(text('DROP INDEX CONCURRENTLY IF EXISTS ix_users_email_lower'))
+        logger.info('users emails normalized')
+        click.echo('ix_users_email_normalized ready')
+    
+    @app.cli.command('send-outbox')
+    def send_outbox():
+        """Send every due message of the email outbox and exit."""
+        click.echo(f'{outbox.drain()} messages processed')
+    
+    @app.cli.command('build-occupancy')
+    def build_occupancy():
+        """Rebuild the occupancy grid from today, and the shared file if OCCUPANCY_FILE is set."""
+        occupancy.build()
+        click.echo(f"occupancy grid: {occupancy.stats()['shelves']} shelves from {occupancy.first_day}")
+
+    @app.cli.command('add-order-completion')
+    def add_order_completion():
+        """Add the storage_orders.completed column to an existing database."""
+        db.session.execute(text('ALTER TABLE storage_orders ADD COLUMN IF NOT EXISTS completed timestamp'))
+        db.session.commit()
+        logger.info('storage_orders.completed added')
+        click.echo('Column added, run create-indexes for ix_storage_orders_open')
+
+    @app.cli.command('sweep-expired')
+    @click.option('--chunk', default=None, type=int, help='orders completed per transaction')
+    def sweep_expired(chunk):
+        """Complete every storage order whose stop_date has passed. Safe to rerun after a crash."""
+        if chunk:
+            expiry.chunk = chunk
+        completed = expiry.sweep()
+        click.echo(f"{completed} orders completed, {expiry.stats()['last_rate']} rows/s")
+
+    @app.cli.command('optimize-shelves')
+    @click.option('--size', 'size_ids', type=int, multiple=True, help='size id, every size by default')
+    @click.option('--apply', is_flag=True, help='move the orders, otherwise only print the plan')
+    def optimize_shelves(size_ids, apply):
+        """Repack the bookings that have not started yet onto as few gaps as possible."""
+        if not size_ids:
+            size_ids = db.session.execute(text('SELECT size_id FROM sizes ORDER BY size_id')).scalars().all()
+        for size_id in size_ids:
+            started = time.perf_counter()
+            plan = plan_reassignment(size_id)
+            elapsed = (time.perf_counter() - started) * 1000
+            click.echo(f'size {size_id}: {len(plan.moves)} of {plan.orders} future orders to move, '
+                       f'{len(plan.unplaced)} unplaced, planned in {elapsed:.0f} ms')
+            if apply:
+                click.echo(f'size {size_id}: {apply_reassignment(plan)} orders moved')
+
+    @app.cli.command('add-order-reminders')
+    def add_order_reminders():
+        """Add the storage_orders.reminded column to an existing database."""
+        db.session.execute(text('ALTER TABLE storage_orders ADD COLUMN IF NOT EXISTS reminded timestamp'))
+        db.session.commit()
+        logger.info('storage_orders.reminded added')
+        click.echo('Column added, run create-indexes for ix_storage_orders_reminder_due')
+
+    @app.cli.command('send-reminders')
+    @click.option('--send/--queue-only', default=True, help='drain the outbox after queueing the digests')
+    def send_reminders(send):
+        """Queue a digest for every customer whose orders end within REMINDER_DAYS_BEFORE days."""
+        click.echo(f'{reminders.send()} digests queued')
+        if send:
+            click.echo(f'{outbox.drain(workers=outbox.workers)} messages processed')
+
+    @app.cli.command('calibrate-bcrypt')
+    @click.option('--target-ms', default=250.0, help='time budget of one hash')
+    @click.option('--samples', default=3, help='hashes timed per cost')
+    def calibrate_bcrypt(target_ms, samples):
+        """Time bcrypt on this host and print the HASHING_ROUNDS that fits the budget."""
+        rounds, timings = calibrate(target_ms, samples=samples)
+        for cost, ms in timings.items():
+            click.echo(f'cost {cost:2}: {ms:8.1f} ms' + (' <- configured' if cost == hasher.rounds else ''))
+        click.echo(f'HASHING_ROUNDS = {rounds}  # fits {target_ms:.0f} ms, currently {hasher.rounds}')
+
+    @app.cli.command('bcrypt-costs')
+    def bcrypt_costs():
+        """Count the stored password hashes per bcrypt cost."""
+        rows = db.session.execute(text(
+            "SELECT split_part(password, '$', 3) AS cost, count(*) FROM users GROUP BY 1 ORDER BY 1"
+        )).all()
+        total = sum(count for _, count in rows) or 1
+        for cost, count in rows:
+            stale = hasher.rehash and not (cost.isdigit() and int(cost) == hasher.rounds)
+            mark = '  rehashed on next login' if stale else ''
+            click.echo(f'cost {cost:>2}: {count:8} users {count / total:6.1%}{mark}')
+
+    @app.cli.command('precompile-templates')
+    def precompile_templates_command():
+        """Compile every template into the bytecode cache, e.g. before starting the workers."""
+        result = precompile_templates(app)
+        for name in result['failed']:
+            click.echo(f'failed: {name}')
+        click.echo(f"{result['templates']} templates compiled in {result['ms']} ms")
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Fingerprint, precompress and convert the static files into static/dist; restart to serve them."""
+        try:
+            manifest = build_assets(app.static_folder, app.config.get('ASSET_WIDTHS', (480, 960, 1600)))
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        webp = sum(len(entry.get('webp', {})) for entry in manifest.values())
+        compressed = sum(1 for entry in manifest.values() if entry.get('encodings'))
+        click.echo(f'{len(manifest)} assets, {compressed} precompressed, {webp} WebP variants')
@@ -1,10 +1,15 @@
-from flask import render_template, url_for
+from flask import current_app, render_template, url_for
 from flask_mail import Message
 
 from . import mail
+from .outbox import outbox
 
 
 def send_email(subject, recipients, text_body, html_body):
+    if current_app.config.get('MAIL_OUTBOX', True):
+        outbox.enqueue(subject, recipients, text_body, html_body)
+        return
+    
     msg = Message(subject, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
@@ -4,15 +4,22 @@ from loguru import logger
 from . import errors
 from flask import render_template, request
 
+from project.page_cache import page_cache
+
 
 @errors.app_errorhandler(401)
 def not_authorized(e):
     user = current_user.email if current_user.is_authenticated else 'Guest'
     logger.warning(f'The user {user} takes unauthorized access to {request.url}')
-    return render_template('errors/401.html'), 401
+    return page_cache.respond('errors/401', lambda: (render_template('errors/401.html'), 401))
 
 
 @errors.app_errorhandler(404)
 def page_not_found(e):
     logger.warning(f'{request.url}')
-    return render_template('errors/404.html'), 404
+    return page_cache.respond('errors/404', lambda: (render_template('errors/404.html'), 404))
+
+
+@errors.app_errorhandler(429)
+def too_many_requests(e):
+    return render_template('errors/429.html'), 429, {'Retry-After': str(e.retry_after or 60)}
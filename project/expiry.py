@@ -0,0 +1,138 @@
+"""Expiry sweeper: closes out the storage orders whose stop_date has passed.
+
+An order is open while `completed` is NULL. The sweeper completes expired
+orders chunk by chunk, each chunk one set-based UPDATE over the ids picked
+from the partial ix_storage_orders_open index and one commit. Completed
+rows leave that index, so every chunk starts at its head and a run killed
+halfway simply resumes where it stopped: nothing but the `completed` column
+records the progress. Rows are picked FOR UPDATE SKIP LOCKED, so several
+processes can sweep at the same time without waiting on each other.
+
+A shelf is busy only through the dates of its orders (the exclusion
+constraint, the availability index and the occupancy grid all work on
+dates), so completing the order is what releases the shelf; the bulk UPDATE
+bypasses the ORM and the in-memory indexes, which key on the unchanged
+dates, have nothing to follow.
+
+Config:
+    EXPIRY_SWEEPER_WORKER    run the periodic sweep in a thread of the app (default True)
+    EXPIRY_SWEEP_INTERVAL    seconds between two sweeps (default 3600)
+    EXPIRY_SWEEP_CHUNK       orders completed per transaction (default 5000)
+"""
+import time
+from datetime import date, datetime
+from threading import Event, Lock, Thread
+
+from loguru import logger
+from sqlalchemy import text
+
+from project import db
+
+_COMPLETE_CHUNK = text(
+    'UPDATE storage_orders SET completed = :now '
+    'WHERE storage_order_id IN ('
+    '  SELECT storage_order_id FROM storage_orders '
+    '  WHERE completed IS NULL AND stop_date < :today '
+    '  ORDER BY stop_date, storage_order_id '
+    '  LIMIT :chunk '
+    '  FOR UPDATE SKIP LOCKED'
+    ') RETURNING shelf_id'
+)
+
+
+class ExpirySweeper:
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self._stopping = Event()
+        self._lock = Lock()
+        self.chunk = 5000
+        self.interval = 3600
+        self.sweeps = 0
+        self.completed = 0
+        self.last_sweep = None
+        self.last_rate = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.chunk = app.config.get('EXPIRY_SWEEP_CHUNK', 5000)
+        self.interval = app.config.get('EXPIRY_SWEEP_INTERVAL', 3600)
+        app.extensions['expiry'] = self
+        app.extensions.setdefault('stats', {})['expiry'] = self.stats
+        if app.config.get('EXPIRY_SWEEPER_WORKER', True):
+            app.before_first_request(self.start)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = Thread(target=self._run, name='expiry-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        logger.info('expiry sweeper started')
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    self.sweep()
+                except Exception:
+                    logger.exception('expiry sweep failed')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            self._stopping.wait(self.interval)
+
+    def complete_chunk(self, today: date = None) -> int:
+        """Complete one chunk of expired orders and commit. Returns the number of orders completed."""
+        shelf_ids = db.session.execute(_COMPLETE_CHUNK, {
+            'now': datetime.now(),
+            'today': today or date.today(),
+            'chunk': self.chunk,
+        }).scalars().all()
+        db.session.commit()
+        if shelf_ids:
+            logger.debug(f'expiry chunk: {len(shelf_ids)} orders completed on {len(set(shelf_ids))} shelves')
+        return len(shelf_ids)
+
+    def sweep(self, today: date = None) -> int:
+        """Complete every order that ended before today, chunk after chunk."""
+        started = time.perf_counter()
+        total = 0
+        while not self._stopping.is_set():
+            done = self.complete_chunk(today)
+            total += done
+            if done < self.chunk:
+                break
+
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0.0
+        with self._lock:
+            self.sweeps += 1
+            self.completed += total
+            self.last_sweep = datetime.now()
+            self.last_rate = rate
+        if total:
+            logger.info(f'expiry sweep: {total} orders completed in {elapsed * 1000:.0f} ms, {rate:.0f} rows/s')
+        return total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'sweeps': self.sweeps,
+                'completed': self.completed,
+                'last_sweep': self.last_sweep.isoformat() if self.last_sweep else None,
+                'last_rate': round(self.last_rate, 1),
+            }
+
+
+expiry = ExpirySweeper()
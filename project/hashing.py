@@ -0,0 +1,238 @@
+"""Bounded worker pool for bcrypt.
+
+bcrypt is CPU-bound on purpose. Running it inline lets a login storm take
+every request thread and every core; here hashing goes through a fixed
+number of workers with a bounded backlog. When the backlog is full the
+caller gets HashingBusy right away instead of queueing without limit.
+
+HASHING_ROUNDS is the cost of new hashes; calibrate() (`flask
+calibrate-bcrypt`) finds the cost that fits a latency budget on this host.
+A login with a hash of another cost schedules rehash_later(), which hashes
+again at the configured cost on a background thread and lets the caller
+store the result, so the login itself pays only for the check.
+
+Config:
+    HASHING_EXECUTOR    'thread' (default), 'process' or 'inline'
+    HASHING_WORKERS     pool size, default: number of CPUs
+    HASHING_QUEUE_SIZE  jobs allowed to wait for a worker, default: 4 per worker
+    HASHING_TIMEOUT     seconds to wait for a free slot before HashingBusy, default: 0.5
+    HASHING_ROUNDS      bcrypt log2 cost of new hashes, default: 5 (4, the minimum, for test fixtures)
+    HASHING_REHASH      rehash passwords of another cost on login, default: True
+    HASHING_REHASH_QUEUE  rehashes allowed to wait, more are skipped until the next login, default: 100
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+from loguru import logger
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _hashpw(password: bytes, salt: bytes):
+    started = time.perf_counter()
+    hashed = bcrypt.hashpw(password, salt)
+    return hashed, time.perf_counter() - started
+
+
+def _checkpw(password: bytes, hashed: bytes):
+    started = time.perf_counter()
+    ok = bcrypt.checkpw(password, hashed)
+    return ok, time.perf_counter() - started
+
+
+def cost_of(hashed: str) -> int:
+    """The log2 cost stored in a bcrypt hash ('$2b$12$...' -> 12)."""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        raise ValueError('not a bcrypt hash') from None
+
+
+def calibrate(target_ms: float, min_rounds: int = MIN_ROUNDS, max_rounds: int = 16, samples: int = 3):
+    """Time one hash per cost on this host, from min_rounds up until a cost is over the target.
+
+    Returns (the highest cost whose median time fits target_ms, {cost: median ms}).
+    Every cost step doubles the time, so the loop stops soon after the target.
+    """
+    best, timings = min_rounds, {}
+    for rounds in range(min_rounds, max_rounds + 1):
+        runs = sorted(_hashpw(b'calibration', bcrypt.gensalt(rounds))[1] for _ in range(samples))
+        timings[rounds] = runs[len(runs) // 2] * 1000
+        if timings[rounds] > target_ms:
+            break
+        best = rounds
+    return best, timings
+
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.kind = 'inline'
+        self.workers = 0
+        self.queue_size = 0
+        self.timeout = 0
+        self.rounds = 5
+        self.rehash = True
+        self.app = None
+        self._executor = None
+        self._rehash_executor = None
+        self._rehash_slots = BoundedSemaphore(100)
+        self._slots = None
+        self._lock = Lock()
+        self._reset_counters()
+        if app is not None:
+            self.init_app(app)
+
+    def _reset_counters(self):
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.hash_seconds = 0.0
+        self.max_hash_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.rehashed = 0
+        self.rehash_skipped = 0
+
+    def init_app(self, app):
+        self.shutdown()
+        self.kind = app.config.get('HASHING_EXECUTOR', 'thread')
+        if self.kind not in ('thread', 'process', 'inline'):
+            raise ValueError(f'unknown HASHING_EXECUTOR {self.kind!r}')
+        self.workers = app.config.get('HASHING_WORKERS', os.cpu_count() or 1)
+        self.queue_size = app.config.get('HASHING_QUEUE_SIZE', self.workers * 4)
+        self.timeout = app.config.get('HASHING_TIMEOUT', 0.5)
+        self.rounds = app.config.get('HASHING_ROUNDS', 5)
+        if not MIN_ROUNDS <= self.rounds <= MAX_ROUNDS:
+            raise ValueError(f'HASHING_ROUNDS must be between {MIN_ROUNDS} and {MAX_ROUNDS}')
+        self.rehash = app.config.get('HASHING_REHASH', True)
+        self._rehash_slots = BoundedSemaphore(app.config.get('HASHING_REHASH_QUEUE', 100))
+        self.app = app
+        self._slots = BoundedSemaphore(self.workers + self.queue_size)
+        app.extensions['hasher'] = self
+        app.extensions.setdefault('stats', {})['hashing'] = self.stats
+
+    def _get_executor(self):
+        # created on first use, so a pre-forking server doesn't share pool workers between processes
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    pool = ProcessPoolExecutor if self.kind == 'process' else ThreadPoolExecutor
+                    self._executor = pool(max_workers=self.workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._rehash_executor is not None:
+            self._rehash_executor.shutdown(wait=False)
+            self._rehash_executor = None
+
+    def _run(self, fn, *args):
+        if self.kind == 'inline' or self._slots is None:
+            result, elapsed = fn(*args)
+            self._account(elapsed, 0.0)
+            return result
+
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy('password hashing queue is full')
+        try:
+            with self._lock:
+                self.in_flight += 1
+            submitted = time.perf_counter()
+            result, elapsed = self._get_executor().submit(fn, *args).result()
+            self._account(elapsed, time.perf_counter() - submitted - elapsed)
+            return result
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def _account(self, elapsed, waited):
+        with self._lock:
+            self.completed += 1
+            self.hash_seconds += elapsed
+            self.wait_seconds += waited
+            self.max_hash_seconds = max(self.max_hash_seconds, elapsed)
+
+    def gensalt(self) -> bytes:
+        return bcrypt.gensalt(self.rounds)
+
+    def hash_password(self, password: str, salt: bytes) -> str:
+        return self._run(_hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def check_password(self, password: str, hashed: str) -> bool:
+        return self._run(_checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return self.rehash and cost_of(hashed) != self.rounds
+
+    def rehash_later(self, password: str, store) -> bool:
+        """Hash the password at the configured cost off the request and call store(new_hash).
+
+        store runs in an app context of its own (inline with the 'inline'
+        executor). Returns False when the rehash queue is full; the next
+        login tries again.
+        """
+        if not self._rehash_slots.acquire(blocking=False):
+            with self._lock:
+                self.rehash_skipped += 1
+            return False
+        if self.kind == 'inline' or self.app is None:
+            self._rehash(password, store)
+            return True
+        if self._rehash_executor is None:
+            with self._lock:
+                if self._rehash_executor is None:
+                    self._rehash_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bcrypt-rehash')
+        self._rehash_executor.submit(self._rehash_in_context, password, store)
+        return True
+
+    def _rehash_in_context(self, password, store):
+        with self.app.app_context():
+            self._rehash(password, store)
+
+    def _rehash(self, password, store):
+        try:
+            store(self.hash_password(password, self.gensalt()))
+        except HashingBusy:
+            with self._lock:
+                self.rehash_skipped += 1
+        except Exception:
+            logger.exception('password rehash failed')
+        else:
+            with self._lock:
+                self.rehashed += 1
+        finally:
+            self._rehash_slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self.completed or 1
+            return {
+                'executor': self.kind,
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'in_flight': self.in_flight,
+                'queue_depth': max(0, self.in_flight - self.workers),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_hash_ms': round(self.hash_seconds / completed * 1000, 2),
+                'max_hash_ms': round(self.max_hash_seconds * 1000, 2),
+                'avg_wait_ms': round(self.wait_seconds / completed * 1000, 2),
+                'rehashed': self.rehashed,
+                'rehash_skipped': self.rehash_skipped,
+            }
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,195 @@
+"""Logging pipeline.
+
+One loguru file sink written by a background thread: request threads only
+format the record and put it on a queue, the writer thread does the file
+I/O through a buffered file with rotation and compression. The buffer is
+written out with every WARNING and above, and at least every
+LOG_FLUSH_INTERVAL seconds while records come in, so a crash loses a
+second of INFO records at most, never an error. Records are JSON lines
+with the request id, and the traceback of a logged exception. Every
+request gets one access record with its latency. High-volume endpoints can
+keep only a share of their INFO records: the decision is made once per
+request, so a sampled request keeps all of its records.
+
+The writer thread belongs to the process that added the sink. The workers
+of project.server give up the sink they inherit from the master for one of
+their own, writing to a file per worker slot: logger.log becomes
+logger-0.log, logger-1.log, ...
+
+Config:
+    LOG_FILE          'logger.log'
+    LOG_LEVEL         'INFO'
+    LOG_JSON          JSON lines instead of plain text (default True)
+    LOG_ENQUEUE       write from a background thread (default True)
+    LOG_BUFFERING     write buffer of the file in bytes (default 65536)
+    LOG_FLUSH_INTERVAL  seconds between flushes of the buffer (default 1)
+    LOG_ROTATION      size of a file before rotation, '50 MB' or bytes
+    LOG_RETENTION     10
+    LOG_COMPRESSION   'gz'
+    LOG_ACCESS        one access record per request (default True)
+    LOG_SAMPLING      {endpoint: share of INFO records kept}, e.g. {'main.index': 0.05}
+"""
+import json
+import os
+import random
+import re
+import time
+import traceback
+import uuid
+
+from flask import g, has_request_context, request
+from loguru import logger
+
+INFO = logger.level('INFO').no
+WARNING = logger.level('WARNING').no
+
+SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3}
+
+_handler_id = None
+_sink_settings = None
+
+
+def _add_request_context(record):
+    if has_request_context():
+        extra = record['extra']
+        extra['request_id'] = g.get('request_id')
+        extra.setdefault('endpoint', request.endpoint)
+        extra.setdefault('sampled', g.get('log_sampled', True))
+
+
+def _keep(record):
+    return record['level'].no > INFO or record['extra'].get('sampled', True)
+
+
+def _json_format(record):
+    payload = {
+        'time': record['time'].isoformat(),
+        'level': record['level'].name,
+        'message': record['message'],
+        'module': record['name'],
+        'line': record['line'],
+    }
+    payload.update((key, value) for key, value in record['extra'].items() if key not in ('sampled', '_json'))
+    if record['exception'] is not None:
+        exc_type, value, tb = record['exception']
+        payload['exception'] = repr(value)
+        payload['traceback'] = ''.join(traceback.format_exception(exc_type, value, tb))
+    record['extra']['_json'] = json.dumps(payload, default=str, ensure_ascii=False)
+    return '{extra[_json]}\n'
+
+
+def parse_size(size) -> int:
+    """Bytes of a size given as bytes or as a string like '50 MB'."""
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?B?)\s*', str(size), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f'invalid size {size!r}, expected bytes or e.g. "50 MB"')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+class FlushingRotation:
+    """Rotation hook of the file sink that also decides when the buffer is written out.
+
+    loguru calls it with the open file before writing every record, on the
+    writer thread. The file is switched to line buffering for a WARNING or
+    above, so the write of that record flushes the buffer, and flushed
+    outright when LOG_FLUSH_INTERVAL has passed since the last flush. The
+    size of the file is counted here: loguru's own size rotation asks the
+    file for its position, which flushes it before every record.
+    """
+
+    def __init__(self, max_bytes: int, flush_interval: float):
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._flushed = time.monotonic()
+        self._file = None
+        self._size = 0
+        self._rotated = False
+
+    def __call__(self, message, file) -> bool:
+        if file is not self._file:
+            if not self._rotated:
+                # opened, nothing of it is buffered yet
+                self._size = os.fstat(file.fileno()).st_size
+            self._file, self._rotated = file, False
+
+        urgent = message.record['level'].no >= WARNING
+        if file.line_buffering != urgent:
+            file.reconfigure(line_buffering=urgent)
+        now = time.monotonic()
+        if urgent or now - self._flushed >= self.flush_interval:
+            if not urgent:
+                file.flush()
+            self._flushed = now
+
+        self._size += len(message)
+        if self._size > self.max_bytes and self._size > len(message):
+            # the record goes to the new file
+            self._size, self._rotated = len(message), True
+            return True
+        return False
+
+
+def configure_sink(config):
+    """Create the file sink from the LOG_* settings, or keep it when they didn't change."""
+    global _handler_id, _sink_settings
+    json_lines = config.get('LOG_JSON', True)
+    settings = dict(
+        sink=config.get('LOG_FILE', 'logger.log'),
+        level=config.get('LOG_LEVEL', 'INFO'),
+        format=_json_format if json_lines else '{time} | {level: <8} | {extra[request_id]} | {name}:{line} - {message}',
+        enqueue=config.get('LOG_ENQUEUE', True),
+        buffering=config.get('LOG_BUFFERING', 65536),
+        rotation=(parse_size(config.get('LOG_ROTATION', '50 MB')), config.get('LOG_FLUSH_INTERVAL', 1)),
+        retention=config.get('LOG_RETENTION', 10),
+        compression=config.get('LOG_COMPRESSION', 'gz'),
+    )
+    # every app of the process (tests, the CLI) would otherwise reopen the file and start another writer thread
+    if _handler_id is not None and settings == _sink_settings:
+        return
+    if _handler_id is not None:
+        logger.remove(_handler_id)
+
+    logger.configure(patcher=_add_request_context, extra={'request_id': None})
+    _handler_id = logger.add(**dict(settings, filter=_keep, rotation=FlushingRotation(*settings['rotation'])))
+    _sink_settings = settings
+
+
+def worker_log_file(path: str, slot: int) -> str:
+    """The file of the server worker in `slot`: logger.log -> logger-2.log."""
+    root, ext = os.path.splitext(path)
+    return f'{root}-{slot}{ext}'
+
+
+def configure_worker_sink(config, slot: int):
+    """Replace the sink a forked worker inherited with one of its own.
+
+    The inherited sink puts the records on the queue of the master's writer
+    thread; a reload executes the master again, the thread is gone and the
+    worker would block on its next record. Two processes can't share a file
+    either, each rotates it by its own count.
+    """
+    configure_sink(dict(config, LOG_FILE=worker_log_file(config.get('LOG_FILE', 'logger.log'), slot)))
+
+
+def init_logging(app):
+    configure_sink(app.config)
+
+    @app.before_request
+    def start_request_log():
+        g.request_started = time.perf_counter()
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        rate = app.config.get('LOG_SAMPLING', {}).get(request.endpoint)
+        g.log_sampled = rate is None or random.random() < rate
+
+    @app.after_request
+    def finish_request_log(response):
+        if 'request_id' not in g:
+            return response
+        response.headers['X-Request-ID'] = g.request_id
+        if app.config.get('LOG_ACCESS', True):
+            latency_ms = round((time.perf_counter() - g.request_started) * 1000, 2)
+            logger.bind(method=request.method, path=request.path, status=response.status_code,
+                        latency_ms=latency_ms).info('request')
+        return response
@@ -3,11 +3,13 @@ from flask_login import current_user
 
 from loguru import logger
 
+from project.page_cache import page_cache
 from . import main
 
 
 @main.route('/')
 @main.route('/index')
+@page_cache.cached
 def index():
     user = current_user.email if current_user.is_authenticated else 'Guest'
     logger.info(f'User {user} is at the main page')
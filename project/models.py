@@ -1,15 +1,20 @@
 from datetime import datetime
+from functools import partial
 from time import time
 
-import bcrypt
 import jwt
 from flask import current_app
+from flask_mail import Message
 
 from flask_login import UserMixin
-from sqlalchemy import text
+from sqlalchemy import text, func, DDL, event, inspect, select, update
+from sqlalchemy.dialects.postgresql import ExcludeConstraint, insert
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 
 from project import db
+from project.cache import user_cache
+from project.hashing import hasher
 
 
 class UsersGroup(db.Model):
@@ -40,6 +45,11 @@ class User(db.Model, UserMixin):
 	group = relationship('UsersGroup', back_populates='user')
 	storage_order = relationship('StorageOrder', back_populates='user')
 	
+	# one account per email, whatever the letter case; every lookup by email goes through this index
+	__table_args__ = (
+		db.Index('ix_users_email_normalized', func.lower(func.trim(email)), unique=True),
+	)
+	
 	def __init__(self, first_name: str, last_name: str, email: str, phone: str, password: str):
 		self.first_name = first_name
 		self.last_name = last_name
@@ -52,17 +62,70 @@ class User(db.Model, UserMixin):
 		
 	def __repr__(self):
 		return f'<User {self.email}, id {self.user_id}>'
+	
+	@staticmethod
+	def normalize_email(email: str) -> str:
+		return email.strip().lower()
+	
+	@hybrid_property
+	def email_normalized(self):
+		return self.normalize_email(self.email)
+	
+	@email_normalized.expression
+	def email_normalized(cls):
+		# must stay the same expression as ix_users_email_normalized
+		return func.lower(func.trim(cls.email))
+	
+	@classmethod
+	def by_email(cls, email: str):
+		return cls.query.filter(cls.email_normalized == cls.normalize_email(email)).first()
+	
+	@classmethod
+	def insert_unique(cls, user: 'User'):
+		"""INSERT ... ON CONFLICT DO NOTHING RETURNING the new row, in one round trip.
+
+		Returns the persistent user, or None when the email is already registered.
+		The caller commits.
+		"""
+		values = {}
+		for prop in inspect(cls).column_attrs:
+			value = getattr(user, prop.key)
+			if value is not None:
+				values[prop.columns[0]] = value
+		stmt = insert(cls.__table__) \
+			.values(values) \
+			.on_conflict_do_nothing(index_elements=[cls.email_normalized]) \
+			.returning(*cls.__table__.c)
+		return db.session.execute(select(cls).from_statement(stmt)).scalar_one_or_none()
 		
 	def get_id(self):
 		return self.user_id
 	
 	def set_password(self, password: str) -> None:
-		self.salt = bcrypt.gensalt(5)
-		hashed_password = bcrypt.hashpw(password.encode('utf-8'), self.salt)
-		self.password = hashed_password.decode('utf-8')
+		salt = hasher.gensalt()
+		self.password = hasher.hash_password(password, salt)
+		self.salt = salt.decode('utf-8')
 	
 	def check_password(self, password: str) -> bool:
-		return bcrypt.checkpw(password.encode('utf-8'), self.password.encode('utf-8'))
+		return hasher.check_password(password, self.password)
+	
+	def rehash_password_later(self, password: str) -> None:
+		"""After a successful check: rehash in the background if the stored hash has another cost."""
+		if hasher.needs_rehash(self.password):
+			hasher.rehash_later(password, partial(User._store_rehash, self.user_id, self.password))
+	
+	@staticmethod
+	def _store_rehash(user_id: int, old_hash: str, new_hash: str) -> None:
+		# only if the password didn't change meanwhile
+		updated = db.session.execute(
+			update(User.__table__)
+			.where(User.__table__.c.user_id == user_id, User.__table__.c.password == old_hash)
+			.values(password=new_hash, salt=new_hash[:29])
+		).rowcount
+		db.session.commit()
+		if updated:
+			# a core UPDATE doesn't go through the attribute events
+			user_cache.invalidate(user_id)
 	
 	def get_reset_password_token(self, expires_in=600):
 		return jwt.encode(
@@ -85,6 +148,10 @@ class StorageOrder(db.Model):
 	stop_date = db.Column('stop_date', db.Date, nullable=False)
 	storage_order_cost = db.Column('storage_order_cost', db.Integer, nullable=False)
 	created = db.Column('created', db.DateTime)
+	# set by the expiry sweeper once stop_date has passed
+	completed = db.Column('completed', db.DateTime)
+	# set when the stop_date reminder is handed to the outbox
+	reminded = db.Column('reminded', db.DateTime)
 
 	user_id = db.Column(db.ForeignKey('users.user_id', ondelete='CASCADE'), nullable=False)
 	shelf_id = db.Column(db.ForeignKey('warehouse.shelf_id'), nullable=False)
@@ -92,6 +159,26 @@ class StorageOrder(db.Model):
 	shelf = relationship('Warehouse', back_populates='storage_order')
 	user = relationship('User', back_populates='storage_order')
 
+	# one shelf can't be booked twice for overlapping dates (both dates inclusive)
+	__table_args__ = (
+		# profile page: one user's orders, newest first
+		db.Index('ix_storage_orders_user_id_order', user_id, storage_order_id),
+		# expiry sweeper: open orders by stop_date, completed rows drop out of the index
+		db.Index('ix_storage_orders_open', stop_date, storage_order_id, postgresql_where=text('completed IS NULL')),
+		# reminder digests: orders still to remind, by stop_date
+		db.Index('ix_storage_orders_reminder_due', stop_date, postgresql_where=text('reminded IS NULL')),
+		ExcludeConstraint(
+			(shelf_id, '='),
+			(func.daterange(start_date, stop_date, text("'[]'")), '&&'),
+			name='storage_orders_shelf_dates_excl',
+			using='gist'
+		),
+	)
+
+
+# the exclusion constraint mixes a scalar `=` with a range `&&` in one GiST index
+event.listen(StorageOrder.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+
 
 class Warehouse(db.Model):
 	__tablename__ = 'warehouse'
@@ -112,4 +199,29 @@ class Size(db.Model):
 	size_name = db.Column('size_name', db.Integer)
 
 	warehouse = relationship('Warehouse', back_populates='size')
-	
\ No newline at end of file
+	
+
+class OutboxEmail(db.Model):
+	__tablename__ = 'email_outbox'
+
+	email_id = db.Column('email_id', db.Integer, primary_key=True, autoincrement=True)
+	subject = db.Column('subject', db.String, nullable=False)
+	recipients = db.Column('recipients', db.String, nullable=False)
+	text_body = db.Column('text_body', db.Text)
+	html_body = db.Column('html_body', db.Text)
+	attempts = db.Column('attempts', db.Integer, nullable=False, server_default=text("0"))
+	next_attempt = db.Column('next_attempt', db.DateTime, nullable=False)
+	last_error = db.Column('last_error', db.String)
+	sent = db.Column('sent', db.DateTime)
+	created = db.Column('created', db.DateTime)
+
+	# the sender only ever looks at unsent rows, ordered by next_attempt
+	__table_args__ = (
+		db.Index('ix_email_outbox_pending', 'next_attempt', postgresql_where=text('sent IS NULL')),
+	)
+
+	def to_message(self) -> Message:
+		msg = Message(self.subject, recipients=self.recipients.split(','))
+		msg.body = self.text_body
+		msg.html = self.html_body
+		return msg
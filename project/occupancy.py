@@ -0,0 +1,244 @@
+"""Daily shelf occupancy grid.
+
+A shelves x days boolean grid (True = booked) covering OCCUPANCY_DAYS from
+the day it was built. "How many shelves of each size are free on each day"
+is a column sum over the rows of the size, "which shelves are free for the
+whole window" an any() over a slice; both are single NumPy reductions. The
+grid is built from warehouse and storage_orders with one vectorized pass
+and then follows the committed order changes from project.order_events.
+
+With OCCUPANCY_FILE set the grid lives in a memory-mapped .npy file: the
+first process builds it, the other workers map the same file instead of
+rebuilding, and since every process writes its own committed changes into
+the shared mapping they all see one copy. Shelves added after the build and
+the moving window need a rebuild (`flask build-occupancy`, e.g. nightly).
+Building and replacing the files is done under an exclusive flock() of
+OCCUPANCY_FILE.lock, so two processes never interleave their files, and a
+process that finds a newer grid file than the one it maps (checked on every
+read, one stat()) maps the new one.
+
+Config:
+    OCCUPANCY_DAYS   days covered from the build day (default 366)
+    OCCUPANCY_FILE   path of the shared grid, without extension (default: in-memory only)
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from datetime import date, timedelta
+from threading import RLock
+
+import numpy as np
+from loguru import logger
+
+from project import db, order_events
+from project.models import StorageOrder, Warehouse
+
+
+class OccupancyError(ValueError):
+    pass
+
+
+class OccupancyMap:
+    def __init__(self, app=None):
+        self._lock = RLock()
+        self.days = 366
+        self.path = None
+        self.first_day = date.today()
+        self._shelf_ids = np.empty(0, dtype=np.int64)
+        self._size_ids = np.empty(0, dtype=np.int64)
+        self._grid = np.zeros((0, self.days), dtype=np.bool_)
+        self._inode = None
+        self.loaded = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.days = app.config.get('OCCUPANCY_DAYS', 366)
+        self.path = app.config.get('OCCUPANCY_FILE')
+        app.extensions['occupancy'] = self
+        app.extensions.setdefault('stats', {})['occupancy'] = self.stats
+        order_events.subscribe(self)
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        with open(f'{self.path}.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def build(self, first_day: date = None) -> None:
+        """(Re)build the grid from the DB, and write it to OCCUPANCY_FILE if set."""
+        if self.path:
+            with self._file_lock(exclusive=True):
+                self._build(first_day)
+        else:
+            self._build(first_day)
+
+    def _build(self, first_day):
+        first_day = first_day or date.today()
+        last_day = first_day + timedelta(days=self.days - 1)
+        shelves = db.session.query(Warehouse.shelf_id, Warehouse.size_id) \
+            .filter(Warehouse.active.is_(True)) \
+            .order_by(Warehouse.shelf_id) \
+            .all()
+        shelf_ids = np.array([shelf_id for shelf_id, _ in shelves], dtype=np.int64)
+        size_ids = np.array([size_id for _, size_id in shelves], dtype=np.int64)
+
+        orders = db.session.query(StorageOrder.shelf_id, StorageOrder.start_date, StorageOrder.stop_date) \
+            .filter(StorageOrder.stop_date >= first_day, StorageOrder.start_date <= last_day) \
+            .all()
+        first = first_day.toordinal()
+        order_shelves = np.fromiter((row[0] for row in orders), dtype=np.int64, count=len(orders))
+        starts = np.fromiter((row[1].toordinal() - first for row in orders), dtype=np.int64, count=len(orders))
+        stops = np.fromiter((row[2].toordinal() - first for row in orders), dtype=np.int64, count=len(orders))
+
+        rows = np.searchsorted(shelf_ids, order_shelves)
+        known = rows < len(shelf_ids)
+        known[known] = shelf_ids[rows[known]] == order_shelves[known]
+        rows, starts, stops = rows[known], starts[known], stops[known]
+
+        # +1 at the first booked day, -1 after the last: the running sum is the number of bookings per day
+        marks = np.zeros((len(shelf_ids), self.days + 1), dtype=np.int32)
+        np.add.at(marks, (rows, np.clip(starts, 0, self.days)), 1)
+        np.add.at(marks, (rows, np.clip(stops + 1, 0, self.days)), -1)
+        booked = np.cumsum(marks, axis=1)[:, :self.days] > 0
+
+        if self.path:
+            booked = self._save(booked, shelf_ids, size_ids, first_day)
+        with self._lock:
+            self._grid, self._shelf_ids, self._size_ids = booked, shelf_ids, size_ids
+            self.first_day = first_day
+            self.loaded = True
+        logger.info(f'occupancy grid built: {len(shelf_ids)} shelves x {self.days} days, {len(rows)} orders')
+
+    def _save(self, booked, shelf_ids, size_ids, first_day):
+        tmp = f'{self.path}.tmp'
+        grid = np.lib.format.open_memmap(f'{tmp}.npy', mode='w+', dtype=np.bool_, shape=booked.shape)
+        grid[:] = booked
+        grid.flush()
+        np.savez(f'{tmp}.npz', shelf_ids=shelf_ids, size_ids=size_ids)
+        with open(f'{tmp}.json', 'w') as f:
+            json.dump({'first_day': first_day.isoformat(), 'days': self.days}, f)
+        # the grid file is replaced last, a reader never sees a grid with someone else's metadata
+        for ext in ('npz', 'json', 'npy'):
+            os.replace(f'{tmp}.{ext}', f'{self.path}.{ext}')
+        self._inode = os.stat(f'{self.path}.npy').st_ino
+        return np.load(f'{self.path}.npy', mmap_mode='r+')
+
+    def open(self, locked: bool = False) -> bool:
+        """Map the grid written by another process. Returns False if there is none for today.
+
+        `locked` tells the caller already holds the exclusive lock of the file.
+        """
+        if not locked:
+            with self._file_lock(exclusive=False):
+                return self.open(locked=True)
+        try:
+            with open(f'{self.path}.json') as f:
+                meta = json.load(f)
+            ids = np.load(f'{self.path}.npz')
+            inode = os.stat(f'{self.path}.npy').st_ino
+            grid = np.load(f'{self.path}.npy', mmap_mode='r+')
+        except FileNotFoundError:
+            return False
+        first_day = date.fromisoformat(meta['first_day'])
+        if first_day != date.today() or meta['days'] != self.days:
+            return False
+        with self._lock:
+            self._grid, self._shelf_ids, self._size_ids = grid, ids['shelf_ids'], ids['size_ids']
+            self._inode = inode
+            self.first_day = first_day
+            self.days = meta['days']
+            self.loaded = True
+        logger.info(f'occupancy grid mapped from {self.path}.npy')
+        return True
+
+    def _replaced(self) -> bool:
+        try:
+            return os.stat(f'{self.path}.npy').st_ino != self._inode
+        except FileNotFoundError:
+            return False
+
+    def ensure_loaded(self) -> None:
+        if self.loaded:
+            # rebuilt by another process (`flask build-occupancy`): map the new grid
+            if self.path and self._replaced():
+                self.open()
+            return
+        if not self.path:
+            self.build()
+        elif not self.open():
+            with self._file_lock(exclusive=True):
+                # another process may have built it while this one waited for the lock
+                if not self.open(locked=True):
+                    self._build(None)
+
+    def _window(self, start_date: date, stop_date: date):
+        if start_date > stop_date:
+            raise OccupancyError('start_date is after stop_date')
+        start = start_date.toordinal() - self.first_day.toordinal()
+        stop = stop_date.toordinal() - self.first_day.toordinal()
+        if start < 0 or stop >= self.days:
+            raise OccupancyError(f'dates are outside of the grid ({self.first_day}, {self.days} days)')
+        return start, stop + 1
+
+    def _mark(self, shelf_id, start_date, stop_date, booked):
+        with self._lock:
+            if not self.loaded:
+                return
+            row = np.searchsorted(self._shelf_ids, shelf_id)
+            if row == len(self._shelf_ids) or self._shelf_ids[row] != shelf_id:
+                return
+            first = self.first_day.toordinal()
+            start = max(start_date.toordinal() - first, 0)
+            stop = min(stop_date.toordinal() - first, self.days - 1)
+            if start <= stop:
+                self._grid[row, start:stop + 1] = booked
+
+    def add_order(self, order_id: int, shelf_id: int, start_date: date, stop_date: date) -> None:
+        self._mark(shelf_id, start_date, stop_date, True)
+
+    def remove_order(self, order_id: int, shelf_id: int, start_date: date, stop_date: date) -> None:
+        # bookings of one shelf never overlap, so the days of this order are free again
+        self._mark(shelf_id, start_date, stop_date, False)
+
+    def free_counts(self, start_date: date, stop_date: date) -> dict:
+        """{size_id: free shelves per day} for every day of the window."""
+        self.ensure_loaded()
+        start, stop = self._window(start_date, stop_date)
+        with self._lock:
+            free = ~self._grid[:, start:stop]
+            sizes, rows = np.unique(self._size_ids, return_inverse=True)
+            counts = np.zeros((len(sizes), stop - start), dtype=np.int64)
+            np.add.at(counts, rows, free)
+        return {int(size_id): counts[i] for i, size_id in enumerate(sizes)}
+
+    def free_shelves(self, size_id: int, start_date: date, stop_date: date) -> np.ndarray:
+        """Ids of the shelves of the size with no booking in the window."""
+        self.ensure_loaded()
+        start, stop = self._window(start_date, stop_date)
+        with self._lock:
+            rows = self._size_ids == size_id
+            free = ~self._grid[rows, start:stop].any(axis=1)
+            return self._shelf_ids[rows][free]
+
+    def free_count(self, size_id: int, start_date: date, stop_date: date) -> int:
+        """Number of shelves of the size free for the whole window."""
+        return len(self.free_shelves(size_id, start_date, stop_date))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'loaded': self.loaded,
+                'shelves': len(self._shelf_ids),
+                'days': self.days,
+                'first_day': self.first_day.isoformat(),
+                'booked_share': round(float(self._grid.mean()), 4) if self._grid.size else 0.0,
+                'shared_file': self.path,
+            }
+
+
+occupancy = OccupancyMap()
@@ -0,0 +1,82 @@
+"""Committed StorageOrder changes for the in-memory indexes that mirror the table.
+
+Listeners subscribe with add_order(order_id, shelf_id, start_date, stop_date)
+and remove_order(order_id, shelf_id, start_date, stop_date) methods. Changes
+made through the ORM are collected at flush and delivered after COMMIT;
+a rollback drops them. A moved order arrives as remove (old values) + add.
+Code writing with Core statements records its changes with record().
+"""
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from project.models import StorageOrder
+
+SESSION_CHANGES_KEY = 'storage_order_changes'
+
+_listeners = []
+
+
+def subscribe(listener) -> None:
+    if listener not in _listeners:
+        _listeners.append(listener)
+    if not event.contains(Session, 'after_flush', _collect_order_changes):
+        event.listen(Session, 'after_flush', _collect_order_changes)
+        event.listen(Session, 'after_commit', _apply_order_changes)
+        event.listen(Session, 'after_soft_rollback', _drop_order_changes)
+        # load the old value before a change of an expired attribute, removals need it
+        for attr in (StorageOrder.shelf_id, StorageOrder.start_date, StorageOrder.stop_date):
+            event.listen(attr, 'set', _keep_old_value, active_history=True)
+
+
+def record(session, action: str, snapshot: tuple) -> None:
+    """Deliver an 'add' or 'remove' of (order_id, shelf_id, start_date, stop_date) after the next COMMIT."""
+    session.info.setdefault(SESSION_CHANGES_KEY, []).append((action, snapshot))
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+def _snapshot(order):
+    return order.storage_order_id, order.shelf_id, order.start_date, order.stop_date
+
+
+def _old_snapshot(order):
+    # attribute history is only reset after after_flush, deleted holds the pre-flush values
+    state = inspect(order)
+    values = []
+    for key in ('shelf_id', 'start_date', 'stop_date'):
+        history = state.attrs[key].history
+        values.append(history.deleted[0] if history.deleted else getattr(order, key))
+    return (order.storage_order_id, *values)
+
+
+def _collect_order_changes(session, flush_context):
+    changes = session.info.setdefault(SESSION_CHANGES_KEY, [])
+    for obj in session.new:
+        if isinstance(obj, StorageOrder):
+            changes.append(('add', _snapshot(obj)))
+    for obj in session.dirty:
+        if isinstance(obj, StorageOrder) and session.is_modified(obj):
+            changes.append(('remove', _old_snapshot(obj)))
+            changes.append(('add', _snapshot(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, StorageOrder):
+            changes.append(('remove', _old_snapshot(obj)))
+
+
+def _apply_order_changes(session):
+    changes = session.info.pop(SESSION_CHANGES_KEY, None)
+    if not changes:
+        return
+    for action, snapshot in changes:
+        for listener in _listeners:
+            if action == 'add':
+                listener.add_order(*snapshot)
+            else:
+                listener.remove_order(*snapshot)
+
+
+def _drop_order_changes(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(SESSION_CHANGES_KEY, None)
@@ -0,0 +1,251 @@
+"""Persistent email outbox and its background sender.
+
+send_email() only inserts a row into email_outbox. Sender threads drain
+the outbox in batches, sending each batch over a single SMTP connection,
+so MAIL_OUTBOX_WORKERS threads keep a pool of that many connections busy.
+Failed messages are retried with exponential backoff. A batch is claimed
+in its own transaction, committed before the SMTP exchange: the due rows,
+picked with FOR UPDATE SKIP LOCKED so several threads and processes can
+drain one outbox, are counted an attempt and leased to the sender for
+MAIL_OUTBOX_CLAIM seconds by moving their next_attempt. No row lock is
+held while talking to the SMTP server, and the rows of a sender that dies
+before recording the outcome are retried once the lease is over, not sent
+again by the next sender meanwhile. MAIL_OUTBOX_RATE caps the messages per
+second of one process.
+
+Config:
+    MAIL_OUTBOX               False sends inline with mail.send() (default True)
+    MAIL_OUTBOX_WORKER        start the sender threads with the app (default True)
+    MAIL_OUTBOX_WORKERS       sender threads, i.e. SMTP connections, per process (default 1)
+    MAIL_OUTBOX_RATE          messages per second per process, 0 for no limit (default 0)
+    MAIL_OUTBOX_BATCH         messages per SMTP connection (default 50)
+    MAIL_OUTBOX_INTERVAL      seconds between polls of an empty outbox (default 5)
+    MAIL_OUTBOX_MAX_ATTEMPTS  give up on a message after that many failures (default 5)
+    MAIL_OUTBOX_BACKOFF       seconds before the first retry, doubled every time (default 30)
+    MAIL_OUTBOX_CLAIM         seconds a claimed batch has to be sent in (default 300)
+"""
+import time
+from datetime import datetime, timedelta
+from smtplib import SMTPException
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+
+from loguru import logger
+from sqlalchemy import select, update
+
+from project import db, mail
+from project.models import OutboxEmail
+
+
+class RateLimit:
+    """Spaces calls to wait() at least 1/rate seconds apart, across threads."""
+
+    def __init__(self, rate=0):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(self._next, now)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class OutboxSender:
+    def __init__(self, app=None):
+        self.app = None
+        self._threads = []
+        self._wakeup = Event()
+        self._stopping = Event()
+        self._lock = Lock()
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_rate = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('MAIL_OUTBOX_BATCH', 50)
+        self.interval = app.config.get('MAIL_OUTBOX_INTERVAL', 5)
+        self.max_attempts = app.config.get('MAIL_OUTBOX_MAX_ATTEMPTS', 5)
+        self.backoff = app.config.get('MAIL_OUTBOX_BACKOFF', 30)
+        self.claim = app.config.get('MAIL_OUTBOX_CLAIM', 300)
+        self.workers = app.config.get('MAIL_OUTBOX_WORKERS', 1)
+        self.rate_limit = RateLimit(app.config.get('MAIL_OUTBOX_RATE', 0))
+        app.extensions['outbox'] = self
+        app.extensions.setdefault('stats', {})['outbox'] = self.stats
+        if app.config.get('MAIL_OUTBOX', True) and app.config.get('MAIL_OUTBOX_WORKER', True):
+            # started lazily, so a pre-forking server starts one sender per worker process
+            app.before_first_request(self.start)
+
+    def enqueue(self, subject, recipients, text_body, html_body) -> OutboxEmail:
+        now = datetime.now()
+        email = OutboxEmail(subject=subject, recipients=','.join(recipients), text_body=text_body,
+                            html_body=html_body, attempts=0, next_attempt=now, created=now)
+        db.session.add(email)
+        db.session.commit()
+        self._wakeup.set()
+        return email
+
+    def stage_many(self, messages) -> int:
+        """Insert (subject, recipients, text_body, html_body) messages with one statement, without committing.
+
+        They are sent once the caller commits, so whatever the caller writes
+        in the same transaction and the messages are kept or lost together.
+        """
+        now = datetime.now()
+        rows = [{'subject': subject, 'recipients': ','.join(recipients), 'text_body': text_body,
+                 'html_body': html_body, 'attempts': 0, 'next_attempt': now, 'created': now}
+                for subject, recipients, text_body, html_body in messages]
+        if rows:
+            db.session.execute(OutboxEmail.__table__.insert(), rows)
+        return len(rows)
+
+    def wake_up(self):
+        self._wakeup.set()
+
+    def start(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = Thread(target=self._run, name=f'outbox-sender-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        logger.info('outbox sender started')
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    processed = self.send_batch()
+                except Exception:
+                    logger.exception('outbox sender failed')
+                    db.session.rollback()
+                    processed = 0
+                finally:
+                    db.session.remove()
+            if not processed:
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+
+    def _claim_batch(self) -> list:
+        """Lease a batch of due messages to this sender and commit. Returns transient OutboxEmails."""
+        now = datetime.now()
+        table = OutboxEmail.__table__
+        due = select(table.c.email_id) \
+            .where(table.c.sent.is_(None),
+                   table.c.attempts < self.max_attempts,
+                   table.c.next_attempt <= now) \
+            .order_by(table.c.next_attempt) \
+            .limit(self.batch_size) \
+            .with_for_update(skip_locked=True)
+        rows = db.session.execute(
+            update(table)
+            .where(table.c.email_id.in_(due.scalar_subquery()))
+            .values(attempts=table.c.attempts + 1, next_attempt=now + timedelta(seconds=self.claim))
+            .returning(*table.c)
+        ).fetchall()
+        db.session.commit()
+        return sorted((OutboxEmail(**row._mapping) for row in rows), key=lambda email: email.email_id)
+
+    def _failed(self, email, error) -> dict:
+        """The values of a failed message: its next attempt after the backoff of the attempts made."""
+        if email.attempts >= self.max_attempts:
+            logger.error(f'giving up on email {email.email_id} to {email.recipients}: {error}')
+        return dict(email_id=email.email_id, last_error=str(error)[:500],
+                    next_attempt=datetime.now() + timedelta(seconds=self.backoff * 2 ** (email.attempts - 1)))
+
+    def send_batch(self) -> int:
+        """Send one batch of due messages over one SMTP connection. Returns the batch size."""
+        batch = self._claim_batch()
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        sent_ids, failed = [], []
+        pending = list(batch)
+        try:
+            with mail.connect() as connection:
+                while pending:
+                    email = pending.pop(0)
+                    self.rate_limit.wait()
+                    try:
+                        connection.send(email.to_message())
+                    except (SMTPException, OSError) as e:
+                        failed.append(self._failed(email, e))
+                    else:
+                        sent_ids.append(email.email_id)
+        except (SMTPException, OSError) as e:
+            # could not connect or the connection dropped: whatever is left is retried later
+            failed.extend(self._failed(email, e) for email in pending)
+        self._record(sent_ids, failed)
+        sent = len(sent_ids)
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.batches += 1
+            self.sent += sent
+            self.failed += len(batch) - sent
+            self.last_batch_rate = sent / elapsed if elapsed else 0.0
+        logger.info(f'outbox batch: {sent} of {len(batch)} sent in {elapsed * 1000:.0f} ms, '
+                    f'{self.last_batch_rate:.1f} msg/s')
+        return len(batch)
+
+    @staticmethod
+    def _record(sent_ids: list, failed: list) -> None:
+        """Mark the sent messages, reschedule the failed ones (values of _failed()), and commit."""
+        table = OutboxEmail.__table__
+        if sent_ids:
+            db.session.execute(update(table).where(table.c.email_id.in_(sent_ids)).values(sent=datetime.now()))
+        for values in failed:
+            db.session.execute(update(table).where(table.c.email_id == values.pop('email_id')).values(**values))
+        db.session.commit()
+
+    def drain(self, workers: int = 1) -> int:
+        """Send everything that is due now, batch after batch, over `workers` connections at once."""
+        if workers > 1:
+            with ThreadPoolExecutor(workers, thread_name_prefix='outbox-drain') as pool:
+                return sum(pool.map(lambda _: self._drain_in_context(), range(workers)))
+        total = 0
+        while True:
+            processed = self.send_batch()
+            if not processed:
+                return total
+            total += processed
+
+    def _drain_in_context(self) -> int:
+        with self.app.app_context():
+            try:
+                return self.drain()
+            finally:
+                db.session.remove()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'running': sum(thread.is_alive() for thread in self._threads),
+                'batches': self.batches,
+                'sent': self.sent,
+                'failed': self.failed,
+                'last_batch_rate': round(self.last_batch_rate, 1),
+            }
+
+
+outbox = OutboxSender()
@@ -0,0 +1,131 @@
+"""Whole rendered pages for anonymous visitors.
+
+A guest sees the same index and error pages as every other guest, so the
+response of the first one is kept and replayed: status, Content-Type and
+body under a key (the request host and path, or a fixed key for the error
+pages), with an ETag, so a browser holding the page gets a 304 back.
+
+The cache is bypassed when the user is logged in, the session holds
+flashed messages or the reads of the visitor still stick to the primary
+(see project.replicas). A response is not kept when rendering it put something
+in the session other than the bookkeeping of Flask-Login (which marks every
+non-empty session of a guest, e.g. after a logout), when it sets a cookie
+or when it is larger than PAGE_CACHE_MAX_BYTES. An entry never holds the
+session cookie of the visitor who rendered it, and the answers are sent
+with Cache-Control: private, no-cache and Vary: Cookie, so that shared
+caches keep out of it and browsers revalidate with the ETag. Entries expire
+after PAGE_CACHE_TTL seconds; the local backend keeps at most
+PAGE_CACHE_SIZE of them (LRU).
+
+    @main.route('/index')
+    @page_cache.cached
+    def index(): ...
+
+    return page_cache.respond('errors/404', lambda: (render_template('errors/404.html'), 404))
+
+Config:
+    PAGE_CACHE_ENABLED    default True
+    PAGE_CACHE_BACKEND    'local' or 'redis' (default: CACHE_BACKEND, see project.cache)
+    PAGE_CACHE_TTL        seconds (default 60)
+    PAGE_CACHE_SIZE       max entries of the local backend (default 256)
+    PAGE_CACHE_MAX_BYTES  larger bodies are not cached (default 256 KB)
+"""
+import time
+from functools import wraps
+from hashlib import md5
+
+from flask import make_response, request, session
+from flask_login import current_user
+
+from project.cache import make_cache
+from project.replicas import STICKY_KEY
+
+KEPT_HEADERS = ('Content-Type', 'Content-Language')
+# written by Flask-Login on the requests of guests too, nothing a page shows
+LOGIN_BOOKKEEPING = frozenset(('_fresh', '_id', '_remember', '_remember_seconds'))
+
+
+class PageCache:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_bytes = 256 * 1024
+        self._cache = None
+        self.bypassed = 0
+        self.not_modified = 0
+        self.uncacheable = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PAGE_CACHE_ENABLED', True)
+        self.max_bytes = app.config.get('PAGE_CACHE_MAX_BYTES', 256 * 1024)
+        self._cache = make_cache(app, 'page', maxsize=app.config.get('PAGE_CACHE_SIZE', 256),
+                                 ttl=app.config.get('PAGE_CACHE_TTL', 60),
+                                 backend=app.config.get('PAGE_CACHE_BACKEND'))
+        app.extensions['page_cache'] = self
+        app.extensions.setdefault('stats', {})['page_cache'] = self.stats
+
+    def cached(self, view):
+        """Cache the guest responses of a GET view under the request host and path."""
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            return self.respond(f'{request.host}{request.full_path}', lambda: view(*args, **kwargs))
+
+        return wrapped
+
+    def respond(self, key: str, render):
+        """The cached response of `key`, or the one of render() (kept when it may be)."""
+        if not self._usable():
+            self.bypassed += 1
+            return render()
+
+        entry = self._cache.get(key)
+        if entry is None:
+            before = dict(session)
+            response = make_response(render())
+            self._store(key, response, before)
+        else:
+            status, headers, body = entry
+            response = make_response(body, status, headers)
+            response.set_etag(md5(body).hexdigest())
+
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        if response.status_code == 200 and response.get_etag()[0]:
+            response.make_conditional(request)
+            if response.status_code == 304:
+                self.not_modified += 1
+        return response
+
+    def _usable(self) -> bool:
+        if not self.enabled or self._cache is None or request.method not in ('GET', 'HEAD'):
+            return False
+        return '_flashes' not in session and session.get(STICKY_KEY, 0) <= time.time() \
+            and not current_user.is_authenticated
+
+    def _store(self, key, response, before):
+        changed = {name for name in before.keys() | session.keys() if before.get(name) != session.get(name)}
+        if response.is_streamed or changed - LOGIN_BOOKKEEPING or 'Set-Cookie' in response.headers:
+            self.uncacheable += 1
+            return
+        body = response.get_data()
+        if len(body) > self.max_bytes:
+            self.uncacheable += 1
+            return
+        response.set_etag(md5(body).hexdigest())
+        headers = [(name, response.headers[name]) for name in KEPT_HEADERS if name in response.headers]
+        self._cache.set(key, (response.status_code, headers, body))
+
+    def clear(self) -> None:
+        if self._cache is not None:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        if self._cache is None:
+            return {'enabled': False}
+        return dict(self._cache.stats(), enabled=self.enabled, bypassed=self.bypassed,
+                    not_modified=self.not_modified, uncacheable=self.uncacheable)
+
+
+page_cache = PageCache()
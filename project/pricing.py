@@ -0,0 +1,141 @@
+"""Storage pricing.
+
+The daily rate of a shelf depends on its Size and on the season of the day;
+the cost of an order is the sum of the daily rates from start_date to
+stop_date, both inclusive. Daily rates are laid out once as a cumulative
+table (sizes x calendar days), so one quote is two lookups and a
+subtraction and a batch of quotes is a single vectorized NumPy pass.
+
+Until PRICING_TARIFFS is configured nothing can be quoted, and the callers
+have to give the cost themselves (see project.reservations.reserve_shelf).
+
+Config:
+    PRICING_TARIFFS     {size_id: {season: daily rate}}, every season of SEASONS per size (default: none)
+    PRICING_SEASONS     {month: season}, default MONTH_SEASONS
+    PRICING_FIRST_DAY   first day of the priced calendar (default 2020-01-01)
+    PRICING_YEARS       length of the priced calendar in years (default 20)
+    PRICING_CACHE_SIZE  memoized single quotes (default 65536)
+"""
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+from loguru import logger
+
+SEASONS = ('winter', 'spring', 'summer', 'autumn')
+
+MONTH_SEASONS = {
+    12: 'winter', 1: 'winter', 2: 'winter',
+    3: 'spring', 4: 'spring', 5: 'spring',
+    6: 'summer', 7: 'summer', 8: 'summer',
+    9: 'autumn', 10: 'autumn', 11: 'autumn',
+}
+
+
+class PricingError(ValueError):
+    pass
+
+
+def _years_after(day: date, years: int) -> date:
+    """The same day `years` calendar years later; a 29th of February ends on the 1st of March."""
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:
+        return date(day.year + years, 3, 1)
+
+
+class PricingEngine:
+    def __init__(self, app=None):
+        self._size_ids = np.empty(0, dtype=np.int64)
+        self._tariffs = np.empty((0, len(SEASONS)), dtype=np.int64)
+        self._cumulative = np.zeros((0, 1), dtype=np.int64)
+        self._first_day = np.datetime64('2020-01-01', 'D')
+        self._first_ordinal = date(2020, 1, 1).toordinal()
+        self._quote = lru_cache(maxsize=65536)(self._quote_one)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.configure(app.config.get('PRICING_TARIFFS', {}),
+                       seasons=app.config.get('PRICING_SEASONS', MONTH_SEASONS),
+                       first_day=app.config.get('PRICING_FIRST_DAY', date(2020, 1, 1)),
+                       years=app.config.get('PRICING_YEARS', 20),
+                       cache_size=app.config.get('PRICING_CACHE_SIZE', 65536))
+        if not self.configured:
+            logger.warning('PRICING_TARIFFS is empty, orders have to be given their cost')
+        app.extensions['pricing'] = self
+
+    def configure(self, tariffs, seasons=MONTH_SEASONS, first_day=date(2020, 1, 1), years=20, cache_size=65536):
+        """Build the tariff matrix (sizes x seasons) and the cumulative daily price table."""
+        size_ids = sorted(tariffs)
+        try:
+            matrix = [[tariffs[size_id][season] for season in SEASONS] for size_id in size_ids]
+        except KeyError as e:
+            raise PricingError(f'tariff is missing season {e}') from None
+        self._size_ids = np.array(size_ids, dtype=np.int64)
+        self._tariffs = np.array(matrix, dtype=np.int64).reshape(len(size_ids), len(SEASONS))
+
+        self._first_day = np.datetime64(first_day, 'D')
+        self._first_ordinal = first_day.toordinal()
+        days = np.arange(self._first_day, np.datetime64(_years_after(first_day, years), 'D'))
+        months = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+        season_index = np.array([SEASONS.index(seasons[m]) for m in range(1, 13)], dtype=np.int64)
+        daily_season = season_index[months - 1]
+
+        daily_rates = self._tariffs[:, daily_season]
+        self._cumulative = np.zeros((len(size_ids), len(days) + 1), dtype=np.int64)
+        np.cumsum(daily_rates, axis=1, out=self._cumulative[:, 1:])
+        self._quote = lru_cache(maxsize=cache_size)(self._quote_one)
+
+    @property
+    def tariffs(self) -> np.ndarray:
+        return self._tariffs
+
+    @property
+    def configured(self) -> bool:
+        """True when there is a tariff to quote from."""
+        return len(self._size_ids) > 0
+
+    def _rows(self, size_ids):
+        size_ids = np.asarray(size_ids, dtype=np.int64)
+        rows = np.searchsorted(self._size_ids, size_ids)
+        rows = np.minimum(rows, max(len(self._size_ids) - 1, 0))
+        if len(self._size_ids) == 0 or not np.array_equal(self._size_ids[rows], size_ids):
+            unknown = np.setdiff1d(size_ids, self._size_ids)
+            raise PricingError(f'no tariff for sizes {unknown.tolist()}')
+        return rows
+
+    def _days(self, dates):
+        if isinstance(dates, np.ndarray) and np.issubdtype(dates.dtype, np.datetime64):
+            return (dates.astype('datetime64[D]') - self._first_day).astype(np.int64)
+        # going through ordinals is much faster than letting NumPy parse date objects
+        first = self._first_ordinal
+        return np.fromiter((d.toordinal() - first for d in dates), dtype=np.int64, count=len(dates))
+
+    def quote_many(self, size_ids, start_dates, stop_dates) -> np.ndarray:
+        """Costs of a batch of (size_id, start_date, stop_date) orders, in one pass."""
+        rows = self._rows(size_ids)
+        start = self._days(start_dates)
+        stop = self._days(stop_dates)
+        if np.any(start > stop):
+            raise PricingError('start_date is after stop_date')
+        if np.any(start < 0) or np.any(stop + 1 >= self._cumulative.shape[1]):
+            raise PricingError('dates are outside of the priced calendar')
+        return self._cumulative[rows, stop + 1] - self._cumulative[rows, start]
+
+    def _quote_one(self, size_id: int, start_date: date, stop_date: date) -> int:
+        row = int(self._rows([size_id])[0])
+        start = start_date.toordinal() - self._first_ordinal
+        stop = stop_date.toordinal() - self._first_ordinal
+        if start > stop:
+            raise PricingError('start_date is after stop_date')
+        if start < 0 or stop + 1 >= self._cumulative.shape[1]:
+            raise PricingError('dates are outside of the priced calendar')
+        return int(self._cumulative[row, stop + 1] - self._cumulative[row, start])
+
+    def quote(self, size_id: int, start_date: date, stop_date: date) -> int:
+        """Cost of one order; repeated quotes come from a memo cache."""
+        return self._quote(size_id, start_date, stop_date)
+
+
+pricing = PricingEngine()
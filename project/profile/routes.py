@@ -1,9 +1,11 @@
-from flask import render_template, flash, url_for
+from flask import render_template, flash, url_for, request, current_app
 from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload
 from werkzeug.exceptions import abort
 from werkzeug.utils import redirect
 
-from ..models import User
+from ..models import StorageOrder, Warehouse
+from ..replicas import read_replica
 from . import profile
 
 
@@ -13,12 +15,25 @@ def profile_main():
 	return redirect(url_for('.profile_user', user_id=current_user.user_id))
 
 
-@profile.route('/<user_id>')
+@profile.route('/<int:user_id>')
 @login_required
+@read_replica()
 def profile_user(user_id):
-	user = User.query.filter_by(user_id=user_id).first_or_404()
-	if current_user.user_id != user.user_id:
+	# current_user is already loaded, no need to fetch the user again
+	if current_user.user_id != user_id:
 		flash('Not yours!', 'danger')
 		abort(401)
 
-	return render_template('profile/profile.html')
+	# keyset pagination: newest orders first, `before` is the last order id of the previous page
+	per_page = current_app.config.get('PROFILE_ORDERS_PER_PAGE', 20)
+	before = request.args.get('before', type=int)
+	query = StorageOrder.query \
+		.filter(StorageOrder.user_id == user_id) \
+		.options(joinedload(StorageOrder.shelf).joinedload(Warehouse.size)) \
+		.order_by(StorageOrder.storage_order_id.desc())
+	if before is not None:
+		query = query.filter(StorageOrder.storage_order_id < before)
+	orders = query.limit(per_page + 1).all()
+
+	next_before = orders[per_page - 1].storage_order_id if len(orders) > per_page else None
+	return render_template('profile/profile.html', orders=orders[:per_page], next_before=next_before)
@@ -0,0 +1,207 @@
+"""Token-bucket rate limits for the auth POSTs.
+
+Every rule is `count` requests per `seconds`, allowing bursts of `count`;
+a key (an IP or a normalized email) gets a bucket per rule. limit_posts()
+checks the client IP and the posted email before the view runs, so a
+rejected request costs no DB query, no bcrypt and no SMTP send.
+
+Two stores share one interface (take / compact / clear):
+LocalBuckets keeps the buckets in SHARDS dicts, each behind its own lock,
+so concurrent requests rarely wait on each other; buckets that are full
+again are dropped by a compaction pass every RATELIMIT_COMPACT_INTERVAL
+seconds. RedisBuckets is shared by all workers (optional `redis` package)
+and updates a bucket atomically with a Lua script.
+
+The IP is request.remote_addr. Behind a reverse proxy, every client would
+share the bucket of the proxy's address: set PROXY_FIX_X_FOR to the number
+of proxies that append to X-Forwarded-For (see project.trust_proxies).
+
+Config:
+    RATELIMIT_ENABLED           default True
+    RATELIMIT_BACKEND           'local' (default) or 'redis' (CACHE_REDIS_URL)
+    RATELIMIT_RULES             {rule: (count, seconds)}, merged over DEFAULT_RULES
+    RATELIMIT_COMPACT_INTERVAL  seconds between compactions of the local store (default 60)
+    PROXY_FIX_X_FOR             trusted proxies in front of the app (default 0)
+"""
+import time
+import zlib
+from functools import wraps
+from threading import Lock
+
+from flask import request
+from loguru import logger
+from werkzeug.exceptions import TooManyRequests
+
+DEFAULT_RULES = {
+    'login_ip': (30, 60),
+    'login_email': (10, 300),
+    'reset_ip': (10, 3600),
+    'reset_email': (3, 3600),
+}
+
+SHARDS = 16
+
+
+class LocalBuckets:
+    def __init__(self, compact_interval=60):
+        self.compact_interval = compact_interval
+        self._shards = [{} for _ in range(SHARDS)]
+        self._locks = [Lock() for _ in range(SHARDS)]
+        self._next_compaction = time.monotonic() + compact_interval
+
+    def take(self, key: str, count: int, seconds: float) -> float:
+        """Take a token from the bucket of the key. Returns 0, or the seconds until a token is back."""
+        now = time.monotonic()
+        if now >= self._next_compaction:
+            self._next_compaction = now + self.compact_interval
+            self.compact(now)
+        rate = count / seconds
+        i = zlib.crc32(key.encode('utf-8')) % SHARDS
+        with self._locks[i]:
+            shard = self._shards[i]
+            tokens, updated, _ = shard.get(key, (count, now, seconds))
+            tokens = min(count, tokens + (now - updated) * rate)
+            if tokens < 1:
+                shard[key] = (tokens, now, seconds)
+                return (1 - tokens) / rate
+            shard[key] = (tokens - 1, now, seconds)
+            return 0.0
+
+    def compact(self, now=None) -> int:
+        """Drop the buckets untouched for a whole window: they are full again."""
+        now = now or time.monotonic()
+        dropped = 0
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                idle = [key for key, (_, updated, seconds) in shard.items() if now - updated >= seconds]
+                for key in idle:
+                    del shard[key]
+                dropped += len(idle)
+        return dropped
+
+    def clear(self):
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                shard.clear()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+
+_TAKE_SCRIPT = """
+local count, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 't', 'u')
+local tokens = tonumber(bucket[1]) or count
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(count, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+else
+    tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'u', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(count / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    def __init__(self, url, prefix='ratelimit'):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+        self.prefix = prefix
+
+    def take(self, key: str, count: int, seconds: float) -> float:
+        return float(self._take(keys=[f'{self.prefix}:{key}'], args=[count, count / seconds, time.time()]))
+
+    def compact(self, now=None) -> int:
+        # keys expire by themselves once their bucket is full again
+        return 0
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(f'{self.prefix}:*'))
+        if keys:
+            self._redis.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self._redis.scan_iter(f'{self.prefix}:*'))
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.rules = dict(DEFAULT_RULES)
+        self._store = LocalBuckets()
+        self._lock = Lock()
+        self.allowed = 0
+        self.rejected = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATELIMIT_ENABLED', True)
+        self.rules = dict(DEFAULT_RULES, **app.config.get('RATELIMIT_RULES', {}))
+        backend = app.config.get('RATELIMIT_BACKEND', 'local')
+        if backend == 'local':
+            self._store = LocalBuckets(app.config.get('RATELIMIT_COMPACT_INTERVAL', 60))
+        elif backend == 'redis':
+            self._store = RedisBuckets(app.config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+        else:
+            raise ValueError(f'unknown RATELIMIT_BACKEND {backend!r}')
+        app.extensions['ratelimit'] = self
+        app.extensions.setdefault('stats', {})['ratelimit'] = self.stats
+
+    def hit(self, rule: str, key: str) -> float:
+        """Count a request against the rule. Returns 0 if allowed, else the seconds to wait."""
+        count, seconds = self.rules[rule]
+        retry_after = self._store.take(f'{rule}:{key}', count, seconds)
+        with self._lock:
+            if retry_after:
+                self.rejected[rule] = self.rejected.get(rule, 0) + 1
+            else:
+                self.allowed += 1
+        return retry_after
+
+    def check(self, action: str, ip: str, email: str = None) -> float:
+        """Seconds to wait before the action is allowed for this IP and email, 0 if it is allowed now."""
+        if not self.enabled:
+            return 0.0
+        retry_after = self.hit(f'{action}_ip', ip or 'unknown')
+        if not retry_after and email:
+            retry_after = self.hit(f'{action}_email', email.strip().lower())
+        return retry_after
+
+    def reset(self):
+        self._store.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'keys': len(self._store),
+                'allowed': self.allowed,
+                'rejected': dict(self.rejected),
+                'rules': {rule: f'{count}/{seconds}s' for rule, (count, seconds) in self.rules.items()},
+            }
+
+
+limiter = RateLimiter()
+
+
+def limit_posts(action: str):
+    """Reject POSTs over the `{action}_ip` / `{action}_email` limits with 429 before the view runs."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method == 'POST':
+                email = request.form.get('email')
+                retry_after = limiter.check(action, request.remote_addr, email)
+                if retry_after:
+                    logger.warning(f'{action} rate limit: {request.remote_addr} {email}, retry in {retry_after:.0f} s')
+                    raise TooManyRequests(retry_after=int(retry_after) + 1)
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
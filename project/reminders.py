@@ -0,0 +1,124 @@
+"""Reminder digests: one email per customer whose storage orders end soon.
+
+The due orders (stop_date within REMINDER_DAYS_BEFORE days, not reminded
+yet) come from one query over the partial ix_storage_orders_reminder_due
+index, joined with their users. Digests are rendered with templates
+compiled once from the app's Jinja environment and handed to the outbox,
+which sends them over its pooled, rate-limited SMTP connections.
+
+Each chunk of customers is one transaction: it claims the orders by
+setting `reminded` only where it is still NULL, stages the digests of the
+claimed orders in the outbox and commits. A restart therefore never sends
+a reminder twice, and two concurrent runs split the orders between them.
+
+Config:
+    REMINDER_DAYS_BEFORE  remind that many days before stop_date (default 7)
+    REMINDER_CHUNK        customers per transaction (default 500)
+"""
+import time
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from threading import Lock
+
+from flask import current_app
+from loguru import logger
+
+from project import db
+from project.models import StorageOrder, User
+from project.outbox import outbox
+
+SUBJECT = '[ServiceStation] Хранение скоро заканчивается'
+
+
+class ReminderDigest:
+    def __init__(self, app=None):
+        self._lock = Lock()
+        self.days_before = 7
+        self.chunk = 500
+        self.runs = 0
+        self.digests = 0
+        self.orders = 0
+        self.last_rate = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.days_before = app.config.get('REMINDER_DAYS_BEFORE', 7)
+        self.chunk = app.config.get('REMINDER_CHUNK', 500)
+        app.extensions['reminders'] = self
+        app.extensions.setdefault('stats', {})['reminders'] = self.stats
+
+    def due_orders(self, today: date = None) -> list:
+        today = today or date.today()
+        return db.session.query(StorageOrder.user_id, User.email, User.first_name, User.last_name,
+                                StorageOrder.storage_order_id, StorageOrder.shelf_id,
+                                StorageOrder.start_date, StorageOrder.stop_date) \
+            .join(User, User.user_id == StorageOrder.user_id) \
+            .filter(StorageOrder.reminded.is_(None),
+                    StorageOrder.stop_date >= today,
+                    StorageOrder.stop_date <= today + timedelta(days=self.days_before)) \
+            .order_by(StorageOrder.user_id, StorageOrder.stop_date) \
+            .all()
+
+    def _claim(self, order_ids) -> set:
+        table = StorageOrder.__table__
+        return set(db.session.execute(
+            table.update()
+            .where(table.c.storage_order_id.in_(order_ids), table.c.reminded.is_(None))
+            .values(reminded=datetime.now())
+            .returning(table.c.storage_order_id)
+        ).scalars())
+
+    def _send_chunk(self, customers, text_template, html_template) -> tuple:
+        claimed = self._claim([row.storage_order_id for _, rows in customers for row in rows])
+        messages = []
+        for user, rows in customers:
+            orders = [row for row in rows if row.storage_order_id in claimed]
+            if orders:
+                messages.append((SUBJECT, [user.email],
+                                 text_template.render(user=user, orders=orders),
+                                 html_template.render(user=user, orders=orders)))
+        outbox.stage_many(messages)
+        db.session.commit()
+        return len(messages), len(claimed)
+
+    def send(self, today: date = None) -> int:
+        """Stage the digests of every due order in the outbox. Returns the number of digests."""
+        started = time.perf_counter()
+        env = current_app.jinja_env
+        text_template = env.get_template('email/storage_reminder.txt')
+        html_template = env.get_template('email/storage_reminder.html')
+
+        # rows of one customer are adjacent, the first one carries the name and email
+        customers = []
+        for _, group in groupby(self.due_orders(today), key=lambda row: row.user_id):
+            user_rows = list(group)
+            customers.append((user_rows[0], user_rows))
+        digests = orders = 0
+        for i in range(0, len(customers), self.chunk):
+            sent, claimed = self._send_chunk(customers[i:i + self.chunk], text_template, html_template)
+            digests += sent
+            orders += claimed
+            outbox.wake_up()
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.runs += 1
+            self.digests += digests
+            self.orders += orders
+            self.last_rate = digests / elapsed if elapsed else 0.0
+        logger.info(f'reminders: {digests} digests for {orders} orders queued in {elapsed * 1000:.0f} ms, '
+                    f'{self.last_rate:.0f} digests/s')
+        return digests
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'digests': self.digests,
+                'orders': self.orders,
+                'last_rate': round(self.last_rate, 1),
+            }
+
+
+reminders = ReminderDigest()
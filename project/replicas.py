@@ -0,0 +1,217 @@
+"""Read-only queries on read replicas.
+
+db is a RoutingSQLAlchemy: its sessions send the SELECTs run inside
+read_replica() to one of the SQLALCHEMY_REPLICAS (round robin, registered
+as the binds replica_0, replica_1, ...); everything else, and every SELECT
+... FOR UPDATE, stays on the primary.
+
+    with read_replica():
+        user = User.query.get(user_id)
+
+    @read_replica()
+    def profile_user(user_id): ...
+
+Reads stay on the primary:
+    - in a session that has written in its current transaction,
+    - for REPLICA_STICKY_SECONDS after a session committed a write; the
+      deadline is kept in session.info, and copied to the Flask session at
+      the end of the request, so the redirect after a POST sees its own
+      writes,
+    - when every replica lags behind by more than REPLICA_MAX_LAG seconds
+      or can't be reached. The lag of a replica is measured at most every
+      REPLICA_LAG_CHECK_INTERVAL seconds, by the request that finds the
+      last measure stale.
+
+Without replicas configured nothing is routed.
+
+Config:
+    SQLALCHEMY_REPLICAS          URIs of the replicas (default: none)
+    REPLICA_MAX_LAG              seconds (default 2)
+    REPLICA_LAG_CHECK_INTERVAL   seconds (default 1)
+    REPLICA_STICKY_SECONDS       seconds (default 5)
+"""
+import itertools
+import time
+from contextlib import contextmanager
+from threading import Lock, local
+
+from flask import current_app, has_request_context, session as http_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from loguru import logger
+from sqlalchemy import event, orm, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import Select
+
+REPLICA_PREFIX = 'replica_'
+REPLICA_BIND = REPLICA_PREFIX + '{}'
+STICKY_KEY = '_primary_until'
+
+# seconds of WAL not replayed yet; 0 on a server that is not a standby
+LAG_QUERY = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+_state = local()
+
+
+@contextmanager
+def read_replica():
+    """Let the SELECTs of the block go to a replica; also a decorator."""
+    previous = getattr(_state, 'read_only', False)
+    _state.read_only = True
+    try:
+        yield
+    finally:
+        _state.read_only = previous
+
+
+class Replica:
+    __slots__ = ('bind', 'lag', 'checked', 'lock')
+
+    def __init__(self, bind):
+        self.bind = bind
+        self.lag = 0.0
+        self.checked = float('-inf')
+        self.lock = Lock()
+
+
+class ReplicaRouter:
+    def __init__(self, app=None):
+        self.replicas = []
+        self.max_lag = 2
+        self.check_interval = 1
+        self.sticky_seconds = 5
+        self._turn = itertools.count()
+        self.routed = 0
+        self.sticky_reads = 0
+        self.lagging_reads = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        uris = app.config.get('SQLALCHEMY_REPLICAS') or ()
+        binds = {key: uri for key, uri in (app.config.get('SQLALCHEMY_BINDS') or {}).items()
+                 if not key.startswith(REPLICA_PREFIX)}
+        binds.update((REPLICA_BIND.format(i), uri) for i, uri in enumerate(uris))
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        self.replicas = [Replica(REPLICA_BIND.format(i)) for i in range(len(uris))]
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', 2)
+        self.check_interval = app.config.get('REPLICA_LAG_CHECK_INTERVAL', 1)
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 5)
+        app.extensions['replicas'] = self
+        app.extensions.setdefault('stats', {})['replicas'] = self.stats
+        if self._keep_sticky not in app.after_request_funcs.get(None, ()):
+            app.after_request(self._keep_sticky)
+
+        for name, listener in (('after_flush', _after_flush), ('do_orm_execute', _on_execute),
+                               ('after_commit', _after_commit), ('after_rollback', _after_rollback)):
+            if not event.contains(RoutingSession, name, listener):
+                event.listen(RoutingSession, name, listener)
+
+    def read_bind(self, session, clause):
+        """The replica engine for the statement, None for the primary."""
+        if not self.replicas or not getattr(_state, 'read_only', False) \
+                or not isinstance(clause, Select) or clause._for_update_arg is not None:
+            return None
+        if session.info.get('wrote') or self._sticky(session):
+            self.sticky_reads += 1
+            return None
+
+        app = session.app
+        start = next(self._turn)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if self._lag(app, replica) <= self.max_lag:
+                self.routed += 1
+                return get_state(app).db.get_engine(app, bind=replica.bind)
+        self.lagging_reads += 1
+        return None
+
+    def _sticky(self, session) -> bool:
+        now = time.time()
+        if session.info.get(STICKY_KEY, 0) > now:
+            return True
+        return has_request_context() and http_session.get(STICKY_KEY, 0) > now
+
+    def _lag(self, app, replica) -> float:
+        # one thread measures a stale replica, the others go on with the last measure
+        if time.monotonic() - replica.checked >= self.check_interval and replica.lock.acquire(blocking=False):
+            try:
+                replica.lag = self._measure(app, replica)
+                replica.checked = time.monotonic()
+            finally:
+                replica.lock.release()
+        return replica.lag
+
+    @staticmethod
+    def _measure(app, replica) -> float:
+        try:
+            with get_state(app).db.get_engine(app, bind=replica.bind).connect() as conn:
+                lag = float(conn.execute(LAG_QUERY).scalar() or 0)
+        except SQLAlchemyError as e:
+            logger.warning(f'replica {replica.bind} unreachable, reading from the primary: {e}')
+            return float('inf')
+        if lag > 0:
+            logger.debug(f'replica {replica.bind} lags {lag:.1f}s')
+        return lag
+
+    def mark_written(self, session) -> None:
+        session.info[STICKY_KEY] = time.time() + self.sticky_seconds
+
+    def _keep_sticky(self, response):
+        # only here, inside a request being served: a context kept alive
+        # past its request (the test client's) must not carry the deadline
+        if self.replicas:
+            until = get_state(current_app).db.session.info.get(STICKY_KEY, 0)
+            if until > http_session.get(STICKY_KEY, 0):
+                http_session[STICKY_KEY] = until
+        return response
+
+    def reset(self) -> None:
+        """Forget the measured lags and zero the counters."""
+        self.replicas = [Replica(replica.bind) for replica in self.replicas]
+        self._turn = itertools.count()
+        self.routed = self.sticky_reads = self.lagging_reads = 0
+
+    def stats(self) -> dict:
+        return {
+            'replicas': {replica.bind: replica.lag for replica in self.replicas},
+            'routed': self.routed,
+            'sticky_reads': self.sticky_reads,
+            'lagging_reads': self.lagging_reads,
+        }
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        engine = replicas.read_bind(self, clause)
+        if engine is not None:
+            return engine
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def _after_flush(session, flush_context):
+    session.info['wrote'] = True
+
+
+def _on_execute(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['wrote'] = True
+
+
+def _after_commit(session):
+    if session.info.pop('wrote', False) and replicas.replicas:
+        replicas.mark_written(session)
+
+
+def _after_rollback(session):
+    session.info.pop('wrote', None)
+
+
+replicas = ReplicaRouter()
@@ -0,0 +1,91 @@
+"""Shelf reservation under concurrency.
+
+A booking locks one free shelf with SELECT ... FOR UPDATE SKIP LOCKED, so
+concurrent bookings of the same size spread over different shelves instead
+of queueing behind one row lock. The storage_orders exclusion constraint is
+the last line of defence: if a concurrent booking slipped in between the
+free-check and the insert, the insert fails and the next shelf is tried.
+"""
+from datetime import date, datetime
+
+from flask import current_app
+from loguru import logger
+from sqlalchemy import case, exists, func, text
+from sqlalchemy.exc import IntegrityError
+
+from project import db
+from project.allocation import candidate_shelves
+from project.models import StorageOrder, Warehouse
+from project.pricing import pricing
+
+
+class ShelfUnavailable(Exception):
+    pass
+
+
+def _dates(start_date, stop_date):
+    return func.daterange(start_date, stop_date, text("'[]'"))
+
+
+def _lock_free_shelf(size_id: int, start_date: date, stop_date: date, candidates=None):
+    busy = exists().where(
+        StorageOrder.shelf_id == Warehouse.shelf_id,
+        _dates(StorageOrder.start_date, StorageOrder.stop_date).op('&&')(_dates(start_date, stop_date))
+    )
+    query = db.session.query(Warehouse.shelf_id) \
+        .filter(Warehouse.size_id == size_id, Warehouse.active.is_(True), ~busy)
+    if candidates:
+        # keep the order the allocation strategy ranked the candidates in
+        query = query.filter(Warehouse.shelf_id.in_(candidates)) \
+            .order_by(case({shelf_id: rank for rank, shelf_id in enumerate(candidates)}, value=Warehouse.shelf_id))
+    return query.order_by(Warehouse.shelf_id) \
+        .limit(1) \
+        .with_for_update(skip_locked=True, of=Warehouse) \
+        .scalar()
+
+
+def reserve_shelf(user_id: int, size_id: int, start_date: date, stop_date: date, cost: int = None) -> StorageOrder:
+    """Book a free shelf of the size for the dates and commit the order.
+
+    The cost is quoted from the tariffs unless given; without PRICING_TARIFFS
+    it must be given. Raises ShelfUnavailable when every matching shelf is
+    booked or locked by another transaction for all the attempts.
+    """
+    if start_date > stop_date:
+        raise ValueError('start_date is after stop_date')
+    if cost is None:
+        if not pricing.configured:
+            raise ValueError('cost is required until PRICING_TARIFFS is configured')
+        cost = pricing.quote(size_id, start_date, stop_date)
+
+    attempts = current_app.config.get('RESERVATION_ATTEMPTS', 3)
+    n_candidates = current_app.config.get('RESERVATION_CANDIDATES', 20)
+    for attempt in range(attempts):
+        # the in-memory index narrows the search, the DB has the final word
+        candidates = candidate_shelves(size_id, start_date, stop_date, limit=n_candidates)
+        shelf_id = _lock_free_shelf(size_id, start_date, stop_date, candidates)
+        if shelf_id is None and candidates:
+            shelf_id = _lock_free_shelf(size_id, start_date, stop_date)
+        if shelf_id is None:
+            db.session.rollback()
+            break
+
+        order = StorageOrder(start_date=start_date, stop_date=stop_date, storage_order_cost=cost,
+                             created=datetime.now(), user_id=user_id, shelf_id=shelf_id)
+        db.session.add(order)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            logger.warning(f'shelf {shelf_id} was booked concurrently, attempt {attempt + 1} of {attempts}')
+        else:
+            logger.info(f'user {user_id} booked shelf {shelf_id} from {start_date} to {stop_date}')
+            return order
+
+    raise ShelfUnavailable(f'no free shelf of size {size_id} from {start_date} to {stop_date}')
+
+
+def cancel_order(order: StorageOrder) -> None:
+    db.session.delete(order)
+    db.session.commit()
+    logger.info(f'storage order {order.storage_order_id} cancelled, shelf {order.shelf_id} released')
@@ -0,0 +1,512 @@
+"""Pre-forking production server.
+
+The master builds the app once (create_app, with its warm-up), freezes the
+garbage collector so the preloaded objects stay shared copy-on-write, and
+forks the workers. Every worker serves the shared listening socket with a
+bounded number of threads (werkzeug's threaded WSGI server) and gets its own
+connection pools: the master never holds a connection across fork(). A
+worker that dies is replaced.
+
+    python -m project.server --bind 0.0.0.0:8000
+    python -m project.server --report       # startup time and memory per worker, then exit
+
+Signals to the master:
+    TERM, INT   graceful stop, the workers finish their requests first
+    HUP         graceful reload: the master checks that the new code imports,
+                executes itself again, keeping its pid and the listening
+                socket, loads the new code and config, then replaces the
+                old workers SERVER_RELOAD_BATCH at a time: a batch of new
+                workers is started, as many old ones are stopped gracefully
+                once it is ready, and the next batch is started when they
+                are gone. A stopped worker still running after
+                SERVER_GRACEFUL_TIMEOUT is killed. If the new code or config
+                fails to load, the old workers keep serving.
+    USR1        log the startup and memory report
+
+Unless configured, the worker count is the number of CPUs available,
+capped by the connections the primary accepts: max_connections minus
+superuser_reserved_connections and SERVER_DB_RESERVED. Each worker's pool
+holds one connection per request thread and per background thread (mail
+senders, expiry sweeper, rehash), without overflow, and the pools of
+SERVER_RELOAD_BATCH more workers are kept free for the overlap of a reload.
+
+Every worker logs to its own file (project.log.configure_worker_sink), named
+after the lowest slot free when it starts: the files of the slots are kept
+across restarts, SERVER_WORKERS + SERVER_RELOAD_BATCH of them at most. The
+sink of the master can't be shared, its writer thread doesn't survive a
+reload.
+
+Config:
+    SERVER_BIND                host:port (default 127.0.0.1:8000)
+    SERVER_WORKERS             default: sized as above
+    SERVER_THREADS             request threads per worker (default 8)
+    SERVER_DB_MAX_CONNECTIONS  default: asked from the primary
+    SERVER_DB_RESERVED         connections left to the CLI and other clients (default 10)
+    SERVER_GRACEFUL_TIMEOUT    seconds to finish the requests in flight (default 30)
+    SERVER_RELOAD_BATCH        workers replaced at a time on reload (default 1)
+"""
+import argparse
+import gc
+import itertools
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from threading import BoundedSemaphore, Thread
+
+from flask import Flask
+from loguru import logger
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import NullPool
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+from project import create_app, db
+from project.log import configure_worker_sink
+
+LISTEN_FD_ENV = 'SERVER_LISTEN_FD'
+RETIRING_ENV = 'SERVER_RETIRING_WORKERS'
+STOP_MARGIN = 5  # seconds a stopped worker gets past the graceful timeout to stop its background threads
+
+Plan = namedtuple('Plan', 'workers threads pool_size hashing_workers')
+
+
+def available_cpus() -> int:
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def background_threads(config) -> int:
+    """Threads of a worker that hold a DB connection besides the request threads."""
+    threads = 0
+    if config.get('MAIL_OUTBOX', True) and config.get('MAIL_OUTBOX_WORKER', True):
+        threads += config.get('MAIL_OUTBOX_WORKERS', 1)
+    if config.get('EXPIRY_SWEEPER_WORKER', True):
+        threads += 1
+    if config.get('HASHING_REHASH', True):
+        threads += 1
+    return threads
+
+
+def db_connection_budget(config):
+    """Connections the app may open on the primary, None when it can't be asked."""
+    budget = config.get('SERVER_DB_MAX_CONNECTIONS')
+    if budget is None:
+        engine = create_engine(config['SQLALCHEMY_DATABASE_URI'], poolclass=NullPool)
+        try:
+            with engine.connect() as conn:
+                budget = conn.execute(text(
+                    "SELECT current_setting('max_connections')::int "
+                    "- current_setting('superuser_reserved_connections')::int")).scalar()
+        except SQLAlchemyError as e:
+            logger.warning(f'max_connections unknown, workers sized by CPU only: {e}')
+            return None
+        finally:
+            engine.dispose()
+    return budget - config.get('SERVER_DB_RESERVED', 10)
+
+
+def plan_workers(config, cpus: int, budget=None) -> Plan:
+    threads = config.get('SERVER_THREADS', 8)
+    per_worker = threads + background_threads(config)
+    workers = config.get('SERVER_WORKERS') or cpus
+    if budget is not None:
+        if budget < per_worker:
+            threads = max(1, budget - background_threads(config))
+            per_worker = threads + background_threads(config)
+            logger.warning(f'{budget} DB connections available, one worker with {threads} threads')
+        # a reload runs the pools of the old and of a batch of new workers at once
+        reload_batch = config.get('SERVER_RELOAD_BATCH', 1)
+        if budget // per_worker <= reload_batch:
+            logger.warning(f'{budget} DB connections available, no room left for the overlap of a reload')
+        workers = max(1, min(workers, budget // per_worker - reload_batch))
+    # bcrypt releases the GIL: the hashing threads of all the workers share the CPUs
+    hashing_workers = config.get('HASHING_WORKERS') or max(1, cpus // workers)
+    return Plan(workers, threads, per_worker, hashing_workers)
+
+
+def dispose_engines(app) -> None:
+    """Close the pooled connections of the primary and of every bind."""
+    with app.app_context():
+        for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ()):
+            db.get_engine(app, bind=bind).dispose()
+
+
+def memory_of(pid: int) -> dict:
+    """{'rss', 'pss', 'uss'} in MB from /proc (Linux), {} elsewhere."""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) for line in f if line.split()[-1] == 'kB'}
+    except OSError:
+        return {}
+    return {'rss': fields['Rss'] / 1024, 'pss': fields['Pss'] / 1024,
+            'uss': (fields['Private_Clean'] + fields['Private_Dirty']) / 1024}
+
+
+class RequestHandler(WSGIRequestHandler):
+    # one request per connection, so an idle keep-alive client can't hold a
+    # thread; keep-alive is the business of the proxy in front
+    protocol_version = 'HTTP/1.0'
+
+
+class BoundedWSGIServer(ThreadedWSGIServer):
+    """Threaded WSGI server running at most `threads` requests at once."""
+
+    def __init__(self, host, app, threads, fd):
+        super().__init__(host, 0, app, handler=RequestHandler, fd=fd)
+        self.threads = threads
+        self._slots = BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+    def drain(self, timeout) -> bool:
+        """Wait for the requests in flight. False if some are still running at the timeout."""
+        deadline = time.monotonic() + timeout
+        for _ in range(self.threads):
+            if not self._slots.acquire(timeout=max(0, deadline - time.monotonic())):
+                return False
+        return True
+
+
+class Worker:
+    def __init__(self, master, forked, slot):
+        self.master = master
+        self.forked = forked
+        self.slot = slot
+
+    def run(self) -> int:
+        master = self.master
+        # stopped outright until the server runs; the master handles the others for the whole group
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for signum in (signal.SIGINT, signal.SIGHUP, signal.SIGUSR1):
+            signal.signal(signum, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        os.close(master.ready_r)
+
+        app = master.app or create_app(master.config_filename, **master.overrides)
+        configure_worker_sink(app.config, self.slot)
+        # nothing is pooled in a preloaded app, this only makes sure of it
+        dispose_engines(app)
+        server = BoundedWSGIServer(master.host, app, master.plan.threads, master.sock.fileno())
+        signal.signal(signal.SIGTERM, lambda signum, frame: Thread(target=server.shutdown).start())
+        os.write(master.ready_w, f'{os.getpid()} {time.perf_counter() - self.forked:.4f}\n'.encode())
+
+        server.serve_forever()
+        if not server.drain(master.graceful_timeout):
+            logger.warning(f'worker {os.getpid()}: requests still running after {master.graceful_timeout}s')
+        self.stop_background(app)
+        return 0
+
+    @staticmethod
+    def stop_background(app):
+        from project.expiry import expiry
+        from project.hashing import hasher
+        from project.outbox import outbox
+
+        outbox.stop(timeout=5)
+        expiry.stop(timeout=5)
+        hasher.shutdown()
+        dispose_engines(app)
+
+
+class Master:
+    def __init__(self, config_filename, overrides, plan, host, sock, graceful_timeout, preload=True, retiring=None,
+                 reload_batch=1, broken=False):
+        self.config_filename = config_filename
+        self.overrides = overrides
+        self.plan = plan
+        self.host = host
+        self.sock = sock
+        self.graceful_timeout = graceful_timeout
+        self.preload = preload
+        self.reload_batch = max(1, reload_batch)
+        self.app = None
+        self.broken = broken
+        self.preload_seconds = None
+        self.workers = {}           # pid: [forked at, seconds to ready]
+        self.retiring = set(retiring or ())
+        self.slots = dict(retiring or {})   # pid: log slot, of the workers and of the retiring ones
+        self._draining = {}         # retiring workers already told to stop: pid: deadline
+        self.stopping = False
+        self._signals = []
+        self.ready_r, self.ready_w = os.pipe()
+        self._ready_buffer = ''
+        self._wake_r, self._wake_w = os.pipe()
+
+    def load(self):
+        if self.broken:
+            return
+        started = time.perf_counter()
+        gc.disable()
+        try:
+            if self.preload:
+                self.app = create_app(self.config_filename, **self.overrides)
+                dispose_engines(self.app)
+        except Exception:
+            if not self.retiring:
+                raise
+            logger.exception('reload failed, the previous workers keep serving')
+            self.broken = True
+        finally:
+            # what is loaded now stays out of the collector, so its pages stay shared with the workers
+            gc.freeze()
+            gc.enable()
+        self.preload_seconds = time.perf_counter() - started
+
+    def run(self, report=False):
+        self.load()
+        os.set_blocking(self._wake_w, False)
+        signal.set_wakeup_fd(self._wake_w)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1, signal.SIGCHLD):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+
+        if not self.broken:
+            logger.info(f'{self.plan.workers} workers x {self.plan.threads} threads on {self.sock.getsockname()}, '
+                        f'pools of {self.plan.pool_size}, preloaded in {self.preload_seconds:.2f}s')
+            for _ in range(self.plan.workers if not self.retiring else 0):
+                self.spawn()
+
+        while True:
+            readable = select.select([self.ready_r, self._wake_r], [], [], 1.0)[0]
+            if self._wake_r in readable:
+                os.read(self._wake_r, 4096)
+            if self.ready_r in readable:
+                self._read_ready()
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self.stop()
+                    return
+                if signum == signal.SIGHUP:
+                    self.reload()
+                elif signum == signal.SIGUSR1:
+                    self.log_report()
+            self._reap()
+
+            all_ready = self.workers and all(seconds is not None for _, seconds in self.workers.values())
+            if self.retiring and not self.broken:
+                self._roll()
+            if all_ready and report:
+                time.sleep(0.5)
+                print_report(self.report())
+                self.stop()
+                return
+
+    def spawn(self):
+        taken = set(self.slots.values())
+        slot = next(slot for slot in itertools.count() if slot not in taken)
+        forked = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = Worker(self, forked, slot).run()
+            except BaseException:
+                logger.exception('worker failed')
+            finally:
+                os._exit(code)
+        self.workers[pid] = [forked, None]
+        self.slots[pid] = slot
+
+    def _roll(self):
+        """One step of a reload: retire old workers for the ready new ones, or start the next batch."""
+        now = time.monotonic()
+        stuck = [pid for pid, deadline in self._draining.items() if deadline <= now]
+        if stuck:
+            logger.warning(f'previous workers {stuck} still running {self.graceful_timeout}s after TERM, killing them')
+            self._kill(stuck, signal.SIGKILL)
+            self._draining.update(dict.fromkeys(stuck, float('inf')))
+        if self._draining.keys() & self.retiring or any(seconds is None for _, seconds in self.workers.values()):
+            return
+        extra = len(self.workers) + len(self.retiring) - self.plan.workers
+        if extra > 0:
+            batch = sorted(self.retiring)[:extra]
+            logger.info(f'{len(self.workers)} new workers ready, stopping previous ones: {batch}')
+            self._kill(batch, signal.SIGTERM)
+            self._draining.update(dict.fromkeys(batch, now + self.graceful_timeout + STOP_MARGIN))
+        else:
+            for _ in range(min(self.reload_batch, self.plan.workers - len(self.workers))):
+                self.spawn()
+
+    def _read_ready(self):
+        # the workers write '<pid> <seconds to ready>' lines
+        self._ready_buffer += os.read(self.ready_r, 4096).decode()
+        *lines, self._ready_buffer = self._ready_buffer.split('\n')
+        for line in lines:
+            pid, seconds = line.split()
+            info = self.workers.get(int(pid))
+            if info is not None:
+                info[1] = float(seconds)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.slots.pop(pid, None)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                self._draining.pop(pid, None)
+                continue
+            info = self.workers.pop(pid, None)
+            if info is None or self.stopping:
+                continue
+            logger.warning(f'worker {pid} exited with {os.waitstatus_to_exitcode(status)}, starting another one')
+            if time.perf_counter() - info[0] < 1:
+                # failing at startup: don't fork in a tight loop
+                time.sleep(1)
+            self.spawn()
+
+    def _kill(self, pids, signum):
+        for pid in list(pids):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(self):
+        self.stopping = True
+        children = set(self.workers) | self.retiring
+        logger.info(f'stopping {len(children)} workers')
+        self._kill(children, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + STOP_MARGIN
+        while children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                children.discard(pid)
+            else:
+                time.sleep(0.1)
+        if children:
+            logger.warning(f'killing workers {sorted(children)}')
+            self._kill(children, signal.SIGKILL)
+        self.sock.close()
+
+    def reload(self):
+        logger.info('reloading')
+        # the master can't survive code that fails at import, check it in a child first
+        check = subprocess.run([sys.executable, '-c', f'import {__spec__.name}'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if check.returncode != 0:
+            logger.error(f'reload failed, going on with the current workers:\n{check.stderr.strip()}')
+            return
+        self.sock.set_inheritable(True)
+        os.environ[LISTEN_FD_ENV] = str(self.sock.fileno())
+        os.environ[RETIRING_ENV] = ','.join(f'{pid}:{slot}' for pid, slot in self.slots.items())
+        signal.set_wakeup_fd(-1)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            os.execv(sys.executable, [sys.executable, '-m', __spec__.name] + sys.argv[1:])
+        except OSError:
+            logger.exception('reload failed, going on with the current workers')
+            os.environ.pop(LISTEN_FD_ENV)
+            os.environ.pop(RETIRING_ENV)
+            signal.set_wakeup_fd(self._wake_w)
+
+    def report(self) -> list:
+        rows = [dict(role='master', pid=os.getpid(), startup=self.preload_seconds, **memory_of(os.getpid()))]
+        rows += [dict(role='worker', pid=pid, startup=seconds, **memory_of(pid))
+                 for pid, (_, seconds) in sorted(self.workers.items())]
+        return rows
+
+    def log_report(self):
+        for row in self.report():
+            logger.info(' '.join(f'{key}={value:.3f}' if isinstance(value, float) else f'{key}={value}'
+                                 for key, value in row.items()))
+
+
+def print_report(rows):
+    print(f'{"role":<8} {"pid":>8} {"startup s":>10} {"RSS MB":>8} {"PSS MB":>8} {"USS MB":>8}')
+    for row in rows:
+        memory = ''.join(f' {row[key]:8.1f}' if key in row else f' {"-":>8}' for key in ('rss', 'pss', 'uss'))
+        startup = f'{row["startup"]:10.3f}' if row['startup'] is not None else f'{"-":>10}'
+        print(f'{row["role"]:<8} {row["pid"]:>8} {startup}{memory}')
+    workers = [row for row in rows if row['role'] == 'worker' and 'uss' in row]
+    if workers:
+        print(f'private memory per worker: {sum(row["uss"] for row in workers) / len(workers):.1f} MB')
+
+
+def read_config(config_filename):
+    """The config create_app() will see, read before building the app."""
+    config = Flask('project', instance_relative_config=True).config
+    config.from_pyfile(config_filename)
+    return config
+
+
+def listening_socket(host, port):
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd is not None:
+        sock = socket.socket(fileno=int(fd))
+    else:
+        sock = socket.create_server((host, port), family=socket.AF_INET6 if ':' in host else socket.AF_INET,
+                                    backlog=2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='flask.cfg', help='config file of the instance folder')
+    parser.add_argument('--bind', help='host:port (default: SERVER_BIND)')
+    parser.add_argument('--workers', type=int, help='default: SERVER_WORKERS or sized from CPUs and DB limits')
+    parser.add_argument('--threads', type=int, help='default: SERVER_THREADS')
+    parser.add_argument('--no-preload', action='store_true', help='build the app in every worker instead')
+    parser.add_argument('--report', action='store_true', help='print startup time and memory per worker, then exit')
+    args = parser.parse_args()
+
+    # pid:slot of the workers of the master this one replaces
+    retiring = dict(map(int, worker.split(':')) for worker in os.environ.pop(RETIRING_ENV, '').split(',') if worker)
+    try:
+        config = read_config(args.config)
+        if args.workers:
+            config['SERVER_WORKERS'] = args.workers
+        if args.threads:
+            config['SERVER_THREADS'] = args.threads
+        plan = plan_workers(config, available_cpus(), db_connection_budget(config))
+        broken = False
+    except Exception:
+        if not retiring:
+            raise
+        # reloading: this process is the parent of the previous workers, it must stay up
+        logger.exception('reload failed, the previous workers keep serving')
+        config, plan, broken = {}, None, True
+    overrides = {
+        'SQLALCHEMY_ENGINE_OPTIONS': dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {},
+                                          pool_size=plan.pool_size, max_overflow=0),
+        'HASHING_WORKERS': plan.hashing_workers,
+    } if plan else {}
+
+    host, _, port = (args.bind or config.get('SERVER_BIND', '127.0.0.1:8000')).rpartition(':')
+    host = host.strip('[]')
+    master = Master(args.config, overrides, plan, host, listening_socket(host, int(port)),
+                    config.get('SERVER_GRACEFUL_TIMEOUT', 30), preload=not args.no_preload, retiring=retiring,
+                    reload_batch=config.get('SERVER_RELOAD_BATCH', 1), broken=broken)
+    master.run(report=args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""Per-request SQL instrumentation.
+
+Engine events count the statements and DB time of every request. Statements
+are reduced to a shape (literals and IN-lists collapsed); a shape repeated
+SQL_NPLUSONE_THRESHOLD times in one request is reported as a possible N+1.
+In debug mode the counters are also sent back as X-Query-* headers, and
+per-endpoint totals are served from /stats/sql.
+
+count_queries() collects the same numbers for any block of code, which is
+what the test suite uses to hold routes to a query budget.
+
+Config:
+    SQL_STATS                 enable the instrumentation (default True)
+    SQL_STATS_HEADERS         add X-Query-* headers (default: app.debug)
+    SQL_NPLUSONE_THRESHOLD    repeats of one shape flagged as N+1 (default 5)
+"""
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock, local
+
+from flask import request
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_IN_LIST = re.compile(r'\(\s*(?:%\(\w+\)s|\?|:\w+)(?:\s*,\s*(?:%\(\w+\)s|\?|:\w+))+\s*\)')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+\b')
+_PARAM = re.compile(r'%\(\w+\)s|:\w+')
+
+_collectors = local()
+
+ENVIRON_KEY = 'sql_stats.queries'
+
+
+def statement_shape(statement: str) -> str:
+    shape = _IN_LIST.sub('(?)', statement)
+    shape = _STRING.sub('?', shape)
+    shape = _PARAM.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    return ' '.join(shape.split())
+
+
+class QueryLog:
+    """Statements executed while the log is active in the current thread."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+        self.shapes = Counter()
+
+    def add(self, statement, elapsed):
+        self.count += 1
+        self.seconds += elapsed
+        self.statements.append(statement)
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold):
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+def _active_logs():
+    logs = getattr(_collectors, 'logs', None)
+    if logs is None:
+        logs = _collectors.logs = []
+    return logs
+
+
+@contextmanager
+def count_queries():
+    log = QueryLog()
+    logs = _active_logs()
+    logs.append(log)
+    try:
+        yield log
+    finally:
+        logs.remove(log)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_collectors, 'logs', None):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    logs = getattr(_collectors, 'logs', None)
+    if not logs or not conn.info.get('query_started'):
+        return
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    for log in logs:
+        log.add(statement, elapsed)
+
+
+class EndpointStats:
+    __slots__ = ('requests', 'queries', 'max_queries', 'seconds', 'n_plus_one', 'repeated')
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.seconds = 0.0
+        self.n_plus_one = 0
+        self.repeated = Counter()
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'queries': self.queries,
+            'avg_queries': round(self.queries / self.requests, 2) if self.requests else 0,
+            'max_queries': self.max_queries,
+            'db_ms': round(self.seconds * 1000, 2),
+            'n_plus_one_requests': self.n_plus_one,
+            'repeated_shapes': dict(self.repeated.most_common(5)),
+        }
+
+
+class QueryStats:
+    def __init__(self, app=None):
+        self._lock = Lock()
+        self.endpoints = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('SQL_STATS', True):
+            return
+        self.threshold = app.config.get('SQL_NPLUSONE_THRESHOLD', 5)
+        self.headers = app.config.get('SQL_STATS_HEADERS', app.debug)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.extensions['sql_stats'] = self
+        app.extensions.setdefault('stats', {})['sql'] = self.stats
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    # kept in the WSGI environ rather than g: a request context preserved by the
+    # test client is torn down after the app context (and its g) is gone
+    def _start(self):
+        log = request.environ[ENVIRON_KEY] = QueryLog()
+        _active_logs().append(log)
+
+    def _finish(self, response):
+        log = request.environ.get(ENVIRON_KEY)
+        if log is None:
+            return response
+        endpoint = request.endpoint or request.path
+        repeated = log.repeated(self.threshold)
+        for shape, n in repeated:
+            logger.warning(f'possible N+1 on {endpoint}: {n} x {shape[:200]}')
+
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.requests += 1
+            stats.queries += log.count
+            stats.max_queries = max(stats.max_queries, log.count)
+            stats.seconds += log.seconds
+            if repeated:
+                stats.n_plus_one += 1
+                stats.repeated.update(dict(repeated))
+
+        if self.headers:
+            response.headers['X-Query-Count'] = str(log.count)
+            response.headers['X-Query-Time-ms'] = f'{log.seconds * 1000:.2f}'
+            response.headers['X-Query-Repeated'] = str(len(repeated))
+        return response
+
+    def _teardown(self, exc):
+        log = request.environ.pop(ENVIRON_KEY, None)
+        logs = _active_logs()
+        if log is not None and log in logs:
+            logs.remove(log)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {endpoint: stats.as_dict() for endpoint, stats in sorted(self.endpoints.items())}
+
+
+query_stats = QueryStats()
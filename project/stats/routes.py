@@ -0,0 +1,24 @@
+from flask import current_app, jsonify
+from werkzeug.exceptions import abort
+
+from . import stats
+
+
+@stats.before_request
+def stats_enabled():
+    if not current_app.config.get('STATS_ENABLED', current_app.debug):
+        abort(404)
+
+
+@stats.route('/')
+def all_stats():
+    providers = current_app.extensions.get('stats', {})
+    return jsonify({name: provider() for name, provider in providers.items()})
+
+
+@stats.route('/<name>')
+def one_stats(name):
+    provider = current_app.extensions.get('stats', {}).get(name)
+    if provider is None:
+        abort(404)
+    return jsonify(provider())
@@ -1,11 +1,46 @@
+"""Test database harness.
+
+The schema is created once per run, in a template database. Each process
+(every pytest-xdist worker, or the only one without xdist) clones its own
+database from the template with CREATE DATABASE ... TEMPLATE, and every
+test using init_database runs in a transaction that is rolled back at the
+end: the commits of the code under test only release a SAVEPOINT.
+
+Fixture users get their bcrypt hashes at the minimum cost, once per
+password for the whole run.
+
+    python -m pytest -n auto
+"""
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+
+import bcrypt
 import pytest
 import testing.postgresql
 from loguru import logger
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
 
+from benchmarks._smtp_stub import SMTPStub
 from project import create_app, db
+from project.cache import user_cache
 from project.models import User, UsersGroup
+from project.page_cache import page_cache
+from project.ratelimit import limiter
+from project.replicas import replicas
+from project.sql_stats import count_queries
+
+TEMPLATE_DATABASE = 'service_station_template'
+FIXTURE_ROUNDS = 4  # the lowest cost bcrypt accepts
+
+DEFAULT_USER = dict(first_name='First_Name1', last_name='Last_Name1', email='email1@gmail.com',
+                    phone='442083661177', password='Password1!')
+
 
-postgresql = testing.postgresql.Postgresql(port=7654)
+@lru_cache(maxsize=None)
+def fixture_password_hash(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(FIXTURE_ROUNDS)).decode('utf-8')
 
 
 class NewTestUser(User):
@@ -17,10 +52,66 @@ class NewTestUser(User):
             phone='442083661177',
             password='Password1!'
         )
-        
-        
+
+    def set_password(self, password: str) -> None:
+        self.password = fixture_password_hash(password)
+        self.salt = self.password[:29]
+
+
+def _database_url(server_url, name):
+    return str(make_url(server_url).set(database=name))
+
+
+def _build_template(server_url):
+    with create_engine(server_url, isolation_level='AUTOCOMMIT').connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS {TEMPLATE_DATABASE}'))
+        conn.execute(text(f'CREATE DATABASE {TEMPLATE_DATABASE}'))
+
+    engine = create_engine(_database_url(server_url, TEMPLATE_DATABASE))
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(UsersGroup.__table__.insert(), {'group_id': 2, 'group_name': 'users'})
+        user = dict(DEFAULT_USER, password=fixture_password_hash(DEFAULT_USER['password']), group_id=2, active=True)
+        user['salt'] = user['password'][:29]
+        conn.execute(User.__table__.insert(), user)
+    # CREATE DATABASE ... TEMPLATE fails while anyone is connected to the template
+    engine.dispose()
+    logger.info(f'template database {TEMPLATE_DATABASE} ready')
+
+
+def pytest_configure(config):
+    if hasattr(config, 'workerinput'):
+        # an xdist worker: the controller has started the server and built the template
+        return
+    config.postgresql = testing.postgresql.Postgresql(port=7654)
+    _build_template(config.postgresql.url())
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    node.workerinput['postgresql_url'] = node.config.postgresql.url()
+
+
+def pytest_unconfigure(config):
+    postgresql = getattr(config, 'postgresql', None)
+    if postgresql is not None:
+        postgresql.stop()
+
+
+@pytest.fixture(scope='session')
+def database_url(request):
+    """A database of this process, cloned from the template."""
+    config = request.config
+    server_url = config.workerinput['postgresql_url'] if hasattr(config, 'workerinput') else config.postgresql.url()
+    name = f"test_{os.environ.get('PYTEST_XDIST_WORKER', 'main')}"
+    with create_engine(server_url, isolation_level='AUTOCOMMIT').connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS {name}'))
+        conn.execute(text(f'CREATE DATABASE {name} TEMPLATE {TEMPLATE_DATABASE}'))
+    return _database_url(server_url, name)
+
+
 @pytest.fixture(scope='function')
-def new_user(request):
+def new_user(request, init_database):
     user = NewTestUser(request.param)
     logger.info(f'adding {user.email} to the db')
     db.session.add(user)
@@ -29,9 +120,26 @@ def new_user(request):
 
 
 @pytest.fixture(scope='session')
-def test_client():
-    flask_app = create_app('flask_test.cfg')
+def flask_app(database_url):
+    """The one app of the run.
+
+    The extensions are module-level singletons that every create_app()
+    rebinds, so tests needing an app use this one instead of creating theirs.
+    """
+    return create_app(
+        'flask_test.cfg',
+        SQLALCHEMY_DATABASE_URI=database_url,
+        HASHING_EXECUTOR='inline',
+        HASHING_ROUNDS=FIXTURE_ROUNDS,
+        MAIL_OUTBOX_WORKER=False,
+        EXPIRY_SWEEPER_WORKER=False,
+        RATELIMIT_ENABLED=False,
+        PAGE_CACHE_ENABLED=False,
+    )
+
 
+@pytest.fixture(scope='session')
+def test_client(flask_app):
     # Create a test client using the Flask application configured for testing
     with flask_app.test_client() as testing_client:
         # Establish an application context
@@ -39,54 +147,82 @@ def test_client():
             yield testing_client  # this is where the testing happens!
 
 
-@pytest.fixture(scope='module')
+@pytest.fixture(autouse=True)
+def reset_extensions():
+    """Forget what one test left in the in-process caches and counters of the extensions."""
+    yield
+
+    limiter.reset()
+    page_cache.clear()
+    replicas.reset()
+    user_cache.clear()
+
+
+@pytest.fixture(scope='function')
 def init_database(test_client):
-    # Drop and Create the database and the database table
-    logger.info('------------------------------START------------------------------------------------')
-    db.session.commit()
-    db.drop_all()
-    logger.info('db drop all')
-    
-    db.create_all()
-    logger.info('db create all')
-
-    # Insert user_group data
-    user_group = UsersGroup(
-        group_id=2,
-        group_name='users'
-    )
-    db.session.add(user_group)
-    db.session.commit()
-    
-    # Insert user data
-    user1 = User(
-        first_name='First_Name1',
-        last_name='Last_Name1',
-        email='email1@gmail.com',
-        phone='442083661177',
-        password='Password1!'
-    )
-    db.session.add(user1)
-    logger.info(f'db add user {user1.email}')
+    """Run the test in a transaction that is rolled back afterwards.
+
+    db.session is bound to one connection inside an open transaction, and
+    a SAVEPOINT is restarted whenever the session ends one, so commits and
+    rollbacks of the code under test never reach the outer transaction.
+    """
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    savepoint = connection.begin_nested()
+    session = db.create_scoped_session(options={'bind': connection, 'binds': {}})
+
+    def restart_savepoint(sess, trans):
+        nonlocal savepoint
+        if not savepoint.is_active:
+            savepoint = connection.begin_nested()
+
+    # on the factory, so the sessions created after a teardown's remove() get it too
+    event.listen(session.session_factory, 'after_transaction_end', restart_savepoint)
+    app_session, db.session = db.session, session
 
-    db.session.commit()
-    
     yield  # this is where the testing happens!
-    
-    db.session.commit()
-    db.drop_all()
-    logger.info('db drop all')
-    logger.info('---------------------------END---------------------------------------------------')
-    
-    # postgresql.stop()
+
+    session.remove()
+    db.session = app_session
+    transaction.rollback()
+    connection.close()
+    user_cache.clear()
 
 
 @pytest.fixture(scope='function')
 def login_default_user(test_client):
     test_client.post('/login',
-                     data=dict(email='email1@gmail.com', password='Password1!'),
+                     data=dict(email=DEFAULT_USER['email'], password=DEFAULT_USER['password']),
                      follow_redirects=True)
 
     yield  # this is where the testing happens!
 
     test_client.get('/logout', follow_redirects=True)
+
+
+@pytest.fixture(scope='function')
+def smtp_stub(flask_app, monkeypatch):
+    """A local SMTP server the app sends to, instead of suppressing the sends."""
+    state = flask_app.extensions['mail']
+    with SMTPStub() as smtp:
+        for name, value in dict(server='localhost', port=smtp.port, use_tls=False, use_ssl=False,
+                                username=None, suppress=False).items():
+            monkeypatch.setattr(state, name, value)
+        yield smtp
+
+
+@pytest.fixture(scope='function')
+def query_budget():
+    """Fail when the block runs more SQL statements than allowed:
+
+        with query_budget(3):
+            test_client.get('/profile/1')
+    """
+    @contextmanager
+    def budget(max_queries):
+        with count_queries() as queries:
+            yield queries
+        assert queries.count <= max_queries, \
+            f'{queries.count} queries, budget is {max_queries}:\n' + '\n'.join(queries.statements)
+
+    return budget
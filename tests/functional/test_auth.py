@@ -267,3 +267,20 @@ def test_duplicate_registration(test_client, init_database):
     assert b'Log Out' not in response.data
     assert b'Log In' in response.data
     assert b'Register' in response.data
+
+
+def test_login_query_budget(test_client, init_database, query_budget):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/login' page is posted to with valid and with invalid credentials (POST)
+    THEN check each attempt looks the user up with a single query
+    """
+    with query_budget(1):
+        response = test_client.post('/login', data=dict(email='email1@gmail.com', password='InvalidPassword'))
+    assert response.status_code == 302
+
+    with query_budget(1):
+        response = test_client.post('/login', data=dict(email='email1@gmail.com', password='Password1!'))
+    assert response.status_code == 302
+
+    test_client.get('/logout', follow_redirects=True)
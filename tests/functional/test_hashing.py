@@ -0,0 +1,109 @@
+"""
+This file (test_hashing.py) contains the functional tests for the password hashing of the `auth` blueprint.
+
+These tests use POSTs to '/login' and '/register' URLs while the bcrypt
+pool is full or the stored hashes have another cost.
+"""
+from threading import BoundedSemaphore
+
+import pytest
+
+from project import db
+from project.cache import user_cache
+from project.hashing import cost_of, hasher
+from project.models import User
+
+
+@pytest.fixture
+def busy_hasher(monkeypatch):
+    """The bcrypt pool with every slot taken, as during a login storm."""
+    slots = BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(hasher, 'kind', 'thread')
+    monkeypatch.setattr(hasher, 'timeout', 0)
+    monkeypatch.setattr(hasher, '_slots', slots)
+    return hasher
+
+
+def test_login_when_hashing_is_busy(test_client, init_database, busy_hasher):
+    """
+    GIVEN a full bcrypt pool
+    WHEN the '/login' page is posted to (POST) with valid credentials
+    THEN check the response is a 503 asking to retry, without logging in
+    """
+    rejected = busy_hasher.rejected
+    response = test_client.post('/login', data={'email': 'email1@gmail.com', 'password': 'Password1!'})
+    assert response.status_code == 503
+    assert b'Server is busy, please try again' in response.data
+    assert b'Log In' in response.data
+    assert busy_hasher.rejected == rejected + 1
+
+
+def test_register_when_hashing_is_busy(test_client, init_database, busy_hasher):
+    """
+    GIVEN a full bcrypt pool
+    WHEN the '/register' page is posted to (POST) with a valid new user
+    THEN check the response is a 503 asking to retry, and the user is not registered
+    """
+    response = test_client.post('/register', data={
+        'first_name': 'John',
+        'last_name': 'Rambo',
+        'email': 'busy@gmail.com',
+        'phone': '442083661177',
+        'password': 'Password1!',
+        'password_check': 'Password1!'
+    })
+    assert response.status_code == 503
+    assert b'Server is busy, please try again' in response.data
+    assert User.by_email('busy@gmail.com') is None
+
+
+def test_login_rehashes_a_hash_of_another_cost(test_client, init_database, monkeypatch):
+    """
+    GIVEN a user with a cost 4 hash cached by an earlier request, and a hasher configured for cost 5
+    WHEN the '/login' page is posted to (POST) with valid credentials, twice
+    THEN check the first login stores a cost 5 hash of the same password and drops the cached user,
+        and the second login doesn't rehash again
+    """
+    monkeypatch.setattr(hasher, 'rounds', 5)
+    user = User.by_email('email1@gmail.com')
+    assert cost_of(user.password) == 4
+    user_cache.put(user)
+    rehashed = hasher.rehashed
+
+    response = test_client.post('/login', data={'email': 'email1@gmail.com', 'password': 'Password1!'})
+    assert response.status_code == 302
+    assert hasher.rehashed == rehashed + 1
+    assert user_cache._cache.get(user.user_id) is None
+
+    # the next request caches the user again, with the new hash
+    assert b'Welcome' in test_client.get(response.location).data
+    assert cost_of(user_cache._cache.get(user.user_id)['password']) == 5
+    db.session.expire_all()
+    user = User.by_email('email1@gmail.com')
+    assert cost_of(user.password) == 5
+    assert user.salt == user.password[:29]
+    assert user.check_password('Password1!')
+
+    test_client.get('/logout', follow_redirects=True)
+    response = test_client.post('/login', data={'email': 'email1@gmail.com', 'password': 'Password1!'},
+                                follow_redirects=True)
+    assert b'Welcome' in response.data
+    assert hasher.rehashed == rehashed + 1
+    test_client.get('/logout', follow_redirects=True)
+
+
+def test_rehash_keeps_a_password_changed_meanwhile(init_database):
+    """
+    GIVEN a rehash scheduled for the old hash of a user
+    WHEN the password changes before the rehash is stored
+    THEN check the new password is kept
+    """
+    user = User.by_email('email1@gmail.com')
+    old_hash = user.password
+    user.set_password('Changed1!')
+    db.session.commit()
+
+    User._store_rehash(user.user_id, old_hash, hasher.hash_password('Password1!', hasher.gensalt()))
+    db.session.expire_all()
+    assert User.by_email('email1@gmail.com').check_password('Changed1!')
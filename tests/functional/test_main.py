@@ -4,17 +4,12 @@ This file (test_main.py) contains the functional tests for the `recipes` bluepri
 These tests use GETs and POSTs to different URLs to check for the proper behavior
 of the `recipes` blueprint.
 """
-from project import create_app
-
-
-def test_home_page():
+def test_home_page(flask_app):
     """
     GIVEN a Flask application configured for testing
     WHEN the '/' page is requested (GET)
     THEN check that the response is valid
     """
-    flask_app = create_app('flask_test.cfg')
-
     # Create a test client using the Flask application configured for testing
     with flask_app.test_client() as test_client:
         response = test_client.get('/')
@@ -25,14 +20,12 @@ def test_home_page():
         assert b"Register" in response.data
 
 
-def test_home_page_post():
+def test_home_page_post(flask_app):
     """
     GIVEN a Flask application configured for testing
     WHEN the '/' page is posted to (POST)
     THEN check that a '405' status code is returned
     """
-    flask_app = create_app('flask_test.cfg')
-
     # Create a test client using the Flask application configured for testing
     with flask_app.test_client() as test_client:
         response = test_client.post('/')
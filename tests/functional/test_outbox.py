@@ -0,0 +1,104 @@
+"""
+This file (test_outbox.py) contains the functional tests for the email outbox, sent to a local SMTP stub.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from project import db
+from project.models import OutboxEmail
+from project.outbox import outbox
+
+BACKOFF = 30
+
+
+@pytest.fixture(scope='function')
+def sender(init_database, smtp_stub, monkeypatch):
+    monkeypatch.setattr(outbox, 'batch_size', 50)
+    monkeypatch.setattr(outbox, 'backoff', BACKOFF)
+    monkeypatch.setattr(outbox, 'max_attempts', 5)
+    return smtp_stub
+
+
+def enqueue(count):
+    return [outbox.enqueue(f'message {i}', ['user@example.com'], 'hello', '<p>hello</p>').email_id
+            for i in range(count)]
+
+
+def make_due(email_ids):
+    """Move the next attempt of the messages to the past, as if their backoff or lease were over."""
+    OutboxEmail.query.filter(OutboxEmail.email_id.in_(email_ids)) \
+        .update({'next_attempt': datetime.now() - timedelta(seconds=1)}, synchronize_session=False)
+    db.session.commit()
+
+
+def test_batch_sent_over_one_connection(sender, monkeypatch):
+    """
+    GIVEN five messages in the outbox
+    WHEN the outbox is drained with batches of 50, then five more with batches of 2
+    THEN check every message is sent once, over one SMTP connection per batch
+    """
+    enqueue(5)
+    assert outbox.drain() == 5
+    assert sender.connections == 1
+    assert sorted(sender.subjects) == [f'message {i}' for i in range(5)]
+    assert OutboxEmail.query.filter(OutboxEmail.sent.is_(None)).count() == 0
+
+    monkeypatch.setattr(outbox, 'batch_size', 2)
+    enqueue(5)
+    assert outbox.drain() == 5
+    assert sender.connections == 1 + 3
+    assert sender.messages == 10
+
+
+def test_failed_message_retried_with_backoff(sender):
+    """
+    GIVEN two messages in the outbox and an SMTP server failing the first message it gets, twice in a row
+    WHEN the outbox is drained, then again once the backoff is over
+    THEN check the other message is sent on the same connection and the failed one waits twice as long each time
+    """
+    first, second = enqueue(2)
+    sender.reject = 1
+    before = datetime.now()
+    assert outbox.drain() == 2
+    failed = OutboxEmail.query.get(first)
+    assert failed.sent is None and failed.attempts == 1 and '451' in failed.last_error
+    assert before + timedelta(seconds=BACKOFF) <= failed.next_attempt <= datetime.now() + timedelta(seconds=BACKOFF)
+    assert OutboxEmail.query.get(second).sent is not None
+    assert sender.connections == 1
+
+    # not due yet
+    assert outbox.drain() == 0
+
+    make_due([first])
+    sender.reject = 1
+    before = datetime.now()
+    assert outbox.drain() == 1
+    failed = OutboxEmail.query.get(first)
+    assert failed.attempts == 2 and failed.next_attempt >= before + timedelta(seconds=2 * BACKOFF)
+
+    make_due([first])
+    assert outbox.drain() == 1
+    assert OutboxEmail.query.get(first).sent is not None
+    assert sorted(sender.subjects) == ['message 0', 'message 1']
+
+
+def test_claimed_messages_not_sent_again_after_restart(sender):
+    """
+    GIVEN a sender that claimed a batch and died before sending it
+    WHEN another sender drains the outbox, then again once the lease of the batch is over
+    THEN check the batch is left alone during the lease and then sent once
+    """
+    email_ids = enqueue(2)
+    claimed = outbox._claim_batch()
+    assert sorted(email.email_id for email in claimed) == email_ids
+    assert all(email.attempts == 1 and email.next_attempt > datetime.now() for email in claimed)
+
+    assert outbox.drain() == 0
+    assert sender.messages == 0
+
+    make_due(email_ids)
+    assert outbox.drain() == 2
+    assert outbox.drain() == 0
+    assert sorted(sender.subjects) == ['message 0', 'message 1']
+    assert all(email.attempts == 2 for email in OutboxEmail.query.filter(OutboxEmail.email_id.in_(email_ids)))
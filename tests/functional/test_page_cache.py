@@ -0,0 +1,99 @@
+"""
+This file (test_page_cache.py) contains the functional tests for the guest page cache.
+"""
+import time
+
+import pytest
+
+from project.page_cache import page_cache
+from project.replicas import STICKY_KEY
+
+
+@pytest.fixture(scope='function')
+def enabled_page_cache():
+    enabled = page_cache.enabled
+    page_cache.enabled = True
+    page_cache.clear()
+
+    yield
+
+    page_cache.enabled = enabled
+    page_cache.clear()
+
+
+def test_index_served_from_cache_with_etag(test_client, enabled_page_cache):
+    """
+    GIVEN a Flask application with the page cache enabled
+    WHEN the '/index' page is requested twice by a guest, then with the ETag of the answer (GET)
+    THEN check the same page is returned both times and a '304' status code the third time
+    """
+    first = test_client.get('/index')
+    second = test_client.get('/index')
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    assert b"HELLO!!" in second.data
+    assert second.headers['ETag']
+    assert 'private' in second.headers['Cache-Control']
+    assert 'Cookie' in second.headers['Vary']
+
+    response = test_client.get('/index', headers={'If-None-Match': second.headers['ETag']})
+    assert response.status_code == 304
+    assert page_cache.stats()['not_modified'] >= 1
+
+
+def test_logged_in_user_bypasses_cache(test_client, init_database, enabled_page_cache, login_default_user):
+    """
+    GIVEN a Flask application with the page cache enabled and a logged in user
+    WHEN the '/index' page is requested (GET)
+    THEN check the user gets the personal page, not the guest one
+    """
+    bypassed = page_cache.bypassed
+    response = test_client.get('/index')
+    assert response.status_code == 200
+    assert b"HELLO, First_Name1 Last_Name1" in response.data
+    assert page_cache.bypassed == bypassed + 1
+
+
+def test_guest_after_logout_served_from_cache(test_client, init_database, enabled_page_cache):
+    """
+    GIVEN a Flask application with the page cache enabled
+    WHEN a user logs in and out, then requests the '/index' page twice (GET)
+    THEN check the second page comes from the cache and the guest page holds no session cookie
+    """
+    test_client.post('/login', data=dict(email='email1@gmail.com', password='Password1!'), follow_redirects=True)
+    test_client.get('/logout', follow_redirects=True)
+
+    first = test_client.get('/index')
+    hits = page_cache.stats()['hits']
+    second = test_client.get('/index')
+    assert first.status_code == second.status_code == 200
+    assert b"HELLO!!" in second.data
+    assert page_cache.stats()['hits'] == hits + 1
+    _, headers, _ = page_cache._cache.get('localhost/index?')
+    assert 'Set-Cookie' not in dict(headers)
+
+
+def test_guest_after_sticky_deadline_served_from_cache(test_client, enabled_page_cache):
+    """
+    GIVEN a guest whose session sticks to the primary until a deadline, in the future then in the past
+    WHEN the '/index' page is requested twice each time (GET)
+    THEN check the cache is bypassed only before the deadline
+    """
+    with test_client.session_transaction() as session:
+        session[STICKY_KEY] = time.time() + 60
+    bypassed = page_cache.bypassed
+    test_client.get('/index')
+    test_client.get('/index')
+    assert page_cache.bypassed == bypassed + 2
+
+    with test_client.session_transaction() as session:
+        session[STICKY_KEY] = time.time() - 1
+    test_client.get('/index')
+    hits = page_cache.stats()['hits']
+    response = test_client.get('/index')
+    assert response.status_code == 200
+    assert page_cache.bypassed == bypassed + 2
+    assert page_cache.stats()['hits'] == hits + 1
+
+    with test_client.session_transaction() as session:
+        session.pop(STICKY_KEY)
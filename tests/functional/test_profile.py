@@ -0,0 +1,45 @@
+"""
+This file (test_profile.py) contains the functional tests for the `profile` blueprint.
+"""
+from datetime import date, datetime, timedelta
+
+from project import db
+from project.models import Size, StorageOrder, User, Warehouse
+
+SEASON_START = date(2022, 6, 1)
+
+
+def add_orders(count, first_shelf):
+    """`count` orders of the default user, on shelves of three sizes."""
+    user_id = User.by_email('email1@gmail.com').user_id
+    sizes = [Size(size_id=first_shelf + i, size_name=13 + i) for i in range(3)]
+    shelves = [Warehouse(shelf_id=first_shelf + i, size_id=sizes[i % 3].size_id, active=True) for i in range(count)]
+    db.session.add_all(sizes + shelves)
+    db.session.add_all([StorageOrder(start_date=SEASON_START + timedelta(days=i), storage_order_cost=100,
+                                     stop_date=SEASON_START + timedelta(days=i + 7), created=datetime.now(),
+                                     user_id=user_id,
+                                     shelf_id=shelf.shelf_id)
+                        for i, shelf in enumerate(shelves)])
+    db.session.commit()
+
+
+def test_profile_queries_do_not_grow_with_orders(test_client, init_database, login_default_user, query_budget):
+    """
+    GIVEN a logged in user with one order, then with more orders than a page holds
+    WHEN the profile page is requested (GET)
+    THEN check both pages run the same number of SQL statements, within the budget
+    """
+    user = User.by_email('email1@gmail.com')
+    user.created = datetime.now()  # shown on the page, the fixture user has none
+    db.session.commit()
+    user_id = user.user_id
+    add_orders(1, first_shelf=9100)
+    with query_budget(2) as one_order:
+        response = test_client.get(f'/profile/{user_id}')
+    assert response.status_code == 200
+
+    add_orders(30, first_shelf=9200)
+    with query_budget(2) as full_page:
+        response = test_client.get(f'/profile/{user_id}')
+    assert response.status_code == 200
+    assert full_page.count == one_order.count
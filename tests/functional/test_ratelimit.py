@@ -0,0 +1,64 @@
+"""
+This file (test_ratelimit.py) contains the functional tests for the login rate limits.
+"""
+import pytest
+
+from project import trust_proxies
+from project.ratelimit import limiter
+
+
+@pytest.fixture(scope='function')
+def tight_login_limits():
+    rules, enabled = limiter.rules, limiter.enabled
+    limiter.rules = dict(rules, login_ip=(100, 60), login_email=(2, 60))
+    limiter.enabled = True
+    limiter.reset()
+
+    yield
+
+    limiter.rules, limiter.enabled = rules, enabled
+    limiter.reset()
+
+
+def test_login_rejected_over_email_limit(test_client, init_database, tight_login_limits):
+    """
+    GIVEN a Flask application with a login limit of 2 attempts per email
+    WHEN the '/login' page is posted to a third time with the same email (POST)
+    THEN check a '429' status code is returned before the password is checked
+    """
+    rejected = limiter.rejected.get('login_email', 0)
+    for _ in range(2):
+        response = test_client.post('/login', data=dict(email='email1@gmail.com', password='InvalidPassword'))
+        assert response.status_code != 429
+
+    response = test_client.post('/login', data=dict(email='Email1@gmail.com ', password='InvalidPassword'))
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+    assert limiter.rejected['login_email'] == rejected + 1
+
+    # another email from the same address is still allowed
+    response = test_client.post('/login', data=dict(email='email2@gmail.com', password='InvalidPassword'))
+    assert response.status_code != 429
+
+
+def test_login_ip_limit_keyed_on_forwarded_client(test_client, init_database, tight_login_limits, monkeypatch):
+    """
+    GIVEN a Flask application behind one trusted proxy with a login limit of 2 attempts per IP
+    WHEN two clients behind the proxy post to the '/login' page (POST)
+    THEN check each client is limited on its own address, not on the proxy's
+    """
+    app = test_client.application
+    monkeypatch.setattr(app, 'wsgi_app', app.wsgi_app)
+    monkeypatch.setitem(app.config, 'PROXY_FIX_X_FOR', 1)
+    trust_proxies(app)
+    limiter.rules = dict(limiter.rules, login_ip=(2, 60), login_email=(100, 60))
+
+    def login(client_ip):
+        return test_client.post('/login', data=dict(email='email1@gmail.com', password='InvalidPassword'),
+                                headers={'X-Forwarded-For': f'10.0.0.99, {client_ip}'})
+
+    assert login('203.0.113.1').status_code != 429
+    assert login('203.0.113.1').status_code != 429
+    assert login('203.0.113.1').status_code == 429
+    # the spoofed first entry is not trusted, the second client has its own bucket
+    assert login('203.0.113.2').status_code != 429
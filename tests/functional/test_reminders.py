@@ -0,0 +1,49 @@
+"""
+This file (test_reminders.py) contains the functional tests for the storage reminder digests.
+"""
+from datetime import date, datetime, timedelta
+
+from project import db, mail
+from project.models import Size, StorageOrder, User, Warehouse
+from project.outbox import outbox
+from project.reminders import reminders
+
+SIZE_ID = 9300
+
+
+def add_order(shelf_id, stop_date, user_id):
+    db.session.add(Warehouse(shelf_id=shelf_id, size_id=SIZE_ID, active=True))
+    order = StorageOrder(start_date=stop_date - timedelta(days=30), stop_date=stop_date, storage_order_cost=100,
+                         created=datetime.now(), user_id=user_id, shelf_id=shelf_id)
+    db.session.add(order)
+    return order
+
+
+def test_reminder_sent_once(init_database, smtp_stub):
+    """
+    GIVEN a customer with two orders ending within REMINDER_DAYS_BEFORE days and one ending later
+    WHEN the reminders are sent and the outbox drained, twice
+    THEN check one digest for the two orders goes out the first time, and nothing the second time
+    """
+    today = date.today()
+    user_id = User.by_email('email1@gmail.com').user_id
+    db.session.add(Size(size_id=SIZE_ID, size_name=17))
+    due = [add_order(SIZE_ID + 1, today + timedelta(days=2), user_id),
+           add_order(SIZE_ID + 2, today + timedelta(days=reminders.days_before), user_id)]
+    later = add_order(SIZE_ID + 3, today + timedelta(days=reminders.days_before + 1), user_id)
+    db.session.commit()
+    due_ids = [order.storage_order_id for order in due]
+
+    assert reminders.send(today) == 1
+    with mail.record_messages() as sent:
+        assert outbox.drain() == 1
+    assert smtp_stub.messages == 1
+    assert [message.recipients for message in sent] == [['email1@gmail.com']]
+    assert all(f'заказ №{order_id},' in sent[0].body for order_id in due_ids)
+    assert f'заказ №{later.storage_order_id},' not in sent[0].body
+    assert all(StorageOrder.query.get(order_id).reminded is not None for order_id in due_ids)
+    assert StorageOrder.query.get(later.storage_order_id).reminded is None
+
+    assert reminders.send(today) == 0
+    assert outbox.drain() == 0
+    assert smtp_stub.messages == 1
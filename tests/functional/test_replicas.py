@@ -0,0 +1,114 @@
+"""
+This file (test_replicas.py) contains the functional tests for the read replica routing.
+
+The replica is a second, empty testing.postgresql server with the same
+schema: rows written to the primary are not there, so a query that finds
+nothing went to the replica.
+"""
+import time
+
+import pytest
+import testing.postgresql
+from flask import session
+from sqlalchemy import create_engine
+
+from project import db
+from project.models import User
+from project.replicas import STICKY_KEY, read_replica, replicas
+
+EMAIL = 'replica@gmail.com'
+
+
+@pytest.fixture(scope='module')
+def replica_app(test_client):
+    app = test_client.application
+    with testing.postgresql.Postgresql() as replica:
+        engine = create_engine(replica.url())
+        db.metadata.create_all(engine)
+        engine.dispose()
+
+        app.config.update(SQLALCHEMY_REPLICAS=[replica.url()], REPLICA_LAG_CHECK_INTERVAL=0)
+        replicas.init_app(app)
+        db.session.remove()
+
+        yield app
+
+        db.session.remove()
+        db.get_engine(app, bind='replica_0').dispose()
+        app.config.update(SQLALCHEMY_REPLICAS=None)
+        replicas.init_app(app)
+
+
+@pytest.fixture(scope='function')
+def primary_user(replica_app):
+    """A user committed on the primary behind the back of db.session."""
+    with db.engine.begin() as conn:
+        conn.execute(User.__table__.insert(), dict(
+            first_name='Replica', last_name='User', email=EMAIL, phone='442083661177',
+            password='x', salt='x', group_id=2, active=True))
+    db.session.remove()
+
+    yield
+
+    db.session.remove()
+    with db.engine.begin() as conn:
+        conn.execute(User.__table__.delete().where(User.email == EMAIL))
+
+
+def test_read_only_block_goes_to_replica(primary_user):
+    """
+    GIVEN an application with one replica that lacks the new user
+    WHEN the user is looked up inside and outside read_replica()
+    THEN check only the lookup outside of it finds the user
+    """
+    with read_replica():
+        assert User.query.filter_by(email=EMAIL).first() is None
+    assert User.query.filter_by(email=EMAIL).first() is not None
+
+
+def test_reads_stick_to_primary_after_write(primary_user):
+    """
+    GIVEN an application with one replica
+    WHEN the session commits a write and then reads inside read_replica()
+    THEN check the read goes to the primary and sees the write
+    """
+    user = User.query.filter_by(email=EMAIL).first()
+    user.first_name = 'Changed'
+    db.session.commit()
+
+    sticky_reads = replicas.sticky_reads
+    with read_replica():
+        assert User.query.filter_by(email=EMAIL).first().first_name == 'Changed'
+    assert replicas.sticky_reads == sticky_reads + 1
+
+
+def test_lagging_replica_falls_back_to_primary(primary_user):
+    """
+    GIVEN an application whose only replica lags more than REPLICA_MAX_LAG
+    WHEN the user is looked up inside read_replica()
+    THEN check the lookup goes to the primary
+    """
+    max_lag, replicas.max_lag = replicas.max_lag, -1
+    try:
+        lagging_reads = replicas.lagging_reads
+        with read_replica():
+            assert User.query.filter_by(email=EMAIL).first() is not None
+        assert replicas.lagging_reads == lagging_reads + 1
+    finally:
+        replicas.max_lag = max_lag
+
+
+def test_write_in_request_sticks_to_the_flask_session(primary_user, replica_app):
+    """
+    GIVEN an application with one replica
+    WHEN a request commits a write
+    THEN check the end of the request keeps the sticky deadline in the Flask session
+    """
+    with replica_app.test_request_context('/'):
+        user = User.query.filter_by(email=EMAIL).first()
+        user.first_name = 'Changed'
+        db.session.commit()
+        assert STICKY_KEY not in session
+
+        replica_app.process_response(replica_app.response_class())
+        assert session[STICKY_KEY] > time.time()
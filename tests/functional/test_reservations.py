@@ -0,0 +1,216 @@
+"""
+This file (test_reservations.py) contains the functional tests for concurrent shelf booking.
+
+The bookings run in threads with their own sessions and commit for real, so
+the fixture data is committed too (and deleted afterwards) instead of living
+in the rolled back transaction of init_database.
+"""
+import threading
+import time
+from datetime import date, datetime
+
+import pytest
+
+from project import db, reservations
+from project.availability import availability
+from project.models import Size, StorageOrder, User, Warehouse
+from project.reservations import ShelfUnavailable, reserve_shelf
+
+THREADS = 4
+SIZE_ID = 901
+SHELF_ID = 901
+START, STOP = date(2022, 11, 1), date(2022, 11, 14)
+# two shelves of another size for the bookings through the unpatched path,
+# the first one booked for October
+PAIR_SIZE_ID = 902
+FIRST_SHELF_ID, SECOND_SHELF_ID = 902, 903
+
+
+@pytest.fixture(scope='function')
+def one_shelf(test_client):
+    with db.engine.begin() as conn:
+        conn.execute(Size.__table__.insert(), dict(size_id=SIZE_ID, size_name=15))
+        conn.execute(Warehouse.__table__.insert(), dict(shelf_id=SHELF_ID, size_id=SIZE_ID, active=True))
+        user_id = conn.execute(User.__table__.select().where(User.email == 'email1@gmail.com')).first().user_id
+
+    yield test_client.application, user_id
+
+    db.session.remove()
+    with db.engine.begin() as conn:
+        conn.execute(StorageOrder.__table__.delete().where(StorageOrder.shelf_id == SHELF_ID))
+        conn.execute(Warehouse.__table__.delete().where(Warehouse.shelf_id == SHELF_ID))
+        conn.execute(Size.__table__.delete().where(Size.size_id == SIZE_ID))
+    availability.load()
+
+
+@pytest.fixture(scope='function')
+def two_shelves(test_client):
+    with db.engine.begin() as conn:
+        conn.execute(Size.__table__.insert(), dict(size_id=PAIR_SIZE_ID, size_name=16))
+        conn.execute(Warehouse.__table__.insert(), [dict(shelf_id=shelf_id, size_id=PAIR_SIZE_ID, active=True)
+                                                    for shelf_id in (FIRST_SHELF_ID, SECOND_SHELF_ID)])
+        user_id = conn.execute(User.__table__.select().where(User.email == 'email1@gmail.com')).first().user_id
+        october_id = conn.execute(StorageOrder.__table__.insert().returning(StorageOrder.storage_order_id), dict(
+            start_date=date(2022, 10, 1), stop_date=date(2022, 10, 31), storage_order_cost=100,
+            created=datetime.now(), user_id=user_id, shelf_id=FIRST_SHELF_ID)).scalar()
+    availability.load()
+
+    yield test_client.application, user_id, october_id
+
+    db.session.remove()
+    with db.engine.begin() as conn:
+        conn.execute(StorageOrder.__table__.delete()
+                     .where(StorageOrder.shelf_id.in_([FIRST_SHELF_ID, SECOND_SHELF_ID])))
+        conn.execute(Warehouse.__table__.delete().where(Warehouse.size_id == PAIR_SIZE_ID))
+        conn.execute(Size.__table__.delete().where(Size.size_id == PAIR_SIZE_ID))
+    availability.load()
+
+
+def book_in_thread(app, user_id, booked, failed):
+    def book():
+        with app.app_context():
+            try:
+                booked.append(reserve_shelf(user_id, PAIR_SIZE_ID, START, STOP, cost=100).shelf_id)
+            except Exception as e:
+                failed.append(e)
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=book)
+    thread.start()
+    return thread
+
+
+def test_booking_skips_a_shelf_locked_by_another_booking(two_shelves):
+    """
+    GIVEN two free shelves, one of them locked by a booking that hasn't committed yet
+    WHEN another booking of the same dates runs in its own session
+    THEN check it books the other shelf without waiting for the lock, and both bookings commit
+    """
+    app, user_id, _ = two_shelves
+    locked, release = threading.Event(), threading.Event()
+    first, failed = [], []
+
+    def hold_a_shelf():
+        with app.app_context():
+            try:
+                shelf_id = reservations._lock_free_shelf(PAIR_SIZE_ID, START, STOP)
+                first.append(shelf_id)
+                locked.set()
+                release.wait(timeout=10)
+                db.session.add(StorageOrder(start_date=START, stop_date=STOP, storage_order_cost=100,
+                                            created=datetime.now(), user_id=user_id, shelf_id=shelf_id))
+                db.session.commit()
+            except Exception as e:
+                failed.append(e)
+            finally:
+                locked.set()
+                db.session.remove()
+
+    holder = threading.Thread(target=hold_a_shelf)
+    holder.start()
+    try:
+        assert locked.wait(timeout=10)
+        booked = []
+        booking = book_in_thread(app, user_id, booked, failed)
+        booking.join(timeout=10)
+        assert not booking.is_alive(), 'the booking waited for the locked shelf'
+    finally:
+        release.set()
+        holder.join()
+
+    assert not failed
+    assert first and booked and {first[0], booked[0]} == {FIRST_SHELF_ID, SECOND_SHELF_ID}
+    assert StorageOrder.query.filter(StorageOrder.start_date == START,
+                                     StorageOrder.shelf_id.in_([FIRST_SHELF_ID, SECOND_SHELF_ID])).count() == 2
+
+
+def test_booking_retries_after_a_conflicting_extension(two_shelves):
+    """
+    GIVEN two free shelves, the first one with an October order being extended into November
+        by a transaction that hasn't committed yet
+    WHEN a November booking runs in its own session, and the extension commits while it waits
+    THEN check its insert on the first shelf is rejected by the exclusion constraint,
+        and the retry books the second shelf
+    """
+    app, user_id, october_id = two_shelves
+    # the tightest gap: right after the October order
+    assert reservations.candidate_shelves(PAIR_SIZE_ID, START, STOP, limit=2) == [FIRST_SHELF_ID, SECOND_SHELF_ID]
+
+    # changing dates takes no lock on the shelf row: the booking still locks the first shelf and inserts,
+    # then waits on the uncommitted extension until the constraint can decide
+    with db.engine.connect() as conn:
+        extension = conn.begin()
+        conn.execute(StorageOrder.__table__.update().where(StorageOrder.storage_order_id == october_id)
+                     .values(stop_date=date(2022, 11, 5)))
+        booked, failed = [], []
+        booking = book_in_thread(app, user_id, booked, failed)
+        try:
+            time.sleep(0.5)
+            assert booking.is_alive(), 'the booking did not wait for the extension'
+        finally:
+            extension.commit()
+            booking.join(timeout=10)
+
+    assert not failed
+    assert booked == [SECOND_SHELF_ID]
+    assert StorageOrder.query.filter_by(shelf_id=FIRST_SHELF_ID).count() == 1
+
+
+def test_concurrent_bookings_of_one_shelf(one_shelf, monkeypatch):
+    """
+    GIVEN one free shelf and bookings that all find it free before any of them commits
+    WHEN the bookings of the same dates run at once in several threads
+    THEN check exactly one succeeds and the others are rejected by the exclusion constraint
+    """
+    app, user_id = one_shelf
+    barrier = threading.Barrier(THREADS)
+    first_try = threading.local()
+    checks = []
+
+    def racing_lock_free_shelf(size_id, start_date, stop_date, candidates=None):
+        # no lock and no check: the constraint alone has to catch the double bookings
+        checks.append(threading.get_ident())
+        if not getattr(first_try, 'done', False):
+            first_try.done = True
+            barrier.wait(timeout=10)
+        return SHELF_ID
+
+    monkeypatch.setattr(reservations, '_lock_free_shelf', racing_lock_free_shelf)
+
+    booked, rejected, failed = [], [], []
+
+    def book():
+        with app.app_context():
+            try:
+                booked.append(reserve_shelf(user_id, SIZE_ID, START, STOP, cost=100).storage_order_id)
+            except ShelfUnavailable:
+                rejected.append(threading.get_ident())
+            except Exception as e:
+                failed.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=book) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not failed
+    assert len(booked) == 1
+    assert len(rejected) == THREADS - 1
+    # the losers went through every attempt, each ending in an IntegrityError
+    assert len(checks) == 1 + (THREADS - 1) * app.config.get('RESERVATION_ATTEMPTS', 3)
+    assert StorageOrder.query.filter_by(shelf_id=SHELF_ID).count() == 1
+
+
+def test_booking_without_cost_or_tariffs(init_database):
+    """
+    GIVEN an application without PRICING_TARIFFS
+    WHEN a shelf is booked without a cost
+    THEN check the booking is refused before anything is written
+    """
+    with pytest.raises(ValueError, match='PRICING_TARIFFS'):
+        reserve_shelf(1, SIZE_ID, START, STOP)
+    assert StorageOrder.query.count() == 0
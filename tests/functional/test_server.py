@@ -0,0 +1,120 @@
+"""
+This file (test_server.py) contains the functional tests for the reload of the pre-forking server.
+
+The server runs in a subprocess on its own config, serving /index without a
+database.
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='reads the workers from /proc')
+
+WORKERS = 2
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def workers_of(pid: int) -> set:
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return {int(child) for child in f.read().split()}
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+@pytest.fixture
+def server(tmp_path):
+    port = free_port()
+    cfg_path = tmp_path / 'server.cfg'
+    cfg_path.write_text(
+        "SECRET_KEY = 'test'\n"
+        "SQLALCHEMY_DATABASE_URI = 'postgresql://localhost:1/unused'\n"
+        "SQLALCHEMY_TRACK_MODIFICATIONS = False\n"
+        "MAIL_OUTBOX_WORKER = False\n"
+        "EXPIRY_SWEEPER_WORKER = False\n"
+        "SERVER_DB_MAX_CONNECTIONS = 100\n"
+        f"SERVER_WORKERS = {WORKERS}\n"
+        "SERVER_THREADS = 2\n"
+        "SERVER_GRACEFUL_TIMEOUT = 30\n"
+        f"LOG_FILE = {str(tmp_path / 'server.log')!r}\n"
+        "LOG_FLUSH_INTERVAL = 0\n"
+        "TEMPLATE_BYTECODE_CACHE = None\n")
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable, '-m', 'project.server', '--config', str(cfg_path),
+                                '--bind', f'127.0.0.1:{port}'],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        assert wait_for(lambda: len(workers_of(process.pid)) == WORKERS and get(port) == 200, 30)
+        yield process, port, tmp_path
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def get(port) -> int:
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/index', timeout=5) as response:
+            return response.status
+    except OSError:
+        return 0
+
+
+def test_reload_while_workers_log(server):
+    """
+    GIVEN a server whose workers write an access record for every request
+    WHEN the master is reloaded while requests keep coming
+    THEN check every request is answered, and the previous workers log until they are replaced
+    """
+    process, port, log_dir = server
+    previous = workers_of(process.pid)
+    statuses = []
+    stop = threading.Event()
+
+    def requests():
+        while not stop.is_set():
+            statuses.append(get(port))
+
+    clients = [threading.Thread(target=requests) for _ in range(4)]
+    for client in clients:
+        client.start()
+    try:
+        time.sleep(0.5)
+        process.send_signal(signal.SIGHUP)
+        replaced = wait_for(lambda: not workers_of(process.pid) & previous
+                            and len(workers_of(process.pid)) == WORKERS, 20)
+    finally:
+        stop.set()
+        for client in clients:
+            client.join()
+
+    assert replaced, 'the previous workers are still running'
+    assert statuses and set(statuses) == {200}
+    assert process.poll() is None
+    # one file per worker slot, freed slots are taken again: one more slot for the batch of the reload
+    assert sorted(path.name for path in log_dir.glob('server-*.log')) == ['server-0.log', 'server-1.log',
+                                                                          'server-2.log']
+    for path in log_dir.glob('server-*.log'):
+        assert '"message": "request"' in path.read_text()
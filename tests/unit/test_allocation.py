@@ -0,0 +1,63 @@
+"""
+This file (test_allocation.py) contains the unit tests for applying shelf reassignments of allocation.py.
+"""
+from datetime import date, timedelta
+
+import pytest
+
+from project import db
+from project.allocation import AllocationError, Reassignment, apply_reassignment
+from project.availability import availability
+from project.models import Size, StorageOrder, User, Warehouse
+
+SIZE_ID = 902
+START = date.today() + timedelta(days=10)
+STOP = START + timedelta(days=6)
+
+
+@pytest.fixture(scope='function')
+def two_shelves(init_database):
+    """Shelves 1 and 2 of a size, an order on shelf 1 and the ids of the order."""
+    db.session.add(Size(size_id=SIZE_ID, size_name=15))
+    db.session.add_all([Warehouse(shelf_id=shelf_id, size_id=SIZE_ID, active=True) for shelf_id in (9021, 9022)])
+    user_id = User.by_email('email1@gmail.com').user_id
+    order = StorageOrder(start_date=START, stop_date=STOP, storage_order_cost=100, user_id=user_id, shelf_id=9021)
+    db.session.add(order)
+    db.session.commit()
+    availability.load()
+
+    yield order.storage_order_id, user_id
+
+    db.session.rollback()
+    availability.load()
+
+
+def test_moved_order_reaches_the_index(two_shelves, monkeypatch):
+    """
+    GIVEN an order on shelf 1 and the availability index
+    WHEN a plan moving it to shelf 2 is applied
+    THEN check the index sees shelf 1 free and shelf 2 booked without being rebuilt
+    """
+    order_id, _ = two_shelves
+    monkeypatch.setattr(availability, 'load', lambda: pytest.fail('the index was rebuilt'))
+
+    assert apply_reassignment(Reassignment(SIZE_ID, {order_id: (9021, 9022)}, [], 1)) == 1
+    assert availability.is_free(9021, START, STOP)
+    assert not availability.is_free(9022, START, STOP)
+
+
+def test_conflicting_booking_rejects_the_plan(two_shelves):
+    """
+    GIVEN an order on shelf 1 and a booking of the same dates on shelf 2 made after the plan
+    WHEN the plan moving the order to shelf 2 is applied
+    THEN check AllocationError is raised and the order stays on shelf 1
+    """
+    order_id, user_id = two_shelves
+    db.session.add(StorageOrder(start_date=START, stop_date=STOP, storage_order_cost=100, user_id=user_id,
+                                shelf_id=9022))
+    db.session.commit()
+
+    with pytest.raises(AllocationError, match='conflicts'):
+        apply_reassignment(Reassignment(SIZE_ID, {order_id: (9021, 9022)}, [], 1))
+    assert db.session.get(StorageOrder, order_id).shelf_id == 9021
+    assert not availability.is_free(9021, START, STOP)
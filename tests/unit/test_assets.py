@@ -0,0 +1,145 @@
+"""
+This file (test_assets.py) contains the unit tests for the fingerprinted static assets of assets.py.
+"""
+import gzip
+import json
+import sys
+
+import pytest
+from flask import Flask, url_for
+
+from project.assets import ONE_YEAR, Assets, build_assets
+
+STYLES = b'body { color: #123456; }\n' * 50
+
+
+def has_webp():
+    try:
+        from PIL import features
+    except ImportError:
+        return False
+    return features.check('webp')
+
+
+@pytest.fixture
+def static_folder(tmp_path):
+    folder = tmp_path / 'static'
+    (folder / 'css').mkdir(parents=True)
+    (folder / 'css' / 'styles.css').write_bytes(STYLES)
+    return folder
+
+
+@pytest.fixture
+def built_app(static_folder):
+    """A bare app serving the assets built from static_folder."""
+    build_assets(str(static_folder))
+    app = Flask(__name__, static_folder=str(static_folder))
+    Assets(app)
+    return app
+
+
+def test_build_assets_fingerprints_and_precompresses(static_folder):
+    """
+    GIVEN a static folder with a stylesheet
+    WHEN the assets are built
+    THEN check the manifest maps it to a content-hashed copy with gzip and brotli copies of the same bytes
+    """
+    import brotli
+
+    manifest = build_assets(str(static_folder))
+    entry = manifest['css/styles.css']
+    assert entry['file'].startswith('dist/css/styles.') and entry['file'].endswith('.css')
+    assert entry['bytes'] == len(STYLES)
+    assert entry['encodings'] == ['br', 'gzip']
+
+    built = static_folder / entry['file']
+    assert built.read_bytes() == STYLES
+    assert gzip.decompress((static_folder / f"{entry['file']}.gz").read_bytes()) == STYLES
+    assert brotli.decompress((static_folder / f"{entry['file']}.br").read_bytes()) == STYLES
+    assert json.loads((static_folder / 'dist' / 'manifest.json').read_text()) == manifest
+
+    # another content, another name
+    (static_folder / 'css' / 'styles.css').write_bytes(STYLES + b'a { }\n')
+    assert build_assets(str(static_folder))['css/styles.css']['file'] != entry['file']
+    assert not built.exists()
+
+
+@pytest.mark.skipif(not has_webp(), reason='Pillow without WebP support')
+def test_build_assets_writes_webp_variants(static_folder):
+    """
+    GIVEN a static folder with a 1000px wide PNG
+    WHEN the assets are built with variants at 480 and 1600px
+    THEN check there are WebP variants at 480px and at the width of the image, not above it
+    """
+    from PIL import Image
+
+    (static_folder / 'img').mkdir()
+    Image.new('RGB', (1000, 500), 'red').save(static_folder / 'img' / 'photo.png')
+
+    manifest = build_assets(str(static_folder), widths=(480, 1600))
+    variants = manifest['img/photo.png']['webp']
+    assert sorted(variants, key=int) == ['480', '1000']
+    with Image.open(static_folder / variants['480']) as image:
+        assert image.format == 'WEBP' and image.size == (480, 240)
+
+
+def test_build_assets_fails_without_brotli(static_folder, monkeypatch):
+    """
+    GIVEN a built static folder, and then no brotli package
+    WHEN the assets are built again
+    THEN check the build fails and leaves the previous build as it was
+    """
+    manifest = build_assets(str(static_folder))
+    monkeypatch.setitem(sys.modules, 'brotli', None)
+
+    with pytest.raises(RuntimeError, match='brotli'):
+        build_assets(str(static_folder))
+    assert (static_folder / manifest['css/styles.css']['file']).exists()
+
+
+def test_build_assets_fails_without_webp_support(static_folder, monkeypatch):
+    """
+    GIVEN a static folder with an image, and a Pillow without WebP support
+    WHEN the assets are built
+    THEN check the build fails instead of leaving the WebP variants out
+    """
+    features = pytest.importorskip('PIL.features')
+    (static_folder / 'img').mkdir()
+    (static_folder / 'img' / 'photo.jpg').write_bytes(b'not read')
+    monkeypatch.setattr(features, 'check', lambda feature: False)
+
+    with pytest.raises(RuntimeError, match='WebP'):
+        build_assets(str(static_folder))
+    assert not (static_folder / 'dist').exists()
+
+
+def test_url_for_builds_the_fingerprinted_url(built_app):
+    """
+    GIVEN an app with a manifest
+    WHEN the URL of a static file is built
+    THEN check the URL of a listed file is the fingerprinted one and the others are unchanged
+    """
+    with built_app.test_request_context('/'):
+        assert url_for('static', filename='css/styles.css') == \
+            f"/static/{built_app.extensions['assets'].manifest['css/styles.css']['file']}"
+        assert url_for('static', filename='css/other.css') == '/static/css/other.css'
+
+
+@pytest.mark.parametrize('accept, encoding', [('br, gzip', 'br'), ('gzip', 'gzip'), ('', None)])
+def test_serve_precompressed_with_immutable_cache(built_app, accept, encoding):
+    """
+    GIVEN an app serving built assets
+    WHEN a fingerprinted file is requested with an Accept-Encoding (GET)
+    THEN check the best accepted copy is sent with a one-year public immutable Cache-Control
+    """
+    url = f"/static/{built_app.extensions['assets'].manifest['css/styles.css']['file']}"
+    response = built_app.test_client().get(url, headers={'Accept-Encoding': accept})
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding') == encoding
+    assert response.mimetype == 'text/css'
+    assert response.cache_control.max_age == ONE_YEAR
+    assert response.cache_control.public and response.cache_control.immutable
+    assert 'Accept-Encoding' in response.headers['Vary']
+    if encoding is None:
+        assert response.data == STYLES
+
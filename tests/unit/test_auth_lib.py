@@ -0,0 +1,87 @@
+"""
+This file (test_auth_lib.py) contains the unit tests for the phone number helpers of auth/auth_lib.py.
+"""
+import pytest
+
+from project.auth.auth_lib import normalize_phone, normalize_phones, warm_up_phone_metadata
+
+
+@pytest.fixture(autouse=True)
+def empty_phone_cache():
+    normalize_phone.cache_clear()
+    yield
+    normalize_phone.cache_clear()
+
+
+@pytest.mark.parametrize('phone, normalized', [
+    ('442083661177', '+442083661177'),  # without the '+'
+    ('+442083661177', '+442083661177'),
+    ('+44 20 8366 1177', '+442083661177'),  # spaced as it is written
+    ('16502530000', '+16502530000'),
+    ('79161234567', '+79161234567'),
+])
+def test_normalize_valid_phone(phone, normalized):
+    """
+    GIVEN a valid phone number, with or without '+' and spaces
+    WHEN it is normalized
+    THEN check the E.164 form is returned
+    """
+    assert normalize_phone(phone) == normalized
+
+
+@pytest.mark.parametrize('phone', [
+    '',  # blank
+    'abc',  # not a number
+    '12345',  # too short for any country
+    '440000000000',  # a country code but not a number of that country
+    '1234567890123',  # too long for its country
+])
+def test_normalize_invalid_phone(phone):
+    """
+    GIVEN a blank, malformed or invalid phone number
+    WHEN it is normalized
+    THEN check None is returned instead of an exception
+    """
+    assert normalize_phone(phone) is None
+
+
+def test_normalize_phone_cache_hit():
+    """
+    GIVEN a phone number normalized once
+    WHEN it is normalized again
+    THEN check the same value comes from the cache without parsing again
+    """
+    first = normalize_phone('442083661177')
+    assert normalize_phone('442083661177') is first
+    info = normalize_phone.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+    assert normalize_phone('12345') is None
+    assert normalize_phone('12345') is None
+    assert normalize_phone.cache_info().hits == 2
+
+
+def test_normalize_phones_batch():
+    """
+    GIVEN a batch of phone numbers with a repeated one, padded ones and an invalid one
+    WHEN the batch is normalized
+    THEN check every given number maps to its E.164 form or None, and the repeated one is parsed once
+    """
+    phones = ['442083661177', ' 442083661177 ', '79161234567', '442083661177', '12345']
+    assert normalize_phones(phones) == {
+        '442083661177': '+442083661177',
+        ' 442083661177 ': '+442083661177',
+        '79161234567': '+79161234567',
+        '12345': None,
+    }
+    assert normalize_phone.cache_info().misses == 3
+
+
+def test_warm_up_phone_metadata():
+    """
+    GIVEN the phone metadata of two regions
+    WHEN it is loaded ahead of the first number
+    THEN check the number of regions is returned and numbers of these regions still normalize
+    """
+    assert warm_up_phone_metadata(['GB', 'US']) == 2
+    assert normalize_phone('16502530000') == '+16502530000'
@@ -0,0 +1,105 @@
+"""
+This file (test_availability.py) contains the unit tests for the shelf availability index of availability.py.
+"""
+import random
+from datetime import date, timedelta
+from time import monotonic
+
+from project.availability import FirstFitTree, ShelfAvailability, ShelfSpans, SizeGaps
+
+SEASON_START = date(2022, 6, 1)
+SIZES = (1, 2)
+
+
+def empty_index(shelves):
+    """An index of `shelves` shelves with nothing booked, as load() would build it from an empty table."""
+    index = ShelfAvailability()
+    index._spans = {shelf_id: ShelfSpans() for shelf_id in range(1, shelves + 1)}
+    index._size_of = {shelf_id: SIZES[shelf_id % len(SIZES)] for shelf_id in index._spans}
+    index._gaps = {size_id: SizeGaps() for size_id in SIZES}
+    for shelf_id, size_id in index._size_of.items():
+        index._gaps[size_id].add(shelf_id, None, None)
+    index._first_fit = {size_id: FirstFitTree([(shelf_id, shelf) for shelf_id, shelf in index._spans.items()
+                                               if index._size_of[shelf_id] == size_id])
+                        for size_id in SIZES}
+    index.max_age = None
+    index.loaded, index.loaded_at = True, monotonic()
+    return index
+
+
+def scan(index, size_id, start, stop, limit):
+    """First-fit and best-fit answers from a scan over every shelf of the size."""
+    shelves = [shelf_id for shelf_id, size in sorted(index._size_of.items()) if size == size_id]
+    free = [shelf_id for shelf_id in shelves if index._spans[shelf_id].is_free(start, stop)]
+    ranked = sorted((index._spans[shelf_id].slack(start, stop), shelf_id) for shelf_id in free)
+    return free[:limit], [shelf_id for _, shelf_id in ranked[:limit]]
+
+
+def test_gap_index_agrees_with_a_scan_of_every_shelf():
+    """
+    GIVEN an availability index following random bookings and cancellations
+    WHEN free shelves are asked for random windows
+    THEN check first-fit and best-fit answer what a scan of every shelf answers
+    """
+    random.seed(7)
+    index = empty_index(30)
+    booked = {}
+    for order_id in range(1500):
+        if booked and random.random() < 0.3:
+            cancelled = random.choice(list(booked))
+            index.remove_order(cancelled, *booked.pop(cancelled))
+            continue
+        start = SEASON_START + timedelta(days=random.randint(0, 200))
+        stop = start + timedelta(days=random.randint(0, 20))
+        size_id = random.choice(SIZES)
+        limit = random.randint(1, 5)
+        first_fit, best_fit = scan(index, size_id, start, stop, limit)
+        assert index.free_shelves(size_id, start, stop, limit=limit) == first_fit
+        assert index.best_fit_shelves(size_id, start, stop, limit=limit) == best_fit
+        if best_fit:
+            shelf_id = random.choice((first_fit[0], best_fit[0]))
+            index.add_order(order_id, shelf_id, start, stop)
+            booked[order_id] = (shelf_id, start, stop)
+    assert len(booked) > 100
+
+    # what the updates left is what a load would build
+    for size_id, gaps in index._gaps.items():
+        rebuilt = SizeGaps()
+        for shelf_id, shelf in index._spans.items():
+            if index._size_of[shelf_id] == size_id:
+                for i in range(len(shelf) + 1):
+                    rebuilt.append(shelf_id, *shelf.gap(i))
+        rebuilt.sort()
+        assert (gaps.closed, gaps.heads, gaps.tails, gaps.empty) == \
+            (rebuilt.closed, rebuilt.heads, rebuilt.tails, rebuilt.empty)
+
+
+def test_first_fit_checks_the_same_shelves_whatever_the_number_of_shelves_before(monkeypatch):
+    """
+    GIVEN indexes of 1000 and 20000 shelves where all but the last 3 shelves of a size have a gap one day too
+        short around the window, or no gap at all
+    WHEN the first 2 free shelves are asked for the window
+    THEN check both find the last shelves after checking only those 2 shelves
+    """
+    checked = []
+    is_free = ShelfSpans.is_free
+
+    def counting_is_free(shelf, start_date, stop_date):
+        checked.append(shelf)
+        return is_free(shelf, start_date, stop_date)
+
+    monkeypatch.setattr(ShelfSpans, 'is_free', counting_is_free)
+    start, stop = SEASON_START + timedelta(days=30), SEASON_START + timedelta(days=36)
+    for shelves in (1000, 20000):
+        index = empty_index(shelves)
+        busy = [shelf_id for shelf_id, size_id in index._size_of.items() if size_id == SIZES[0]][:-3]
+        for order_id, shelf_id in enumerate(busy):
+            if shelf_id % 3:
+                index.add_order(2 * order_id, shelf_id, SEASON_START, start - timedelta(days=1))
+                index.add_order(2 * order_id + 1, shelf_id, stop, stop + timedelta(days=10))
+            else:
+                index.add_order(2 * order_id, shelf_id, SEASON_START, stop + timedelta(days=10))
+
+        checked.clear()
+        assert index.free_shelves(SIZES[0], start, stop, limit=2) == [busy[-1] + 2, busy[-1] + 4]
+        assert len(checked) == 2
@@ -0,0 +1,127 @@
+"""
+This file (test_cache.py) contains the unit tests for the caches and the user cache of cache.py.
+
+The Redis backend runs against an in-memory stand-in for the few redis.Redis
+calls RedisCache makes, so both backends go through the same tests.
+"""
+import fnmatch
+import time
+
+import pytest
+
+from project import db, login_manager
+from project.cache import LocalCache, RedisCache, user_cache
+from project.models import User, UsersGroup
+from project.sql_stats import count_queries
+
+
+class MemoryRedis:
+    """get / set(px=) / delete / scan_iter of redis.Redis, on a dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        entry = self._live(key)
+        return None if entry is None else entry[1]
+
+    def set(self, key, value, px):
+        self.data[key] = (time.monotonic() + px / 1000, value)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.data) if self._live(key) and fnmatch.fnmatch(key, pattern)]
+
+
+@pytest.fixture(params=['local', 'redis'])
+def store(request):
+    if request.param == 'local':
+        return LocalCache(maxsize=2, ttl=60)
+    return RedisCache('redis://unused', 'test', ttl=60, client=MemoryRedis())
+
+
+@pytest.fixture
+def cached_users(store, monkeypatch):
+    monkeypatch.setattr(user_cache, '_cache', store)
+    return store
+
+
+def test_store_get_set_delete_clear(store):
+    """
+    GIVEN a local or a Redis cache
+    WHEN values are set, read, deleted, expired and cleared
+    THEN check they are read back until then, and the hits and misses are counted
+    """
+    store.set(1, {'name': 'one'})
+    store.set(2, {'name': 'two'}, ttl=0.01)
+    assert store.get(1) == {'name': 'one'}
+    time.sleep(0.02)
+    assert store.get(2) is None
+
+    store.delete(1)
+    assert store.get(1) is None
+    store.set(3, 'three')
+    store.clear()
+    assert store.get(3) is None
+    assert (store.stats()['hits'], store.stats()['misses']) == (1, 3)
+
+
+def test_load_user_hit_skips_the_db(init_database, cached_users):
+    """
+    GIVEN a user loaded once by Flask-Login
+    WHEN the user is loaded again in a new session
+    THEN check the user comes from the cache without any SQL statement
+    """
+    user_id = User.by_email('email1@gmail.com').user_id
+    db.session.expunge_all()
+    assert login_manager._user_callback(str(user_id)).user_id == user_id
+    assert cached_users.get(user_id) is not None
+
+    db.session.expunge_all()
+    with count_queries() as queries:
+        user = login_manager._user_callback(str(user_id))
+    assert queries.count == 0
+    assert user.email == 'email1@gmail.com' and user in db.session
+
+
+@pytest.mark.parametrize('attr, value', [('password', 'changed'), ('active', False), ('group_id', 3)])
+def test_user_change_evicts_the_entry(init_database, cached_users, attr, value):
+    """
+    GIVEN a cached user
+    WHEN its password, `active` or group changes and the change is committed,
+        while another request cached the old row again in between
+    THEN check the entry is gone after the commit
+    """
+    db.session.add(UsersGroup(group_id=3, group_name='staff'))
+    db.session.commit()
+    user = User.by_email('email1@gmail.com')
+    user_cache.put(user)
+
+    setattr(user, attr, value)
+    assert cached_users.get(user.user_id) is None
+    cached_users.set(user.user_id, {'user_id': user.user_id})
+    db.session.commit()
+    assert cached_users.get(user.user_id) is None
+
+
+def test_other_changes_keep_the_entry(init_database, cached_users):
+    """
+    GIVEN a cached user
+    WHEN a column the cache doesn't watch changes and is committed
+    THEN check the entry is kept
+    """
+    user = User.by_email('email1@gmail.com')
+    user_cache.put(user)
+    user.first_name = 'Renamed'
+    db.session.commit()
+    assert cached_users.get(user.user_id) is not None
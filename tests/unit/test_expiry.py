@@ -0,0 +1,81 @@
+"""
+This file (test_expiry.py) contains the unit tests for the chunked sweep of expiry.py.
+"""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from project import db
+from project.expiry import expiry
+from project.models import Size, StorageOrder, User, Warehouse
+
+SIZE_ID = 9400
+# far in the past, so only the orders of these tests have ended before it
+TODAY = date(1990, 6, 1)
+
+
+@pytest.fixture
+def orders(init_database, monkeypatch):
+    """7 orders ended before TODAY and 2 still running, on a shelf each, swept 3 per chunk."""
+    monkeypatch.setattr(expiry, 'chunk', 3)
+    user_id = User.by_email('email1@gmail.com').user_id
+    db.session.add(Size(size_id=SIZE_ID, size_name=19))
+    stop_dates = [TODAY - timedelta(days=days) for days in range(1, 8)] + [TODAY, TODAY + timedelta(days=10)]
+    orders = []
+    for shelf_id, stop_date in enumerate(stop_dates, start=SIZE_ID + 1):
+        db.session.add(Warehouse(shelf_id=shelf_id, size_id=SIZE_ID, active=True))
+        orders.append(StorageOrder(start_date=stop_date - timedelta(days=30), stop_date=stop_date,
+                                   storage_order_cost=100, created=datetime.now(), user_id=user_id,
+                                   shelf_id=shelf_id))
+    db.session.add_all(orders)
+    db.session.commit()
+    return [order.storage_order_id for order in orders[:7]], [order.storage_order_id for order in orders[7:]]
+
+
+def completed(order_ids) -> dict:
+    db.session.expire_all()
+    return {order_id: StorageOrder.query.get(order_id).completed for order_id in order_ids}
+
+
+def test_sweep_completes_expired_orders_chunk_by_chunk(orders, monkeypatch):
+    """
+    GIVEN 7 expired orders, 2 running ones and a chunk of 3
+    WHEN the expired orders are swept
+    THEN check they are completed in 3 chunks, and the running ones are left open
+    """
+    expired, running = orders
+    chunks = []
+    complete_chunk = expiry.complete_chunk
+
+    def counted_chunk(today=None):
+        chunks.append(complete_chunk(today))
+        return chunks[-1]
+
+    monkeypatch.setattr(expiry, 'complete_chunk', counted_chunk)
+
+    assert expiry.sweep(TODAY) == 7
+    assert chunks == [3, 3, 1]
+    assert None not in completed(expired).values()
+    assert set(completed(running).values()) == {None}
+
+
+def test_sweep_resumes_after_an_interrupted_run(orders):
+    """
+    GIVEN 7 expired orders, one chunk of which a run killed halfway has completed
+    WHEN the expired orders are swept again, and once more
+    THEN check the second run completes only the 4 others, oldest stop_date first, and the third finds nothing
+    """
+    expired, running = orders
+    assert expiry.complete_chunk(TODAY) == 3
+    first_chunk = {order_id: at for order_id, at in completed(expired).items() if at is not None}
+    # the oldest stop dates go first: the last 3 orders of the list
+    assert sorted(first_chunk) == sorted(expired[-3:])
+
+    assert expiry.sweep(TODAY) == 4
+    after = completed(expired)
+    assert None not in after.values()
+    assert {order_id: after[order_id] for order_id in first_chunk} == first_chunk
+
+    assert expiry.sweep(TODAY) == 0
+    assert completed(expired) == after
+    assert set(completed(running).values()) == {None}
@@ -0,0 +1,114 @@
+"""
+This file (test_hashing.py) contains the unit tests for the bcrypt worker pool of hashing.py.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask
+
+from project.hashing import HashingBusy, PasswordHasher, cost_of
+
+
+def make_hasher(**config) -> PasswordHasher:
+    app = Flask(__name__)
+    app.config.update({'HASHING_ROUNDS': 4, **config})
+    return PasswordHasher(app)
+
+
+def blocking_job(release: threading.Event):
+    release.wait(5)
+    return 'done', 0.0
+
+
+@pytest.mark.parametrize('kind', ['thread', 'process', 'inline'])
+def test_hash_and_check_in_every_mode(kind):
+    """
+    GIVEN a hasher with a thread, a process or no pool
+    WHEN a password is hashed and checked
+    THEN check the hash has the configured cost and only the right password matches it
+    """
+    hasher = make_hasher(HASHING_EXECUTOR=kind, HASHING_WORKERS=2)
+    try:
+        hashed = hasher.hash_password('Password1!', hasher.gensalt())
+        assert cost_of(hashed) == 4
+        assert hasher.check_password('Password1!', hashed)
+        assert not hasher.check_password('Password2!', hashed)
+        assert hasher.stats()['executor'] == kind
+        assert hasher.stats()['completed'] == 3
+    finally:
+        hasher.shutdown()
+
+
+def test_full_backlog_raises_hashing_busy():
+    """
+    GIVEN a hasher with one worker and a backlog of one job
+    WHEN a third job comes while the first runs and the second waits
+    THEN check it gets HashingBusy after the timeout, and jobs are accepted again once the others finish
+    """
+    hasher = make_hasher(HASHING_EXECUTOR='thread', HASHING_WORKERS=1, HASHING_QUEUE_SIZE=1,
+                         HASHING_TIMEOUT=0.05)
+    release = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=2) as callers:
+            jobs = [callers.submit(hasher._run, blocking_job, release) for _ in range(2)]
+            deadline = time.monotonic() + 5
+            while hasher.stats()['in_flight'] < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert hasher.stats()['queue_depth'] == 1
+
+            with pytest.raises(HashingBusy):
+                hasher._run(blocking_job, release)
+            assert hasher.stats()['rejected'] == 1
+
+            release.set()
+            assert [job.result(timeout=5) for job in jobs] == ['done', 'done']
+        assert hasher._run(blocking_job, release) == 'done'
+        assert hasher.stats()['in_flight'] == 0 and hasher.stats()['completed'] == 3
+    finally:
+        release.set()
+        hasher.shutdown()
+
+
+def test_inline_hasher_has_no_backlog_limit():
+    """
+    GIVEN a hasher running inline
+    WHEN more jobs than any backlog run at once
+    THEN check none of them is rejected
+    """
+    hasher = make_hasher(HASHING_EXECUTOR='inline', HASHING_WORKERS=1, HASHING_QUEUE_SIZE=0,
+                         HASHING_TIMEOUT=0)
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=4) as callers:
+        jobs = [callers.submit(hasher._run, blocking_job, release) for _ in range(4)]
+        release.set()
+        assert [job.result(timeout=5) for job in jobs] == ['done'] * 4
+    assert hasher.stats()['rejected'] == 0
+
+
+@pytest.mark.parametrize('config', [{'HASHING_EXECUTOR': 'greenlet'}, {'HASHING_ROUNDS': 3},
+                                    {'HASHING_ROUNDS': 32}])
+def test_invalid_config_is_rejected(config):
+    """
+    GIVEN an unknown executor or a cost out of the bcrypt range
+    WHEN the hasher is configured
+    THEN check it raises ValueError
+    """
+    with pytest.raises(ValueError):
+        make_hasher(**config)
+
+
+def test_needs_rehash_compares_the_cost():
+    """
+    GIVEN hashes of cost 4 and 5, and a hasher configured for cost 5
+    WHEN they are checked for a rehash, with and without HASHING_REHASH
+    THEN check only the cost 4 hash needs one, and none when rehashing is off
+    """
+    old, current = make_hasher(HASHING_EXECUTOR='inline'), make_hasher(HASHING_EXECUTOR='inline', HASHING_ROUNDS=5)
+    old_hash = old.hash_password('Password1!', old.gensalt())
+    current_hash = current.hash_password('Password1!', current.gensalt())
+    assert current.needs_rehash(old_hash) and not current.needs_rehash(current_hash)
+    assert not make_hasher(HASHING_EXECUTOR='inline', HASHING_ROUNDS=5, HASHING_REHASH=False).needs_rehash(old_hash)
+    with pytest.raises(ValueError):
+        cost_of('plain text')
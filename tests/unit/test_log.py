@@ -0,0 +1,68 @@
+"""
+This file (test_log.py) contains the unit tests for the file sink of log.py.
+"""
+import json
+
+from loguru import logger
+
+from project import log
+
+
+def test_warning_flushes_the_buffered_file(tmp_path, flask_app):
+    """
+    GIVEN a buffered file sink
+    WHEN an INFO record and then a WARNING record are logged
+    THEN check the INFO record stays in the buffer and the WARNING writes both out
+    """
+    path = tmp_path / 'test.log'
+    config = dict(LOG_FILE=str(path), LOG_ENQUEUE=False, LOG_FLUSH_INTERVAL=3600, LOG_COMPRESSION=None)
+    try:
+        log.configure_sink(config)
+        logger.info('buffered')
+        assert 'buffered' not in path.read_text()
+
+        logger.warning('flushed')
+        content = path.read_text()
+        assert 'buffered' in content and 'flushed' in content
+    finally:
+        log.configure_sink(flask_app.config)
+
+
+def test_sink_kept_when_configured_again(flask_app):
+    """
+    GIVEN the file sink of the application
+    WHEN it is configured again with the same settings, as by another create_app()
+    THEN check the same sink is kept
+    """
+    handler_id = log._handler_id
+    log.configure_sink(flask_app.config)
+    assert log._handler_id == handler_id
+
+
+def test_exception_record_keeps_the_traceback(tmp_path, flask_app):
+    """
+    GIVEN the JSON file sink
+    WHEN an exception is logged with logger.exception
+    THEN check the record holds the exception and its formatted traceback
+    """
+    path = tmp_path / 'test.log'
+    config = dict(LOG_FILE=str(path), LOG_ENQUEUE=False, LOG_FLUSH_INTERVAL=3600, LOG_COMPRESSION=None)
+    try:
+        log.configure_sink(config)
+
+        def failing():
+            raise ValueError('no such shelf')
+
+        try:
+            failing()
+        except ValueError:
+            logger.exception('booking failed')
+        record = json.loads(path.read_text().splitlines()[-1])
+    finally:
+        log.configure_sink(flask_app.config)
+
+    assert record['message'] == 'booking failed'
+    assert record['exception'] == "ValueError('no such shelf')"
+    assert record['traceback'].startswith('Traceback (most recent call last):')
+    assert 'in failing' in record['traceback']
+    assert record['traceback'].rstrip().endswith('ValueError: no such shelf')
@@ -2,7 +2,9 @@
 This file (test_models.py) contains the unit tests for the models.py file.
 """
 from loguru import logger
+from sqlalchemy import text
 
+from project import db
 from project.models import User
 from tests.conftest import NewTestUser
 
@@ -30,6 +32,21 @@ def test_setting_password():
     """
     user.set_password('MyNewPassword')
     assert user.password != 'MyNewPassword'
+    assert user.salt == user.password[:29]
     assert user.check_password('MyNewPassword')
     assert not user.check_password('MyNewPassword2')
     assert not user.check_password('Password1!')
+
+
+def test_email_lookup_uses_normalized_index(init_database):
+    """
+    GIVEN the users table with its lower(trim(email)) index
+    WHEN the query of User.by_email is explained
+    THEN check the plan looks the email up in the index
+    """
+    # a handful of rows would be scanned anyway, ask for the plan the index allows
+    db.session.execute(text('SET LOCAL enable_seqscan = off'))
+    query = User.query.filter(User.email_normalized == User.normalize_email(' Email1@Gmail.COM '))
+    compiled = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    plan = '\n'.join(db.session.execute(text(f'EXPLAIN {compiled}')).scalars())
+    assert 'ix_users_email_normalized' in plan
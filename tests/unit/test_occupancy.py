@@ -0,0 +1,48 @@
+"""
+This file (test_occupancy.py) contains the unit tests for the shared occupancy grid of occupancy.py.
+"""
+from datetime import date
+
+from project.occupancy import OccupancyMap
+
+
+def worker(path):
+    occupancy = OccupancyMap()
+    occupancy.days = 30
+    occupancy.path = str(path)
+    return occupancy
+
+
+def test_worker_maps_the_grid_rebuilt_by_another(init_database, tmp_path):
+    """
+    GIVEN two processes sharing OCCUPANCY_FILE, the second one mapping the grid the first built
+    WHEN the first one rebuilds the grid
+    THEN check the second one maps the new grid on its next read
+    """
+    builder, reader = worker(tmp_path / 'grid'), worker(tmp_path / 'grid')
+    builder.build()
+    reader.ensure_loaded()
+    old_grid = reader._grid
+
+    builder.build()
+    reader.free_counts(date.today(), date.today())
+    assert reader._grid is not old_grid
+    assert reader._inode == builder._inode
+
+
+def test_first_loads_build_once(init_database, tmp_path, monkeypatch):
+    """
+    GIVEN several processes starting with no grid file
+    WHEN they load the grid one after the other
+    THEN check only the first one builds it and the others map its file
+    """
+    workers = [worker(tmp_path / 'grid') for _ in range(3)]
+    builds = []
+    build = OccupancyMap._build
+    monkeypatch.setattr(OccupancyMap, '_build', lambda self, first_day: (builds.append(self), build(self, first_day)))
+
+    for occupancy in workers:
+        occupancy.ensure_loaded()
+
+    assert builds == workers[:1]
+    assert all(occupancy.loaded and occupancy._inode == workers[0]._inode for occupancy in workers)
@@ -0,0 +1,125 @@
+"""
+This file (test_pricing.py) contains the unit tests for the storage pricing of pricing.py.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from project.pricing import MONTH_SEASONS, PricingEngine, PricingError
+
+TARIFFS = {
+    1: {'winter': 10, 'spring': 20, 'summer': 30, 'autumn': 40},
+    2: {'winter': 100, 'spring': 200, 'summer': 300, 'autumn': 400},
+}
+
+
+@pytest.fixture
+def engine():
+    engine = PricingEngine()
+    engine.configure(TARIFFS, first_day=date(2020, 1, 1), years=2)
+    return engine
+
+
+def day_by_day(size_id, start_date, stop_date):
+    cost, day = 0, start_date
+    while day <= stop_date:
+        cost += TARIFFS[size_id][MONTH_SEASONS[day.month]]
+        day += timedelta(days=1)
+    return cost
+
+
+@pytest.mark.parametrize('size_id, start_date, stop_date', [
+    (1, date(2020, 2, 28), date(2020, 3, 1)),   # winter into spring, over a leap day
+    (2, date(2020, 5, 31), date(2020, 6, 1)),   # spring into summer
+    (1, date(2020, 11, 30), date(2020, 12, 1)),  # autumn into winter
+    (2, date(2020, 12, 31), date(2021, 1, 1)),  # over the new year, within winter
+    (1, date(2020, 1, 1), date(2021, 12, 31)),  # the whole priced calendar
+])
+def test_quote_over_season_boundaries(engine, size_id, start_date, stop_date):
+    """
+    GIVEN a pricing engine with seasonal tariffs
+    WHEN an order over one or more season boundaries is quoted
+    THEN check every day is charged at the rate of its own season, both end days included
+    """
+    assert engine.quote(size_id, start_date, stop_date) == day_by_day(size_id, start_date, stop_date)
+
+
+def test_quote_single_day(engine):
+    """
+    GIVEN a pricing engine with seasonal tariffs
+    WHEN an order starting and stopping the same day is quoted
+    THEN check it costs the daily rate of that day's season
+    """
+    assert engine.quote(1, date(2020, 7, 15), date(2020, 7, 15)) == 30
+    assert engine.quote(2, date(2020, 3, 1), date(2020, 3, 1)) == 200
+
+
+def test_quote_many_matches_quote(engine):
+    """
+    GIVEN a pricing engine with seasonal tariffs
+    WHEN a batch of orders is quoted at once, from dates and from datetime64 arrays
+    THEN check every cost is the one of the order quoted alone
+    """
+    orders = [(1, date(2020, 2, 28), date(2020, 3, 1)), (2, date(2020, 7, 15), date(2020, 7, 15)),
+              (1, date(2020, 1, 1), date(2021, 12, 31)), (2, date(2021, 11, 1), date(2021, 12, 10))]
+    size_ids, starts, stops = zip(*orders)
+    expected = [engine.quote(*order) for order in orders]
+
+    assert engine.quote_many(size_ids, starts, stops).tolist() == expected
+    assert engine.quote_many(size_ids, np.array(starts, dtype='datetime64[D]'),
+                             np.array(stops, dtype='datetime64[D]')).tolist() == expected
+
+
+@pytest.mark.parametrize('size_ids', [[3], [1, 3]])
+def test_unknown_size_is_rejected(engine, size_ids):
+    """
+    GIVEN a pricing engine without a tariff for size 3
+    WHEN an order of size 3 is quoted, alone or in a batch
+    THEN check PricingError names the size
+    """
+    with pytest.raises(PricingError, match=r'\[3\]'):
+        engine.quote_many(size_ids, [date(2020, 1, 1)] * len(size_ids), [date(2020, 1, 2)] * len(size_ids))
+    with pytest.raises(PricingError, match=r'\[3\]'):
+        engine.quote(3, date(2020, 1, 1), date(2020, 1, 2))
+
+
+@pytest.mark.parametrize('start_date, stop_date', [
+    (date(2019, 12, 31), date(2020, 1, 2)),  # starts before the first day
+    (date(2021, 12, 30), date(2022, 1, 1)),  # stops after the last day
+    (date(2020, 3, 2), date(2020, 3, 1)),    # stops before it starts
+])
+def test_dates_outside_the_table_are_rejected(engine, start_date, stop_date):
+    """
+    GIVEN a pricing engine priced from 2020-01-01 to 2021-12-31
+    WHEN an order outside of these days, or stopping before it starts, is quoted
+    THEN check PricingError is raised by quote and by quote_many
+    """
+    with pytest.raises(PricingError):
+        engine.quote(1, start_date, stop_date)
+    with pytest.raises(PricingError):
+        engine.quote_many([1], [start_date], [stop_date])
+
+
+def test_unconfigured_engine_quotes_nothing():
+    """
+    GIVEN a pricing engine without PRICING_TARIFFS
+    WHEN an order is quoted
+    THEN check the engine says it isn't configured and PricingError is raised
+    """
+    engine = PricingEngine()
+    assert not engine.configured
+    with pytest.raises(PricingError):
+        engine.quote(1, date(2020, 1, 1), date(2020, 1, 2))
+    with pytest.raises(PricingError):
+        engine.quote_many([1], [date(2020, 1, 1)], [date(2020, 1, 2)])
+
+
+def test_tariff_missing_a_season_is_rejected():
+    """
+    GIVEN a tariff without an autumn rate
+    WHEN the pricing engine is configured with it
+    THEN check PricingError is raised
+    """
+    with pytest.raises(PricingError, match='autumn'):
+        PricingEngine().configure({1: {'winter': 1, 'spring': 1, 'summer': 1}})
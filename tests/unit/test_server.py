@@ -0,0 +1,100 @@
+"""
+This file (test_server.py) contains the unit tests for the worker sizing and the reload steps of server.py.
+"""
+import signal
+
+from project.server import Master, Plan, background_threads, plan_workers
+
+
+def test_workers_follow_cpus_without_db_limit():
+    """
+    GIVEN a config without a worker count and an unknown DB connection budget
+    WHEN the workers are planned on 4 CPUs
+    THEN check there is one worker per CPU and a pool slot per thread
+    """
+    config = {'SERVER_THREADS': 8}
+    plan = plan_workers(config, cpus=4)
+    assert plan.workers == 4
+    assert plan.threads == 8
+    assert plan.pool_size == 8 + background_threads(config)
+
+
+def test_workers_capped_by_db_connections():
+    """
+    GIVEN a primary accepting 40 connections and pools of 11 connections
+    WHEN the workers are planned on 8 CPUs
+    THEN check the pools of all the workers and of a reload batch fit in the 40 connections
+    """
+    config = {'SERVER_THREADS': 8, 'MAIL_OUTBOX_WORKERS': 1}
+    plan = plan_workers(config, cpus=8, budget=40)
+    assert plan.workers == 2
+    assert (plan.workers + 1) * plan.pool_size <= 40
+    assert plan.hashing_workers == 4
+
+
+def test_threads_reduced_when_one_worker_does_not_fit():
+    """
+    GIVEN a primary accepting fewer connections than one worker needs
+    WHEN the workers are planned
+    THEN check one worker is started with fewer threads
+    """
+    plan = plan_workers({'SERVER_THREADS': 8, 'SERVER_RELOAD_BATCH': 0}, cpus=2, budget=6)
+    assert plan.workers == 1
+    assert plan.pool_size <= 6
+
+
+def test_reload_replaces_workers_one_batch_at_a_time(monkeypatch):
+    """
+    GIVEN a master reloaded from one that ran 2 workers, with a reload batch of 1
+    WHEN it goes through the reload
+    THEN check there are never more than 3 workers, and the old ones are stopped one at a time
+    """
+    master = Master('flask.cfg', {}, Plan(2, 8, 11, 1), 'localhost', None, 30, retiring={101: 0, 102: 1})
+    new_pids = iter(range(201, 210))
+    killed = []
+    monkeypatch.setattr(master, 'spawn', lambda: master.workers.update({next(new_pids): [0, None]}))
+    monkeypatch.setattr(master, '_kill', lambda pids, signum: killed.extend(pids))
+
+    def step(ready=True, exited=()):
+        for info in master.workers.values():
+            info[1] = 0.1 if ready else info[1]
+        master.retiring.difference_update(exited)
+        master._roll()
+        assert len(master.workers) + len(master.retiring) <= 3
+
+    step()
+    assert list(master.workers) == [201] and killed == []
+    step()
+    assert killed == [101]
+    step()
+    assert list(master.workers) == [201] and killed == [101]
+    step(exited=[101])
+    assert list(master.workers) == [201, 202]
+    step()
+    assert killed == [101, 102]
+    step(exited=[102])
+    assert list(master.workers) == [201, 202] and not master.retiring
+
+
+def test_reload_kills_previous_workers_stuck_after_the_graceful_timeout(monkeypatch):
+    """
+    GIVEN a reload whose new worker is ready, with a graceful timeout of 0
+    WHEN the previous worker told to stop is still running at the next steps
+    THEN check it is killed once, and the reload goes on when it is gone
+    """
+    master = Master('flask.cfg', {}, Plan(1, 8, 11, 1), 'localhost', None, 0, retiring={101: 0})
+    monkeypatch.setattr('project.server.STOP_MARGIN', 0)
+    master.workers[201] = [0, 0.1]
+    signals = []
+    monkeypatch.setattr(master, '_kill', lambda pids, signum: signals.extend((pid, signum) for pid in pids))
+
+    master._roll()
+    assert signals == [(101, signal.SIGTERM)]
+    master._roll()
+    master._roll()
+    assert signals == [(101, signal.SIGTERM), (101, signal.SIGKILL)]
+
+    master.retiring.discard(101)
+    master._draining.pop(101)
+    master._roll()
+    assert not master._draining and list(master.workers) == [201]
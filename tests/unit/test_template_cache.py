@@ -0,0 +1,19 @@
+"""
+This file (test_template_cache.py) contains the unit tests for the template precompilation of template_cache.py.
+"""
+from project.template_cache import precompile_templates
+
+
+def test_every_live_template_compiles(flask_app):
+    """
+    GIVEN the application with its templates and the old pages of templates/backup
+    WHEN the templates are precompiled
+    THEN check all of them compile and the old pages are left out
+    """
+    templates = flask_app.jinja_env.list_templates(filter_func=lambda name: name.endswith(('.html', '.txt')))
+    backup = [name for name in templates if name.startswith('backup/')]
+    assert backup and 'title.html' in templates
+
+    result = precompile_templates(flask_app)
+    assert result['failed'] == []
+    assert result['templates'] == len(templates) - len(backup)